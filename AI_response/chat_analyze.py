@@ -1,19 +1,23 @@
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
 from image_recognition.structured_ocr import detect_chat_structure
+from AI_response.gemini_client import generate, generate_async
+from common import metrics
+from common.singleflight import singleflight, async_singleflight, digest
 
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise RuntimeError("環境變數 GEMINI_API_KEY 尚未設定")
+@singleflight(lambda text: digest(text))
+def analyze_message(text):
+    message = generate(analysis_prompt(text), call_site="analyze_message")
+    return message
 
-genai.configure(api_key=api_key)
 
-model = genai.GenerativeModel("gemini-2.5-flash")
+@async_singleflight(lambda text: digest(text))
+async def analyze_message_async(text):
+    """analyze_message 的 asyncio 版本"""
+    return await generate_async(analysis_prompt(text), call_site="analyze_message")
 
-def analyze_message(text):
-    prompt = f"""你是一位專業的對話分析師與伴侶諮商師。
+
+def analysis_prompt(text):
+    return f"""你是一位專業的對話分析師與伴侶諮商師。
     請按照以下格式回覆（去除所有Markdown語法）：
     一、語氣 (Tone)
     - 列出對話中觀察到的語氣特點
@@ -37,8 +41,9 @@ def analyze_message(text):
     請分析以下聊天記錄：
     {text}
     """
-    message = model.generate_content(prompt)
-    return message
+
+
+@metrics.track("convert_dialogue")
 def convert_dialogue(json_list):
     """
     將格式:
@@ -0,0 +1,245 @@
+"""
+所有 Gemini 呼叫共用的用戶端。
+
+- GenerativeModel 依模型名稱快取；每次呼叫有總期限，429 / 5xx / 逾時以 jitter 指數退避重試
+- 每次請求（含重試）前向 quota 取得配額，多使用者公平分享同一把 API key
+- token 用量記入指標與 usage 帳本；整個呼叫記在處理階段與 trace span gemini:<call_site>
+- generate_async：asyncio 版本，等待期間不佔執行緒
+- GEMINI_ENDPOINT：改連本機替身（LineBot/google_standin.py）
+
+指標：gemini_call_seconds{call_site, model}（單次請求）、gemini_calls_total{call_site, model, status}、
+      gemini_tokens_total{call_site, model, kind}
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import google.generativeai as genai
+from google.generativeai import protos
+from google.generativeai.types import content_types
+from google.api_core import exceptions as gexc
+from dotenv import load_dotenv
+
+from common import google_rest, metrics, tracing
+from AI_response import quota, usage
+
+load_dotenv()
+
+ENDPOINT = os.getenv("GEMINI_ENDPOINT") or None   # 例如 http://127.0.0.1:8791
+DEFAULT_MODEL = "gemini-2.5-flash"
+DEFAULT_EMBED_MODEL = "text-embedding-004"
+DEFAULT_DEADLINE = 60     # 每次呼叫（含重試）最多幾秒
+MAX_RETRIES = 3           # 第一次之外最多重試幾次
+BACKOFF_BASE = 1.0        # 第一次重試前等待的秒數上限
+BACKOFF_MAX = 20.0
+
+RETRYABLE = (
+    gexc.TooManyRequests,
+    gexc.ResourceExhausted,
+    gexc.ServiceUnavailable,
+    gexc.InternalServerError,
+    gexc.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+
+LATENCY = metrics.histogram("gemini_call_seconds", "Gemini 單次請求延遲", ["call_site", "model"])
+CALLS = metrics.counter("gemini_calls_total", "Gemini 請求次數（含重試）", ["call_site", "model", "status"])
+TOKENS = metrics.counter("gemini_tokens_total", "Gemini token 用量", ["call_site", "model", "kind"])
+
+_configured = False
+_models = {}
+_lock = threading.Lock()
+
+
+def _configure():
+    global _configured
+    if not _configured:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if ENDPOINT:
+            genai.configure(api_key=api_key or "standin", transport="rest",
+                            client_options={"api_endpoint": ENDPOINT})
+        elif not api_key:
+            raise RuntimeError("環境變數 GEMINI_API_KEY 尚未設定")
+        else:
+            genai.configure(api_key=api_key)
+        _configured = True
+
+
+def get_model(name: str = DEFAULT_MODEL) -> genai.GenerativeModel:
+    """回傳快取的 GenerativeModel，不必每次呼叫都重新建立"""
+    with _lock:
+        _configure()
+        model = _models.get(name)
+        if model is None:
+            model = genai.GenerativeModel(name)
+            _models[name] = model
+        return model
+
+
+def backoff_delay(attempt: int) -> float:
+    """full jitter 指數退避：0 ~ min(BACKOFF_MAX, BACKOFF_BASE * 2^attempt)"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def record_usage(response, call_site: str, model: str) -> dict:
+    """記錄 token 用量（指標 + usage 帳本，使用者取自 quota.current_user()），回傳 {kind: 數量}"""
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return {}
+    counts = {}
+    for kind, field in (("prompt", "prompt_token_count"),
+                        ("cached", "cached_content_token_count"),
+                        ("output", "candidates_token_count"),
+                        ("thoughts", "thoughts_token_count")):
+        count = getattr(metadata, field, 0) or 0
+        if count:
+            TOKENS.inc(count, call_site=call_site, model=model, kind=kind)
+            counts[kind] = count
+    usage.get_ledger().record(call_site, model, counts)
+    return counts
+
+
+def _call_with_retries(fn, call_site, model, deadline, max_retries):
+    end = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{call_site}：超過 {deadline} 秒期限")
+        scheduler = quota.get_scheduler()
+        if scheduler is not None:
+            scheduler.acquire(timeout=remaining)
+            remaining = end - time.monotonic()
+        start = time.monotonic()
+        tracing.set_attributes(attempts=attempt + 1)
+        try:
+            result = fn(remaining)
+        except RETRYABLE as e:
+            LATENCY.observe(time.monotonic() - start, call_site=call_site, model=model)
+            CALLS.inc(call_site=call_site, model=model, status="retryable_error")
+            if attempt >= max_retries:
+                raise
+            delay = min(backoff_delay(attempt), max(0.0, end - time.monotonic()))
+            print(f"⚠️ {call_site} 呼叫失敗：{e}（{delay:.1f} 秒後重試 {attempt+1}/{max_retries}）")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            LATENCY.observe(time.monotonic() - start, call_site=call_site, model=model)
+            CALLS.inc(call_site=call_site, model=model, status="error")
+            raise
+        LATENCY.observe(time.monotonic() - start, call_site=call_site, model=model)
+        CALLS.inc(call_site=call_site, model=model, status="ok")
+        return result
+
+
+async def _call_with_retries_async(fn, call_site, model, deadline, max_retries):
+    """_call_with_retries 的 asyncio 版本：fn(remaining) 回傳 awaitable"""
+    end = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{call_site}：超過 {deadline} 秒期限")
+        scheduler = quota.get_scheduler()
+        if scheduler is not None:
+            await scheduler.acquire_async(timeout=remaining)
+            remaining = end - time.monotonic()
+        start = time.monotonic()
+        tracing.set_attributes(attempts=attempt + 1)
+        try:
+            result = await asyncio.wait_for(fn(remaining), timeout=remaining)
+        except (*RETRYABLE, asyncio.TimeoutError) as e:
+            LATENCY.observe(time.monotonic() - start, call_site=call_site, model=model)
+            CALLS.inc(call_site=call_site, model=model, status="retryable_error")
+            if attempt >= max_retries:
+                raise
+            delay = min(backoff_delay(attempt), max(0.0, end - time.monotonic()))
+            print(f"⚠️ {call_site} 呼叫失敗：{e}（{delay:.1f} 秒後重試 {attempt+1}/{max_retries}）")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            LATENCY.observe(time.monotonic() - start, call_site=call_site, model=model)
+            CALLS.inc(call_site=call_site, model=model, status="error")
+            raise
+        LATENCY.observe(time.monotonic() - start, call_site=call_site, model=model)
+        CALLS.inc(call_site=call_site, model=model, status="ok")
+        return result
+
+
+def generate(prompt, call_site: str, model: str = DEFAULT_MODEL,
+             deadline: float = DEFAULT_DEADLINE, max_retries: int = MAX_RETRIES, **kwargs):
+    """
+    呼叫 generate_content，回傳原本的 response 物件（呼叫端照舊使用 response.text）。
+
+    Args:
+        prompt: 傳給模型的內容
+        call_site (str): 呼叫點名稱，用於統計延遲與 token
+        model (str): 模型名稱
+        deadline (float): 含重試的總期限（秒）
+        max_retries (int): 可重試錯誤的最多重試次數
+    """
+    handle = get_model(model)
+
+    def attempt(remaining):
+        return handle.generate_content(prompt, request_options={"timeout": remaining}, **kwargs)
+
+    with tracing.span(f"gemini:{call_site}", model=model, prompt_chars=len(str(prompt))) as span, \
+            metrics.track(f"gemini:{call_site}"):
+        response = _call_with_retries(attempt, call_site, model, deadline, max_retries)
+        _trace_usage(span, response, record_usage(response, call_site, model))
+    return response
+
+
+async def generate_async(prompt, call_site: str, model: str = DEFAULT_MODEL,
+                         deadline: float = DEFAULT_DEADLINE, max_retries: int = MAX_RETRIES, **kwargs):
+    """generate 的 asyncio 版本，參數與回傳值相同"""
+    handle = get_model(model)
+
+    def attempt(remaining):
+        if ENDPOINT:
+            return _generate_standin_async(prompt, model)
+        return handle.generate_content_async(prompt, request_options={"timeout": remaining}, **kwargs)
+
+    async with tracing.span(f"gemini:{call_site}", model=model, prompt_chars=len(str(prompt))) as span, \
+            metrics.track(f"gemini:{call_site}"):
+        response = await _call_with_retries_async(attempt, call_site, model, deadline, max_retries)
+        _trace_usage(span, response, record_usage(response, call_site, model))
+    return response
+
+
+async def _generate_standin_async(prompt, model):
+    """連到替身的 generate_content_async（只送 prompt；generation_config 等參數替身不使用）"""
+    request = protos.GenerateContentRequest(model=f"models/{model}", contents=content_types.to_contents(prompt))
+    text = await google_rest.post_json(f"{ENDPOINT}/v1beta/models/{model}:generateContent",
+                                       protos.GenerateContentRequest.to_json(request))
+    return genai.types.AsyncGenerateContentResponse.from_response(
+        protos.GenerateContentResponse.from_json(text, ignore_unknown_fields=True)
+    )
+
+
+def _trace_usage(span, response, counts):
+    span.set(prompt_tokens=counts.get("prompt", 0), cached_tokens=counts.get("cached", 0),
+             output_tokens=counts.get("output", 0), thoughts_tokens=counts.get("thoughts", 0))
+    try:
+        span.set(output_chars=len(response.text))
+    except Exception:
+        pass   # 被安全過濾等沒有文字的回應
+
+
+def embed(content, call_site: str, model: str = DEFAULT_EMBED_MODEL,
+          deadline: float = DEFAULT_DEADLINE, max_retries: int = MAX_RETRIES):
+    """呼叫 embed_content，回傳 embedding 向量（list）"""
+    with _lock:
+        _configure()
+
+    def attempt(remaining):
+        return genai.embed_content(model=model, content=content, request_options={"timeout": remaining})
+
+    with tracing.span(f"gemini:{call_site}", model=model, content_chars=len(str(content))), \
+            metrics.track(f"gemini:{call_site}"):
+        return _call_with_retries(attempt, call_site, model, deadline, max_retries)["embedding"]
@@ -0,0 +1,243 @@
+"""
+所有 Gemini 呼叫前的公平配額排程器。
+
+- 全域 token bucket（每分鐘 GEMINI_RPM 次、最多累積 GEMINI_BURST 次）存在本機 SQLite，
+  同一台機器上的所有 Gunicorn worker 共用同一個配額。
+- 等待中的請求以 weighted fair queuing 排序：每個使用者的請求依序拿到
+  finish tag = max(全域虛擬時間, 該使用者上一個 tag) + cost / weight，
+  tag 最小的先拿 token。一次丟 20 張截圖的使用者只會排在自己的請求後面，
+  不會把其他人卡住。
+- 排隊時間記錄在 gemini_quota_wait_seconds{kind} 指標（kind 為 system / user，使用者 ID 不放進標籤）；
+  每個使用者的排隊時間記在同一個 SQLite 的 waits 表，由 wait_report()（GET /admin/quota）查詢。
+
+呼叫端不必傳 user：app.py 處理請求時以 user_context(user_id) 設定目前使用者，
+沒有設定時歸到 "system"（例如離線標註腳本）。
+asyncio 程式使用 acquire_async：等待時不佔執行緒，只有短暫的 SQLite 交易丟到 thread pool。
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from common import metrics
+
+DB_PATH = os.getenv("GEMINI_QUOTA_DB", os.path.join(tempfile.gettempdir(), "gemini_quota.sqlite"))
+RPM = float(os.getenv("GEMINI_RPM", "60"))          # 每分鐘可用的請求數；設為 0 停用排程
+BURST = float(os.getenv("GEMINI_BURST", "5"))       # bucket 容量
+POLL_SECONDS = 0.05
+STALE_SECONDS = 10       # 超過這麼久沒有更新的等待者（行程已結束）會被清掉
+DEFAULT_TIMEOUT = 120
+WAIT_RETENTION = 86400   # 排隊時間明細保留秒數
+WAIT_WINDOW = 3600
+PURGE_INTERVAL = 3600
+
+USER_WEIGHTS = {"system": 0.5}   # 預設權重 1；離線工作讓給線上使用者
+
+_current_user = contextvars.ContextVar("gemini_quota_user", default="system")
+
+WAIT = metrics.histogram(
+    "gemini_quota_wait_seconds", "Gemini 配額排隊時間", ["kind"],
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+QUEUED = metrics.gauge("gemini_quota_waiting", "本行程中等待配額的請求數", ["kind"])
+
+
+class QuotaTimeout(TimeoutError):
+    pass
+
+
+def current_user() -> str:
+    return _current_user.get()
+
+
+def kind_of(user) -> str:
+    """指標標籤用：USER_WEIGHTS 裡的固定身分（例如 system）照原樣，其餘使用者一律歸為 user"""
+    return user if user in USER_WEIGHTS else "user"
+
+
+@contextlib.contextmanager
+def user_context(user_id):
+    """在這個區塊內的 Gemini 呼叫都算在 user_id 的配額"""
+    token = _current_user.set(user_id or "system")
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+class QuotaScheduler:
+    def __init__(self, path=DB_PATH, rpm=RPM, burst=BURST):
+        self.path = path
+        self.rate = rpm / 60.0
+        self.burst = burst
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS bucket "
+                         "(id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL, updated REAL, vtime REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS users (user TEXT PRIMARY KEY, finish REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS waiters "
+                         "(id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT, tag REAL, cost REAL, seen REAL,"
+                         " enqueued REAL)")
+            if "enqueued" not in [row[1] for row in conn.execute("PRAGMA table_info(waiters)")]:
+                conn.execute("ALTER TABLE waiters ADD COLUMN enqueued REAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS waits (ts REAL, user TEXT, seconds REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS waits_ts ON waits (ts)")
+            conn.execute("INSERT OR IGNORE INTO bucket VALUES (1, ?, ?, 0)", (burst, time.time()))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return contextlib.closing(conn)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _enqueue(self, user, weight, cost):
+        now = time.time()
+        with self._transaction() as conn:
+            (vtime,) = conn.execute("SELECT vtime FROM bucket WHERE id = 1").fetchone()
+            row = conn.execute("SELECT finish FROM users WHERE user = ?", (user,)).fetchone()
+            tag = max(vtime, row[0] if row else 0) + cost / weight
+            conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?)", (user, tag))
+            cur = conn.execute("INSERT INTO waiters (user, tag, cost, seen, enqueued) VALUES (?, ?, ?, ?, ?)",
+                               (user, tag, cost, now, now))
+            return cur.lastrowid
+
+    def _try_take(self, waiter_id, cost):
+        """輪到自己且 bucket 有 token 時取走並回傳 0，否則回傳建議的等待秒數"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE waiters SET seen = ? WHERE id = ?", (now, waiter_id))
+            conn.execute("DELETE FROM waiters WHERE seen < ?", (now - STALE_SECONDS,))
+            tokens, updated = conn.execute("SELECT tokens, updated FROM bucket WHERE id = 1").fetchone()
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE id = 1", (tokens, now))
+
+            head = conn.execute("SELECT id, tag FROM waiters ORDER BY tag, id LIMIT 1").fetchone()
+            if head is None or head[0] != waiter_id:
+                return POLL_SECONDS
+            if tokens < cost:
+                return min(1.0, max(POLL_SECONDS, (cost - tokens) / self.rate))
+
+            conn.execute("UPDATE bucket SET tokens = ?, vtime = ? WHERE id = 1", (tokens - cost, head[1]))
+            conn.execute("INSERT INTO waits SELECT ?, user, ? - COALESCE(enqueued, seen) FROM waiters WHERE id = ?",
+                         (now, now, waiter_id))
+            conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+            if now - self._last_purge >= PURGE_INTERVAL:
+                conn.execute("DELETE FROM waits WHERE ts < ?", (now - WAIT_RETENTION,))
+                self._last_purge = now
+            return 0
+
+    def _cancel(self, waiter_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def acquire(self, user=None, cost=1.0, timeout=DEFAULT_TIMEOUT):
+        """
+        等到 user 可以送出一個請求為止，回傳排隊秒數。
+
+        Args:
+            user (str): 使用者 ID，預設為目前 user_context 的使用者
+            cost (float): 這個請求消耗的 token 數
+            timeout (float): 最多等待秒數，超過時丟出 QuotaTimeout
+        """
+        user = user or current_user()
+        weight = USER_WEIGHTS.get(user, 1.0)
+        start = time.monotonic()
+        waiter_id = self._enqueue(user, weight, cost)
+        granted = False
+        kind = kind_of(user)
+        QUEUED.inc(kind=kind)
+        try:
+            while True:
+                delay = self._try_take(waiter_id, cost)
+                if delay == 0:
+                    granted = True
+                    waited = time.monotonic() - start
+                    WAIT.observe(waited, kind=kind)
+                    return waited
+                if time.monotonic() - start + delay > timeout:
+                    raise QuotaTimeout(f"使用者 {user} 等待 Gemini 配額超過 {timeout} 秒")
+                time.sleep(delay)
+        finally:
+            QUEUED.dec(kind=kind)
+            if not granted:
+                self._cancel(waiter_id)
+
+    async def acquire_async(self, user=None, cost=1.0, timeout=DEFAULT_TIMEOUT):
+        """acquire 的 asyncio 版本，參數與回傳值相同"""
+        user = user or current_user()
+        weight = USER_WEIGHTS.get(user, 1.0)
+        start = time.monotonic()
+        waiter_id = await asyncio.to_thread(self._enqueue, user, weight, cost)
+        granted = False
+        kind = kind_of(user)
+        QUEUED.inc(kind=kind)
+        try:
+            while True:
+                delay = await asyncio.to_thread(self._try_take, waiter_id, cost)
+                if delay == 0:
+                    granted = True
+                    waited = time.monotonic() - start
+                    WAIT.observe(waited, kind=kind)
+                    return waited
+                if time.monotonic() - start + delay > timeout:
+                    raise QuotaTimeout(f"使用者 {user} 等待 Gemini 配額超過 {timeout} 秒")
+                await asyncio.sleep(delay)
+        finally:
+            QUEUED.dec(kind=kind)
+            if not granted:
+                # 被取消時也要移除等待紀錄，否則會擋住後面的人直到 STALE_SECONDS
+                await asyncio.shield(asyncio.to_thread(self._cancel, waiter_id))
+
+    def wait_report(self, window: float = WAIT_WINDOW, limit: int = 100) -> dict:
+        """
+        管理端點用：最近 window 秒各使用者的排隊時間（依總等待秒數由高到低），以及目前排隊中的請求。
+        所有行程共用同一個 SQLite，結果包含每個 web / worker 行程。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT user, COUNT(*), AVG(seconds), MAX(seconds) FROM waits WHERE ts >= ?"
+                " GROUP BY user ORDER BY SUM(seconds) DESC LIMIT ?",
+                (now - window, limit),
+            ).fetchall()
+            waiting = conn.execute(
+                "SELECT user, COUNT(*), MIN(COALESCE(enqueued, seen)) FROM waiters WHERE seen >= ?"
+                " GROUP BY user ORDER BY MIN(COALESCE(enqueued, seen)) LIMIT ?",
+                (now - STALE_SECONDS, limit),
+            ).fetchall()
+        return {
+            "window_seconds": window,
+            "users": [{"user": user, "requests": n, "avg_wait_seconds": round(avg, 3),
+                       "max_wait_seconds": round(longest, 3)} for user, n, avg, longest in rows],
+            "waiting": [{"user": user, "requests": n, "waiting_seconds": round(now - since, 3)}
+                        for user, n, since in waiting],
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """回傳共用的排程器；GEMINI_RPM 設為 0 時回傳 None（不限流）"""
+    global _scheduler
+    if RPM <= 0:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = QuotaScheduler()
+        return _scheduler
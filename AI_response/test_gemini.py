@@ -1,15 +1,11 @@
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
+import sys
 
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise RuntimeError("環境變數 GEMINI_API_KEY 尚未設定")
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
 
-genai.configure(api_key=api_key)
+from AI_response.gemini_client import generate
 
-model = genai.GenerativeModel("gemini-2.5-flash")
 print("Current working directory:", os.getcwd())
-response = model.generate_content("Hello Gemini, respond 'OK'.")
+response = generate("Hello Gemini, respond 'OK'.", call_site="test_gemini")
 print(response.text)
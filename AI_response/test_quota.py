@@ -0,0 +1,110 @@
+"""quota：token bucket 的速率與容量、依使用者公平排序、逾時與取消時移除等待紀錄、排隊時間的記錄"""
+import asyncio
+import time
+
+import pytest
+
+from AI_response.quota import POLL_SECONDS, QUEUED, WAIT, QuotaScheduler, QuotaTimeout, user_context
+
+
+@pytest.fixture
+def make(tmp_path):
+    return lambda rpm, burst: QuotaScheduler(str(tmp_path / "quota.sqlite"), rpm=rpm, burst=burst)
+
+
+def waiters(scheduler):
+    with scheduler._connect() as conn:
+        return conn.execute("SELECT user FROM waiters ORDER BY id").fetchall()
+
+
+def test_burst_is_immediate_then_limited_by_rate(make):
+    scheduler = make(rpm=600, burst=2)   # 每秒 10 個
+    assert scheduler.acquire("u1") < POLL_SECONDS
+    assert scheduler.acquire("u1") < POLL_SECONDS
+    start = time.monotonic()
+    scheduler.acquire("u1")
+    assert 0.05 <= time.monotonic() - start < 0.5
+
+
+def test_heavy_user_does_not_block_others(make):
+    scheduler = make(rpm=600, burst=10)
+    heavy = [scheduler._enqueue("heavy", 1.0, 1.0) for _ in range(3)]
+    light = scheduler._enqueue("light", 1.0, 1.0)
+
+    assert scheduler._try_take(heavy[1], 1.0) == POLL_SECONDS   # 還沒輪到
+    assert scheduler._try_take(heavy[0], 1.0) == 0
+    assert scheduler._try_take(heavy[1], 1.0) == POLL_SECONDS   # 後到的 light 排在 heavy 的第二個請求前
+    assert scheduler._try_take(light, 1.0) == 0
+    assert scheduler._try_take(heavy[1], 1.0) == 0
+    assert scheduler._try_take(heavy[2], 1.0) == 0
+
+
+def test_system_gets_half_the_share(make):
+    scheduler = make(rpm=600, burst=10)
+    system = [scheduler._enqueue("system", 0.5, 1.0) for _ in range(2)]
+    users = [scheduler._enqueue("U1", 1.0, 1.0) for _ in range(2)]
+    order = []
+    pending = dict(zip(system + users, ["system", "system", "U1", "U1"]))
+    while pending:
+        for waiter_id in sorted(pending):
+            if scheduler._try_take(waiter_id, 1.0) == 0:
+                order.append(pending.pop(waiter_id))
+                break
+    assert order == ["U1", "system", "U1", "system"]   # system 的每個請求算兩倍
+
+
+def test_timeout_removes_the_waiter(make):
+    scheduler = make(rpm=6, burst=1)   # 每 10 秒 1 個
+    scheduler.acquire("u1")
+    with pytest.raises(QuotaTimeout):
+        scheduler.acquire("u1", timeout=0.2)
+    assert waiters(scheduler) == []
+
+
+def test_user_context_sets_the_default_user(make):
+    scheduler = make(rpm=600, burst=2)
+    with user_context("U42"):
+        scheduler.acquire()
+    with scheduler._connect() as conn:
+        assert [user for (user,) in conn.execute("SELECT user FROM users")] == ["U42"]
+
+
+def test_cancelled_async_waiter_is_removed(make):
+    scheduler = make(rpm=6, burst=1)
+    scheduler.acquire("u1")
+
+    async def main():
+        task = asyncio.create_task(scheduler.acquire_async("u2"))
+        await asyncio.sleep(0.2)
+        assert waiters(scheduler) == [("u2",)]
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert waiters(scheduler) == []
+
+
+def test_metrics_do_not_label_by_user(make):
+    scheduler = make(rpm=600, burst=5)
+    scheduler.acquire("U-metrics-1")
+    scheduler.acquire("U-metrics-2")
+    scheduler.acquire("system")
+    assert set(WAIT.samples()) <= {("user",), ("system",)}
+    assert set(QUEUED.samples()) <= {("user",), ("system",)}
+
+
+def test_wait_report_lists_each_users_waits(make):
+    scheduler = make(rpm=600, burst=1)
+    scheduler.acquire("U1")
+    scheduler.acquire("U2")   # bucket 空了，約等 0.1 秒
+    waiting = scheduler._enqueue("U3", 1.0, 1.0)
+
+    report = scheduler.wait_report(window=60)
+    users = {row["user"]: row for row in report["users"]}
+    assert set(users) == {"U1", "U2"}
+    assert users["U1"]["requests"] == 1
+    assert users["U2"]["max_wait_seconds"] >= 0.05
+    assert report["users"][0]["user"] == "U2"   # 等最久的排前面
+    assert [row["user"] for row in report["waiting"]] == ["U3"]
+    scheduler._cancel(waiting)
@@ -0,0 +1,199 @@
+"""
+Gemini token 用量與費用帳本：依呼叫點、模型、使用者統計，判斷哪個 prompt 最花錢、最佳化省了多少。
+
+- 每次呼叫的 prompt / cached / output / thoughts token 數由 gemini_client.record_usage 記入
+- 明細寫到本機 SQLite（GEMINI_USAGE_DB），同一台機器上的 web、worker 行程共用，可依時間範圍查詢；
+  寫入由背景執行緒批次進行，不拖慢呼叫端（包含 asyncio 版本）
+- 費用依 PRICES（每百萬 token 美元）計算，可用 GEMINI_PRICES（JSON）覆寫
+- 指標：gemini_cost_usd_total{call_site, model}（行程內累計）；
+  gemini_usage_window_tokens{call_site, model, kind} / gemini_usage_window_cost_usd{call_site, model}
+  為帳本中最近 USAGE_WINDOW 秒的合計（跨行程），於 /metrics 抓取時更新
+  使用者不放進指標標籤（數量無上限），依使用者的統計請用 summary(by=("user",))
+
+注意：Gemini 回傳的 prompt_token_count 已包含 cached_content_token_count；
+thinking 模型的 thoughts_token_count 以輸出價格計費。
+"""
+import atexit
+import contextlib
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+from common import metrics
+from AI_response import quota
+
+DB_PATH = os.getenv("GEMINI_USAGE_DB", os.path.join(tempfile.gettempdir(), "gemini_usage.sqlite"))
+RETENTION = int(os.getenv("GEMINI_USAGE_RETENTION", str(7 * 86400)))   # 明細保留秒數
+USAGE_WINDOW = int(os.getenv("GEMINI_USAGE_WINDOW", "3600"))           # 指標上的滾動視窗
+FLUSH_INTERVAL = 1.0
+PURGE_INTERVAL = 3600
+KINDS = ("prompt", "cached", "output", "thoughts")
+GROUP_COLUMNS = ("call_site", "model", "user")
+
+# 每百萬 token 的美元價格（prompt 為未命中快取的部分）
+PRICES = {
+    "gemini-2.5-flash": {"prompt": 0.30, "cached": 0.075, "output": 2.50},
+    "gemini-2.5-pro": {"prompt": 1.25, "cached": 0.31, "output": 10.00},
+    "gemini-2.0-flash": {"prompt": 0.10, "cached": 0.025, "output": 0.40},
+}
+PRICES.update(json.loads(os.getenv("GEMINI_PRICES", "{}")))
+
+COST = metrics.counter("gemini_cost_usd_total", "Gemini 估計費用（美元）", ["call_site", "model"])
+WINDOW_TOKENS = metrics.gauge("gemini_usage_window_tokens", "最近 USAGE_WINDOW 秒的 token 用量（所有行程）",
+                              ["call_site", "model", "kind"])
+WINDOW_COST = metrics.gauge("gemini_usage_window_cost_usd", "最近 USAGE_WINDOW 秒的估計費用（所有行程）",
+                            ["call_site", "model"])
+
+
+def cost_usd(model: str, counts: dict) -> float:
+    """依 token 數估計費用；未知模型回傳 0"""
+    price = PRICES.get(model)
+    if price is None:
+        return 0.0
+    cached = counts.get("cached", 0)
+    uncached = max(0, counts.get("prompt", 0) - cached)
+    output = counts.get("output", 0) + counts.get("thoughts", 0)
+    return (uncached * price["prompt"] + cached * price["cached"] + output * price["output"]) / 1e6
+
+
+class UsageLedger:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS usage (ts REAL, user TEXT, call_site TEXT, model TEXT, "
+                         "prompt INTEGER, cached INTEGER, output INTEGER, thoughts INTEGER, cost REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def record(self, call_site, model, counts, user=None):
+        """記錄一次呼叫（非阻塞）；回傳估計費用"""
+        cost = cost_usd(model, counts)
+        COST.inc(cost, call_site=call_site, model=model)
+        row = (time.time(), user or quota.current_user(), call_site, model,
+               *(counts.get(kind, 0) for kind in KINDS), cost)
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            print("⚠️ 用量帳本佇列已滿，略過一筆紀錄")
+        return cost
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ 用量帳本寫入失敗：{e}")
+
+    def flush(self):
+        """把佇列中的紀錄寫入 SQLite，順便清除過期明細"""
+        rows = []
+        try:
+            while True:
+                rows.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        now = time.time()
+        if not rows and now - self._last_purge < PURGE_INTERVAL:
+            return
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                if now - self._last_purge >= PURGE_INTERVAL:
+                    conn.execute("DELETE FROM usage WHERE ts < ?", (now - RETENTION,))
+                    self._last_purge = now
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def summary(self, window: float = USAGE_WINDOW, by=("call_site", "model"), limit: int = 100):
+        """
+        最近 window 秒的用量合計，依費用由高到低排序。
+
+        Args:
+            window (float): 時間範圍（秒）
+            by (tuple): 分組欄位，可用 call_site / model / user 的任意組合；空的表示全部合計
+            limit (int): 最多回傳幾組
+        """
+        columns = [c for c in by if c in GROUP_COLUMNS]
+        select = "".join(f"{c}, " for c in columns)
+        group = f"GROUP BY {', '.join(columns)}" if columns else ""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {select}COUNT(*), SUM(prompt), SUM(cached), SUM(output), "
+                f"SUM(thoughts), SUM(cost) FROM usage WHERE ts >= ? {group} "
+                f"ORDER BY SUM(cost) DESC, SUM(prompt) DESC LIMIT ?",
+                (time.time() - window, limit),
+            ).fetchall()
+        result = []
+        for row in rows:
+            entry = dict(zip(columns, row))
+            if not row[len(columns)]:
+                continue   # 沒有分組時，視窗內沒有紀錄也會有一列 COUNT(*) = 0
+            calls, prompt, cached, output, thoughts, cost = row[len(columns):]
+            entry.update(calls=calls, prompt_tokens=prompt, cached_tokens=cached, output_tokens=output,
+                         thoughts_tokens=thoughts, cost_usd=round(cost, 6),
+                         prompt_tokens_per_call=round(prompt / calls, 1))
+            result.append(entry)
+        return result
+
+    def refresh_gauges(self, window: float = USAGE_WINDOW):
+        """把帳本中最近 window 秒的合計寫到指標（/metrics 抓取前呼叫）；視窗內沒有用量的組合歸零"""
+        seen = set()
+        for entry in self.summary(window, by=("call_site", "model"), limit=1000):
+            labels = {"call_site": entry["call_site"], "model": entry["model"]}
+            for kind in KINDS:
+                WINDOW_TOKENS.set(entry[f"{kind}_tokens"], kind=kind, **labels)
+            WINDOW_COST.set(entry["cost_usd"], **labels)
+            seen.add((entry["call_site"], entry["model"]))
+        for call_site, model in WINDOW_COST.samples():
+            if (call_site, model) not in seen:
+                for kind in KINDS:
+                    WINDOW_TOKENS.set(0, call_site=call_site, model=model, kind=kind)
+                WINDOW_COST.set(0, call_site=call_site, model=model)
+
+    def report(self, window: float = USAGE_WINDOW, by=("call_site", "model"), limit: int = 100) -> dict:
+        """管理端點用：總計 + 分組明細（可 JSON 序列化）"""
+        total = self.summary(window, by=())
+        return {
+            "window_seconds": window,
+            "by": [c for c in by if c in GROUP_COLUMNS],
+            "total": total[0] if total else {},
+            "rows": self.summary(window, by=by, limit=limit),
+        }
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> UsageLedger:
+    """回傳共用的用量帳本（第一次使用時建立）"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger()
+        return _ledger
@@ -0,0 +1,55 @@
+"""
+分析工作的准入控制：超過上限時立刻告訴使用者「忙碌中」，而不是排進無上限的佇列等到逾時。
+
+- 全域：同時進行的分析最多 concurrency 個（即 responder 的執行緒數），
+  另外最多 queue 個排隊等待；再多就拒絕
+- 每位使用者：同時最多 per_user 個分析（進行中＋排隊）
+
+上限以本行程計算；多個 worker 時總上限為 worker 數 × 設定值。
+
+指標：linebot_admission_total{result}、linebot_analyses_inflight
+"""
+import threading
+
+from common import metrics
+
+ADMISSION = metrics.counter("linebot_admission_total", "分析請求的准入結果", ["result"])
+INFLIGHT = metrics.gauge("linebot_analyses_inflight", "進行中與排隊中的分析數")
+
+BUSY = "busy"            # 全域已滿
+USER_BUSY = "user_busy"  # 這位使用者已有分析在進行
+
+
+class Admission:
+    def __init__(self, concurrency: int, queue: int, per_user: int):
+        self.capacity = concurrency + queue
+        self.per_user = per_user
+        self._lock = threading.Lock()
+        self._total = 0
+        self._users = {}   # user_id → 進行中＋排隊中的數量
+
+    def admit(self, user_id):
+        """可以接受時登記並回傳 None；否則回傳拒絕原因（BUSY / USER_BUSY）"""
+        with self._lock:
+            if self._users.get(user_id, 0) >= self.per_user:
+                reason = USER_BUSY
+            elif self._total >= self.capacity:
+                reason = BUSY
+            else:
+                self._users[user_id] = self._users.get(user_id, 0) + 1
+                self._total += 1
+                INFLIGHT.set(self._total)
+                ADMISSION.inc(result="admitted")
+                return None
+        ADMISSION.inc(result=reason)
+        return reason
+
+    def release(self, user_id):
+        with self._lock:
+            count = self._users.get(user_id, 0) - 1
+            if count > 0:
+                self._users[user_id] = count
+            else:
+                self._users.pop(user_id, None)
+            self._total = max(0, self._total - 1)
+            INFLIGHT.set(self._total)
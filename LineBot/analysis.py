@@ -0,0 +1,211 @@
+"""
+上傳圖片的暫存、背景預先處理與「開始分析」：Flask 版（app.py）、分析 worker（LineBot/worker.py）
+與 asyncio 版（asgi_app.py，AsyncImagePipeline）共用，回覆內容與 session 清理方式一致。
+
+import 時沒有副作用：不啟動清理執行緒、回覆執行緒池或事件去重。
+web 行程另外啟動 start_sweeper 與 Responder；worker 只需要 analyze 與 cleanup_user_images。
+"""
+import asyncio
+
+from common import tracing
+from LineBot import config
+from LineBot.image_buffer import ImageBuffer
+from LineBot.prefetch import Prefetcher, AsyncPrefetcher
+from LineBot.messages import (
+    analysis_result_messages,
+    sticker_result_messages,
+    no_images_messages,
+    no_text_messages,
+    error_messages
+)
+from LineBot.test_backend_logic import (
+    process_image_mygo,
+    process_image_ocr_only,
+    analyze_combined_dialogue,
+    process_image_mygo_async,
+    process_image_ocr_only_async,
+    analyze_combined_dialogue_async
+)
+
+
+def create_image_buffer():
+    """上傳的圖片：小圖放記憶體、大圖寫入磁碟；session 內只存參照"""
+    # 記憶體中的圖片只有本行程看得到，跨行程的 session store 一律寫入磁碟
+    return ImageBuffer(
+        spill_bytes=config.IMAGE_SPILL_BYTES if config.SESSION_STORE_URL.startswith("memory") else 0,
+        max_age=2 * config.SESSION_TTL,
+        directory=config.IMAGE_DIR,
+    )
+
+
+def combine_ocr_texts(ocr_texts):
+    """依截圖順序合併各張圖片的 OCR 文字，一次傳給 AI；全部辨識不到文字時回傳 None"""
+    all_ocr_texts = [
+        f"【第{i+1}張截圖】\n{ocr_text}"
+        for i, ocr_text in enumerate(ocr_texts)
+        if ocr_text
+    ]
+    if not all_ocr_texts:
+        return None
+    print(f"📝 合併 {len(all_ocr_texts)} 張圖片的 OCR 結果，準備傳給 AI...")
+    return "\n\n".join(all_ocr_texts)
+
+
+class ImagePipeline:
+    def __init__(self, sessions):
+        """
+        Args:
+            sessions: SessionStore，圖片參照與預先處理結果存在這裡
+        """
+        self.sessions = sessions
+        self.image_buffer = create_image_buffer()
+        # 圖片一收到就在背景處理，「開始分析」時只需等待 LLM（執行緒在第一次 submit 時才建立）
+        self.prefetcher = Prefetcher(
+            sessions,
+            {"analysis": self.ocr_image, "sticker": self.recommend_sticker},
+            workers=config.PREFETCH_WORKERS,
+            wait=config.PREFETCH_WAIT,
+            max_pending=config.PREFETCH_MAX_PENDING,
+        )
+
+    def ocr_image(self, img_ref):
+        """感情分析：單張圖片的 OCR 文字（直接以 bytes 送進 OCR，不落地）"""
+        return process_image_ocr_only(self.image_buffer.get(img_ref))
+
+    def recommend_sticker(self, img_ref):
+        """智慧表情包：單張圖片的推薦表情包網址（或錯誤訊息）"""
+        return process_image_mygo(self.image_buffer.get(img_ref))
+
+    def cleanup_user_images(self, user_id):
+        """清理用戶的暫存圖片"""
+        session = self.sessions.pop(user_id)
+        if session:
+            self.prefetcher.forget(session["images"])
+            for img_ref in session["images"]:
+                self.image_buffer.discard(img_ref)
+
+    @tracing.traced("process_all_images")
+    def analyze(self, user_id):
+        """
+        處理用戶上傳的所有圖片，回傳要送給用戶的訊息。
+        錯誤直接拋出且不清理 session：worker 交給佇列重試，web 行程由 process_all_images 轉成錯誤訊息。
+        """
+        state = self.sessions.get(user_id) or {}
+        mode = state.get("mode")
+        images = state.get("images", [])
+        tracing.set_attributes(user_id=user_id, mode=mode, image_count=len(images))
+
+        if mode == "analysis":
+            # 感情分析：收集所有圖片的 OCR（上傳時已在背景進行），合併文字後再一次傳給 AI
+            ocr_texts = []
+            for i, img_ref in enumerate(images):
+                print(f"📷 取得第 {i+1}/{len(images)} 張圖片的 OCR: {img_ref}")
+                ocr_texts.append(self.prefetcher.result(user_id, mode, img_ref))
+            combined_text = combine_ocr_texts(ocr_texts)
+            if combined_text is None:
+                return no_text_messages()
+            # 結果太長時截斷
+            return analysis_result_messages(analyze_combined_dialogue(combined_text))
+
+        elif mode == "sticker":
+            # 智慧表情包：每張圖片的推薦（上傳時已在背景進行）
+            image_urls = []
+            for i, img_ref in enumerate(images):
+                print(f"📷 取得第 {i+1}/{len(images)} 張圖片的推薦: {img_ref}")
+                image_urls.append(self.prefetcher.result(user_id, mode, img_ref))
+            return sticker_result_messages(image_urls)
+
+        # session 在等待期間過期或被取消
+        return no_images_messages()
+
+    def process_all_images(self, user_id):
+        """web 行程的「開始分析」：錯誤轉成錯誤訊息回覆，結束後清理暫存圖片（由 responder 決定 reply 或 push）"""
+        try:
+            return self.analyze(user_id)
+        except Exception as e:
+            print(f"❌ 處理錯誤: {e}")
+            return error_messages(e)
+        finally:
+            # 清理所有暫存圖片
+            self.cleanup_user_images(user_id)
+
+
+class AsyncImagePipeline:
+    """
+    ImagePipeline 的 asyncio 版本（asgi_app.py）：Vision / Gemini 使用非同步用戶端，各張圖片的結果並行等待；
+    session store 與圖片暫存等阻塞式操作在 thread pool 執行。
+    """
+
+    def __init__(self, sessions):
+        """
+        Args:
+            sessions: SessionStore，圖片參照與預先處理結果存在這裡
+        """
+        self.sessions = sessions
+        self.image_buffer = create_image_buffer()
+        # 圖片一收到就在背景處理（Task，不佔執行緒）
+        self.prefetcher = AsyncPrefetcher(
+            sessions,
+            {"analysis": self.ocr_image, "sticker": self.recommend_sticker},
+            concurrency=config.ASYNC_PREFETCH_CONCURRENCY,
+            wait=config.PREFETCH_WAIT,
+            max_pending=config.ASYNC_PREFETCH_MAX_PENDING,
+        )
+
+    async def ocr_image(self, img_ref):
+        """感情分析：單張圖片的 OCR 文字"""
+        image = await asyncio.to_thread(self.image_buffer.get, img_ref)
+        return await process_image_ocr_only_async(image)
+
+    async def recommend_sticker(self, img_ref):
+        """智慧表情包：單張圖片的推薦表情包網址（或錯誤訊息）"""
+        image = await asyncio.to_thread(self.image_buffer.get, img_ref)
+        return await process_image_mygo_async(image)
+
+    async def cleanup_user_images(self, user_id):
+        """清理用戶的暫存圖片"""
+        session = await asyncio.to_thread(self.sessions.pop, user_id)
+        if session:
+            self.prefetcher.forget(session["images"])
+
+            def discard_all():
+                for img_ref in session["images"]:
+                    self.image_buffer.discard(img_ref)
+
+            await asyncio.to_thread(discard_all)
+
+    @tracing.traced("process_all_images")
+    async def analyze(self, user_id):
+        """處理用戶上傳的所有圖片，回傳要送給用戶的訊息；錯誤直接拋出且不清理 session"""
+        state = await asyncio.to_thread(self.sessions.get, user_id) or {}
+        mode = state.get("mode")
+        images = state.get("images", [])
+        tracing.set_attributes(user_id=user_id, mode=mode, image_count=len(images))
+
+        if mode == "analysis":
+            ocr_texts = await asyncio.gather(
+                *(self.prefetcher.result(user_id, mode, img_ref) for img_ref in images)
+            )
+            combined_text = combine_ocr_texts(ocr_texts)
+            if combined_text is None:
+                return no_text_messages()
+            return analysis_result_messages(await analyze_combined_dialogue_async(combined_text))
+
+        elif mode == "sticker":
+            image_urls = await asyncio.gather(
+                *(self.prefetcher.result(user_id, mode, img_ref) for img_ref in images)
+            )
+            return sticker_result_messages(image_urls)
+
+        # session 在等待期間過期或被取消
+        return no_images_messages()
+
+    async def process_all_images(self, user_id):
+        """「開始分析」：錯誤轉成錯誤訊息回覆，結束後清理暫存圖片"""
+        try:
+            return await self.analyze(user_id)
+        except Exception as e:
+            print(f"❌ 處理錯誤: {e}")
+            return error_messages(e)
+        finally:
+            await self.cleanup_user_images(user_id)
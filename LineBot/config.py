@@ -8,4 +8,61 @@ env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(env_path)
 
 CHANNEL_ACCESS_TOKEN = os.getenv('CHANNEL_ACCESS_TOKEN')
-CHANNEL_SECRET = os.getenv('CHANNEL_SECRET')
\ No newline at end of file
+CHANNEL_SECRET = os.getenv('CHANNEL_SECRET')
+
+# 使用者 session 儲存位置：memory:// 、sqlite:///path/to/sessions.db 、redis://host:6379/0
+# 多個 Gunicorn worker 需使用 sqlite 或 redis；多台主機需使用 redis
+SESSION_STORE_URL = os.getenv('SESSION_STORE_URL', 'memory://')
+SESSION_TTL = int(os.getenv('SESSION_TTL', '1800'))   # 最後一次操作後幾秒過期
+
+# 上傳圖片的暫存目錄（預設為系統暫存目錄）；多台主機時需指向共用磁碟
+IMAGE_DIR = os.getenv('IMAGE_DIR') or None
+# 小於這個大小的圖片只放在記憶體，超過才寫入 IMAGE_DIR
+# （使用 sqlite / redis session store 時一律寫入磁碟，其他 worker 才讀得到）
+IMAGE_SPILL_BYTES = int(os.getenv('IMAGE_SPILL_BYTES', str(2 * 1024 * 1024)))
+SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', '60'))   # 清理過期 session 的間隔秒數
+
+# LINE Messaging API 共用連線池
+LINE_POOL_MAXSIZE = int(os.getenv('LINE_POOL_MAXSIZE', '10'))       # 每個主機最多同時幾條連線
+LINE_CONNECT_TIMEOUT = float(os.getenv('LINE_CONNECT_TIMEOUT', '3'))
+LINE_READ_TIMEOUT = float(os.getenv('LINE_READ_TIMEOUT', '15'))
+LINE_CONNECT_RETRIES = int(os.getenv('LINE_CONNECT_RETRIES', '2'))  # 只重試建立連線失敗
+# 覆寫所有 LINE API 的網址（含下載圖片的 api-data），供本機測試替身使用；預設為官方網址
+LINE_API_HOST = os.getenv('LINE_API_HOST') or None
+
+# 圖片上傳後立即在背景做 OCR / 表情包推薦
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+PREFETCH_MAX_PENDING = int(os.getenv('PREFETCH_MAX_PENDING', '64'))   # 超過就不預先處理
+PREFETCH_WAIT = int(os.getenv('PREFETCH_WAIT', '120'))   # 開始分析時最多等待背景工作幾秒
+
+# webhook 事件去重（LINE 重送時略過已處理的事件）；預設與 session store 同一個後端
+EVENT_DEDUP_URL = os.getenv('EVENT_DEDUP_URL', SESSION_STORE_URL)
+EVENT_DEDUP_TTL = int(os.getenv('EVENT_DEDUP_TTL', '3600'))
+
+# 「開始分析」的結果在幾秒內完成就直接 reply，否則先回覆處理中、完成後 push
+REPLY_WAIT = float(os.getenv('REPLY_WAIT', '2'))
+RESPONDER_WORKERS = int(os.getenv('RESPONDER_WORKERS', '8'))   # 同時進行的分析數上限
+
+# 准入控制：超過上限時直接回覆忙碌中
+ANALYSIS_QUEUE = int(os.getenv('ANALYSIS_QUEUE', '16'))        # 除了進行中之外最多排隊幾個分析
+ANALYSIS_PER_USER = int(os.getenv('ANALYSIS_PER_USER', '1'))   # 每位使用者同時最多幾個分析
+MAX_IMAGES_PER_SESSION = int(os.getenv('MAX_IMAGES_PER_SESSION', '10'))
+
+# 持久化工作佇列：設定後「開始分析」交給獨立的 worker 行程（python -m LineBot.worker），
+# web 行程重啟也不會遺失已接受的分析。需搭配 sqlite / redis 的 SESSION_STORE_URL
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH') or None
+JOB_QUEUE_CAPACITY = int(os.getenv('JOB_QUEUE_CAPACITY', '100'))   # 未完成工作數上限
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# 工作依預估秒數排序（小工作優先）；每等待 1 秒，預估秒數扣掉這個值，避免大工作一直排不到
+JOB_AGING_RATE = float(os.getenv('JOB_AGING_RATE', '0.5'))
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '2'))
+
+# asyncio 版本（asgi_app.py）：上游呼叫都是 coroutine，上限可以比執行緒版本高很多
+ASYNC_MAX_ANALYSES = int(os.getenv('ASYNC_MAX_ANALYSES', '256'))                 # 同時進行的分析數上限
+ASYNC_PREFETCH_CONCURRENCY = int(os.getenv('ASYNC_PREFETCH_CONCURRENCY', '64'))  # 同時進行的預先處理數
+ASYNC_PREFETCH_MAX_PENDING = int(os.getenv('ASYNC_PREFETCH_MAX_PENDING', '1024'))
+LINE_ASYNC_POOL_MAXSIZE = int(os.getenv('LINE_ASYNC_POOL_MAXSIZE', '100'))       # 同時連到 LINE API 的連線數
+
+# 管理端點（GET /admin/usage：Gemini token 用量與費用；GET /admin/quota：各使用者的配額排隊時間）的 Bearer token；未設定時端點關閉（回 404）
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN') or None
@@ -0,0 +1,178 @@
+"""
+Webhook 事件去重：LINE 在我們回應太慢時會重送 webhook，同一個事件不應重跑 OCR / Gemini。
+
+以 webhookEventId 為 key，第一次收到時「認領」（claim），ttl 秒內再收到同一事件直接略過。
+處理中途拋出例外時釋放認領，讓 LINE 的重送可以再處理一次。
+
+- MemoryEventDedup：單一行程用，最多保留 max_entries 筆
+- SQLiteEventDedup：同一台機器上多個 worker 共用
+- RedisEventDedup：跨機器共用（SET NX EX）
+
+用法：
+    @handler.add(MessageEvent, message=TextMessageContent)
+    @dedup.once
+    def handle_text_message(event): ...
+
+asyncio 版本（asgi_app.py）使用 @dedup.once_async，claim / release 在 thread pool 執行。
+
+指標：linebot_webhook_events_total{result, redelivery}
+"""
+import asyncio
+import contextlib
+import functools
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from common import metrics
+
+EVENTS = metrics.counter("linebot_webhook_events_total", "收到的 webhook 事件", ["result", "redelivery"])
+
+
+class EventDedup(ABC):
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @abstractmethod
+    def claim(self, event_id) -> bool:
+        """第一次看到這個事件時回傳 True；已被接受或處理中則回傳 False"""
+
+    @abstractmethod
+    def release(self, event_id):
+        """處理失敗時釋放，讓重送的事件可以再處理"""
+
+    def once(self, fn):
+        """裝飾器：同一個 webhook 事件只執行一次"""
+        # 只接受 event：WebhookHandler 看到 *args 或兩個參數時會多傳 destination 給 handler
+        @functools.wraps(fn)
+        def wrapper(event):
+            event_id = getattr(event, "webhook_event_id", None)
+            if event_id is None:
+                return fn(event)
+            if not self._accept(event_id, self.claim(event_id), event):
+                return None
+            try:
+                return fn(event)
+            except BaseException:
+                self.release(event_id)
+                raise
+        return wrapper
+
+    def once_async(self, fn):
+        """once 的 async 版本，用於 async def handler"""
+        @functools.wraps(fn)
+        async def wrapper(event):
+            event_id = getattr(event, "webhook_event_id", None)
+            if event_id is None:
+                return await fn(event)
+            if not self._accept(event_id, await asyncio.to_thread(self.claim, event_id), event):
+                return None
+            try:
+                return await fn(event)
+            except BaseException:
+                await asyncio.to_thread(self.release, event_id)
+                raise
+        return wrapper
+
+    @staticmethod
+    def _accept(event_id, claimed, event):
+        delivery = getattr(event, "delivery_context", None)
+        redelivery = "true" if getattr(delivery, "is_redelivery", False) else "false"
+        if not claimed:
+            EVENTS.inc(result="duplicate", redelivery=redelivery)
+            print(f"🔁 略過重複的 webhook 事件：{event_id}")
+            return False
+        EVENTS.inc(result="accepted", redelivery=redelivery)
+        return True
+
+
+class MemoryEventDedup(EventDedup):
+    def __init__(self, ttl: int, max_entries: int = 10000):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()   # event_id → 到期時間（ttl 固定，插入順序即到期順序）
+
+    def claim(self, event_id):
+        now = time.time()
+        with self._lock:
+            while self._seen and next(iter(self._seen.values())) < now:
+                self._seen.popitem(last=False)
+            if event_id in self._seen:
+                return False
+            self._seen[event_id] = now + self.ttl
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
+
+    def release(self, event_id):
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+
+class SQLiteEventDedup(EventDedup):
+    PURGE_INTERVAL = 60   # 每隔幾秒順便刪除過期紀錄
+
+    def __init__(self, path: str, ttl: int):
+        super().__init__(ttl)
+        self.path = path
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS webhook_events (event_id TEXT PRIMARY KEY, expires REAL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def claim(self, event_id):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if now - self._last_purge > self.PURGE_INTERVAL:
+                    conn.execute("DELETE FROM webhook_events WHERE expires < ?", (now,))
+                    self._last_purge = now
+                else:
+                    conn.execute("DELETE FROM webhook_events WHERE event_id = ? AND expires < ?", (event_id, now))
+                cursor = conn.execute("INSERT OR IGNORE INTO webhook_events VALUES (?, ?)",
+                                      (event_id, now + self.ttl))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def release(self, event_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM webhook_events WHERE event_id = ?", (event_id,))
+
+
+class RedisEventDedup(EventDedup):
+    def __init__(self, url: str, ttl: int, prefix: str = "linebot:event:"):
+        super().__init__(ttl)
+        import redis  # 只有使用 Redis 後端時才需要安裝
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def claim(self, event_id):
+        return bool(self.client.set(f"{self.prefix}{event_id}", "1", nx=True, ex=self.ttl))
+
+    def release(self, event_id):
+        self.client.delete(f"{self.prefix}{event_id}")
+
+
+def create_event_dedup(url: str, ttl: int) -> EventDedup:
+    """依網址建立去重快取，格式同 create_session_store"""
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryEventDedup(ttl)
+    if scheme == "sqlite":
+        return SQLiteEventDedup(url[len("sqlite:///"):], ttl)
+    if scheme in ("redis", "rediss"):
+        return RedisEventDedup(url, ttl)
+    raise ValueError(f"不支援的事件去重後端：{url}")
@@ -0,0 +1,356 @@
+"""
+Google Vision / Gemini REST API 的本機替身：不需要網路與真實配額，就能重現排隊、快取與重試行為。
+
+支援：
+- POST /v1/images:annotate                           Vision（document_text_detection / batch_annotate_images）
+- POST /v1beta/models/{model}:generateContent        Gemini generate_content / generate_content_async
+- POST /v1beta/models/{model}:embedContent           Gemini embed_content
+- GET  /_standin/stats                               各後端、各結果的請求數
+- POST /_standin/reset                               清除統計
+
+回應來源（依序）：
+1. --recordings 目錄中的錄製回應：vision/<圖片 sha256>.json（AnnotateImageResponse）、
+   gemini/<prompt sha256>.json（GenerateContentResponse），皆為 REST 的 JSON 格式
+2. 沒有錄製時自動產生：Vision 依圖片雜湊產生左右交錯的對話氣泡；Gemini 依 prompt 類型
+   （語氣分類器、回覆選擇器、其他）產生可解析的回應，token 數粗估為字數
+
+故障注入：
+    --vision-latency / --gemini-latency   延遲分布：0.5（固定）、uniform:0.2,1.5、lognormal:0.8,0.5（中位數, sigma）
+    --gemini-rpm 60                       每分鐘請求上限，超過回 429 RESOURCE_EXHAUSTED
+    --rate-limit-ratio 0.05               隨機回 429 的比例
+    --error-ratio 0.02                    隨機回 503 UNAVAILABLE 的比例
+    --malformed-ratio 0.05                Gemini 回傳截斷、無法解析的 JSON 的比例
+    --seed 1                              固定亂數種子
+
+執行：
+    python LineBot/google_standin.py --port 8791 --gemini-latency lognormal:1.5,0.4
+然後設定 VISION_ENDPOINT=http://127.0.0.1:8791 與 GEMINI_ENDPOINT=http://127.0.0.1:8791
+（image_recognition.structured_ocr 與 AI_response.gemini_client 會改用 REST 連到替身）
+"""
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MYGO_TEXTS = os.path.join(project_root, "mygo", "mygo_texts.txt")
+EMBED_DIMENSIONS = 768
+
+ANALYSIS_TEXT = """一、語氣 (Tone)
+- 雙方用詞輕鬆，語調自然
+二、情緒 (Emotion)
+- 整體情緒平穩，偶有期待
+三、意圖 (Intention)
+- 彼此確認近況、維繫關係
+總結
+- 這是一段日常且友好的對話，雙方關係穩定。"""
+
+
+def parse_latency(spec: str):
+    """把延遲分布字串轉成取樣函式（回傳秒數）"""
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, args = spec.partition(":")
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    params = [float(x) for x in args.split(",")]
+    if kind == "uniform":
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = params
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"不支援的延遲分布：{spec}")
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text))
+
+
+# ===== 自動產生的回應 =====
+
+def synthesize_vision(content: bytes) -> dict:
+    """依圖片雜湊產生 3 ~ 8 個左右交錯的對話氣泡（1000 x 2000 的版面）"""
+    rng = random.Random(content)
+    blocks = []
+    for i in range(rng.randint(3, 8)):
+        left = i % 2 == 0
+        x0, x1 = (60, 460) if left else (540, 940)
+        y0 = 120 + i * 220
+        text = f"訊息{i + 1}"
+        symbols = [{"text": ch} for ch in text]
+        box = {"vertices": [{"x": x0, "y": y0}, {"x": x1, "y": y0}, {"x": x1, "y": y0 + 80}, {"x": x0, "y": y0 + 80}]}
+        blocks.append({
+            "boundingBox": box,
+            "paragraphs": [{"boundingBox": box, "words": [{"boundingBox": box, "symbols": symbols}]}],
+            "blockType": "TEXT",
+        })
+    text = "\n".join("".join(s["text"] for s in b["paragraphs"][0]["words"][0]["symbols"]) for b in blocks)
+    return {
+        "fullTextAnnotation": {"pages": [{"width": 1000, "height": 2000, "blocks": blocks}], "text": text},
+        "textAnnotations": [{"description": text}],
+    }
+
+
+class _GeminiRules:
+    """沒有錄製時，依 prompt 類型產生專案裡各呼叫點可以解析的回應"""
+
+    def __init__(self):
+        self._texts = None
+
+    def known_texts(self):
+        if self._texts is None:
+            try:
+                with open(MYGO_TEXTS, encoding="utf8") as f:
+                    self._texts = {line.strip() for line in f if line.strip()}
+            except OSError:
+                self._texts = set()
+        return self._texts
+
+    def tone(self, prompt, rng):
+        match = re.search(r"【指定標籤清單】\s*\n(.+)", prompt)
+        tags = match.group(1).strip().split("、") if match else ["中性"]
+        return json.dumps({
+            "emotion": rng.choice(tags), "tone": rng.choice(tags), "intent": rng.choice(tags),
+            "confidence": round(rng.uniform(0.5, 0.95), 2),
+        }, ensure_ascii=False)
+
+    def select(self, prompt, rng):
+        # 候選行是「編號. 文字語氣標籤」，以已知的台詞找出文字部分
+        texts = self.known_texts()
+        candidates = []
+        for line in re.findall(r"^\d+\. (.+)$", prompt, re.M):
+            prefix = next((line[:n] for n in range(len(line), 0, -1) if line[:n] in texts), None)
+            if prefix:
+                candidates.append(prefix)
+        return json.dumps({"selected_text": rng.choice(candidates) if candidates else ""}, ensure_ascii=False)
+
+    def respond(self, prompt, rng):
+        if "語氣分類器" in prompt:
+            return self.tone(prompt, rng)
+        if "聊天回覆選擇器" in prompt:
+            return self.select(prompt, rng)
+        return ANALYSIS_TEXT
+
+
+def gemini_response(text: str, prompt: str) -> dict:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": _tokens(prompt),
+            "candidatesTokenCount": _tokens(text),
+            "totalTokenCount": _tokens(prompt) + _tokens(text),
+        },
+    }
+
+
+def embedding(text: str) -> dict:
+    rng = random.Random(text)
+    values = [rng.gauss(0, 1) for _ in range(EMBED_DIMENSIONS)]
+    norm = math.sqrt(sum(v * v for v in values))
+    return {"embedding": {"values": [v / norm for v in values]}}
+
+
+# ===== 伺服器 =====
+
+class _State:
+    def __init__(self, recordings=None, vision_latency="", gemini_latency="", gemini_rpm=0,
+                 rate_limit_ratio=0.0, error_ratio=0.0, malformed_ratio=0.0, seed=None):
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.recordings = recordings
+        self.latency = {"vision": parse_latency(vision_latency), "gemini": parse_latency(gemini_latency)}
+        self.gemini_rpm = gemini_rpm
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.malformed_ratio = malformed_ratio
+        self.recent = collections.deque()   # 最近一分鐘的 Gemini 請求時間
+        self.counts = collections.Counter()
+        self.rules = _GeminiRules()
+
+    def count(self, backend, result):
+        with self.lock:
+            self.counts[f"{backend}:{result}"] += 1
+
+    def draw(self, backend):
+        """決定這次請求的延遲與注入的故障（None 表示正常回應）"""
+        with self.lock:
+            delay = self.latency[backend](self.rng)
+            roll = self.rng.random()
+            fault = None
+            if backend == "gemini" and self.gemini_rpm:
+                now = time.time()
+                while self.recent and self.recent[0] <= now - 60:
+                    self.recent.popleft()
+                if len(self.recent) >= self.gemini_rpm:
+                    fault = "rate_limited"
+                else:
+                    self.recent.append(now)
+            if fault is None:
+                if roll < self.rate_limit_ratio:
+                    fault = "rate_limited"
+                elif roll < self.rate_limit_ratio + self.error_ratio:
+                    fault = "error"
+                elif backend == "gemini" and roll < self.rate_limit_ratio + self.error_ratio + self.malformed_ratio:
+                    fault = "malformed"
+            return delay, fault, random.Random(self.rng.random())
+
+    def recorded(self, backend, key):
+        if not self.recordings:
+            return None
+        path = os.path.join(self.recordings, backend, f"{key}.json")
+        try:
+            with open(path, encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+ERRORS = {
+    "rate_limited": (429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+    "error": (503, "UNAVAILABLE", "The service is currently unavailable."),
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "google-standin"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, backend, fault):
+        status, code, message = ERRORS[fault]
+        self.server.state.count(backend, fault)
+        self._send(status, {"error": {"code": status, "message": message, "status": code}})
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/_standin/stats":
+            with self.server.state.lock:
+                self._send(200, dict(self.server.state.counts))
+        else:
+            self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        state = self.server.state
+        if path == "/_standin/reset":
+            with state.lock:
+                state.counts.clear()
+            self._send(200, {})
+            return
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            self._send(400, {"error": {"code": 400, "message": "Invalid JSON payload", "status": "INVALID_ARGUMENT"}})
+            return
+        if path == "/v1/images:annotate":
+            self._annotate(payload)
+        elif path.startswith("/v1beta/models/") and path.endswith(":generateContent"):
+            self._generate(payload)
+        elif path.startswith("/v1beta/models/") and path.endswith(":embedContent"):
+            self._embed(payload)
+        else:
+            self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+    def _annotate(self, payload):
+        state = self.server.state
+        delay, fault, _ = state.draw("vision")
+        time.sleep(delay)
+        if fault in ERRORS:
+            self._send_error("vision", fault)
+            return
+        responses = []
+        for request in payload.get("requests", []):
+            content = base64.b64decode(request.get("image", {}).get("content", ""))
+            recorded = state.recorded("vision", _sha256(content))
+            state.count("vision", "replayed" if recorded is not None else "synthesized")
+            responses.append(recorded if recorded is not None else synthesize_vision(content))
+        self._send(200, {"responses": responses})
+
+    def _generate(self, payload):
+        state = self.server.state
+        delay, fault, rng = state.draw("gemini")
+        time.sleep(delay)
+        if fault in ERRORS:
+            self._send_error("gemini", fault)
+            return
+        prompt = "".join(part.get("text", "") for content in payload.get("contents", [])
+                         for part in content.get("parts", []))
+        recorded = state.recorded("gemini", _sha256(prompt.encode("utf8")))
+        if recorded is not None:
+            state.count("gemini", "replayed")
+            self._send(200, recorded)
+            return
+        text = state.rules.respond(prompt, rng)
+        if fault == "malformed":
+            text = text[:max(1, len(text) // 2)]   # 像被截斷的輸出：JSON 無法解析
+        state.count("gemini", fault or "synthesized")
+        self._send(200, gemini_response(text, prompt))
+
+    def _embed(self, payload):
+        state = self.server.state
+        delay, fault, _ = state.draw("gemini")
+        time.sleep(delay)
+        if fault in ERRORS:
+            self._send_error("gemini", fault)
+            return
+        text = "".join(part.get("text", "") for part in payload.get("content", {}).get("parts", []))
+        state.count("gemini", "embedded")
+        self._send(200, embedding(text))
+
+
+def serve(host="127.0.0.1", port=8791, background=False, **options):
+    """
+    啟動替身伺服器；options 與命令列參數相同（recordings、vision_latency、gemini_latency、gemini_rpm、
+    rate_limit_ratio、error_ratio、malformed_ratio、seed）。background=True 時在背景執行緒執行並回傳 server。
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.state = _State(**options)
+    if background:
+        threading.Thread(target=server.serve_forever, name="google-standin", daemon=True).start()
+        return server
+    print(f"🧪 Vision / Gemini 替身：http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Google Vision / Gemini REST API 本機替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument("--recordings", help="錄製回應的目錄（vision/、gemini/ 子目錄）")
+    parser.add_argument("--vision-latency", default="", help="Vision 延遲分布")
+    parser.add_argument("--gemini-latency", default="", help="Gemini 延遲分布")
+    parser.add_argument("--gemini-rpm", type=int, default=0, help="Gemini 每分鐘請求上限（0 表示不限制）")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="隨機回 429 的比例")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="隨機回 503 的比例")
+    parser.add_argument("--malformed-ratio", type=float, default=0.0, help="Gemini 回傳無法解析 JSON 的比例")
+    parser.add_argument("--seed", type=int, help="亂數種子")
+    args = parser.parse_args()
+    serve(args.host, args.port, recordings=args.recordings, vision_latency=args.vision_latency,
+          gemini_latency=args.gemini_latency, gemini_rpm=args.gemini_rpm, rate_limit_ratio=args.rate_limit_ratio,
+          error_ratio=args.error_ratio, malformed_ratio=args.malformed_ratio, seed=args.seed)
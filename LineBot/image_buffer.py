@@ -0,0 +1,124 @@
+"""
+上傳圖片的暫存區，取代每張圖片都寫一個 NamedTemporaryFile(delete=False)。
+
+- 小於 spill_bytes 的圖片直接以 bytes 留在記憶體，參照為 "mem:<id>"
+- 超過門檻的圖片寫到磁碟，參照為 "file:<路徑>"
+- 背景清理執行緒 (start_sweeper) 定期移除過期 session 與它們的圖片；
+  另外把超過 max_age 仍未被取用的圖片當作孤兒清掉（Redis 後端自動過期、或行程中途結束時的保底）
+
+指標：linebot_sessions、linebot_image_bytes_held、linebot_evictions_total
+"""
+import glob
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from common import metrics
+
+FILE_PREFIX = "linebot-img-"
+
+SESSIONS = metrics.gauge("linebot_sessions", "目前的使用者 session 數")
+BYTES_HELD = metrics.gauge("linebot_image_bytes_held", "本行程暫存的圖片大小", ["where"])
+EVICTIONS = metrics.counter("linebot_evictions_total", "清理執行緒移除的項目數", ["kind"])
+
+
+class ImageBuffer:
+    def __init__(self, spill_bytes: int, max_age: float, directory=None):
+        self.spill_bytes = spill_bytes
+        self.max_age = max_age
+        self.directory = directory or tempfile.gettempdir()
+        self._lock = threading.Lock()
+        self._memory = {}   # id → (建立時間, bytes)
+        self._files = {}    # 本行程寫出的檔案路徑 → 大小（用於 bytes_held 指標）
+
+    def put(self, data: bytes) -> str:
+        """保存圖片並回傳參照字串"""
+        if len(data) <= self.spill_bytes:
+            key = uuid.uuid4().hex
+            with self._lock:
+                self._memory[key] = (time.time(), data)
+            BYTES_HELD.inc(len(data), where="memory")
+            return f"mem:{key}"
+
+        fd, path = tempfile.mkstemp(prefix=FILE_PREFIX, suffix=".jpg", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._files[path] = len(data)
+        BYTES_HELD.inc(len(data), where="disk")
+        return f"file:{path}"
+
+    def get(self, ref: str) -> bytes:
+        kind, _, value = ref.partition(":")
+        if kind == "mem":
+            with self._lock:
+                entry = self._memory.get(value)
+            if entry is None:
+                raise KeyError(f"圖片已過期或不在本行程：{ref}")
+            return entry[1]
+        with open(value, "rb") as f:
+            return f.read()
+
+    def discard(self, ref: str):
+        kind, _, value = ref.partition(":")
+        if kind == "mem":
+            with self._lock:
+                entry = self._memory.pop(value, None)
+            if entry is not None:
+                BYTES_HELD.dec(len(entry[1]), where="memory")
+        elif kind == "file":
+            with self._lock:
+                size = self._files.pop(value, None)
+            if size is not None:
+                BYTES_HELD.dec(size, where="disk")
+            try:
+                os.remove(value)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self) -> int:
+        """移除超過 max_age 的圖片（記憶體與磁碟），回傳移除數量"""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            stale = [k for k, (created, _) in self._memory.items() if created < cutoff]
+        removed = 0
+        for key in stale:
+            self.discard(f"mem:{key}")
+            removed += 1
+        # 磁碟上的檔案可能是其他 worker 寫的，以修改時間判斷
+        for path in glob.glob(os.path.join(self.directory, FILE_PREFIX + "*")):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    self.discard(f"file:{path}")
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def start_sweeper(buffer: ImageBuffer, sessions, interval: float = 60):
+    """啟動背景清理執行緒：過期 session 的圖片一併刪除，並更新指標"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                expired = sessions.sweep()
+                for session in expired:
+                    for ref in session["images"]:
+                        buffer.discard(ref)
+                orphans = buffer.sweep()
+                EVICTIONS.inc(len(expired), kind="session")
+                EVICTIONS.inc(orphans, kind="image")
+                count = sessions.count()
+                if count is not None:
+                    SESSIONS.set(count)
+                if expired or orphans:
+                    print(f"🧹 清除 {len(expired)} 個過期 session、{orphans} 張孤兒圖片")
+            except Exception as e:
+                print(f"⚠️ 清理執行緒錯誤：{e}")
+
+    thread = threading.Thread(target=run, name="session-sweeper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,347 @@
+"""
+持久化的分析工作佇列（SQLite），讓已接受的分析在 web 行程重啟 / 部署時不會遺失。
+
+web 行程只負責 enqueue；獨立的 worker 行程（LineBot/worker.py）以租約 (lease) 取出工作：
+- worker 處理期間定期延長租約；worker 當掉時租約到期，工作自動回到佇列由其他 worker 接手
+- 失敗時以指數退避重試，超過 max_attempts 次移到 dead（dead letter），不再重試
+- 依預估成本排序：優先取出 cost - 等待秒數 × aging_rate 最小的工作，
+  小工作不必排在大工作後面，大工作等得夠久也會被取出（不會餓死）
+- 結果送達方式由 claim_delivery() 決定：web 行程在 reply_by 前看到結果就用 reply token，
+  否則由 worker push（兩者以同一欄位的條件式 UPDATE 互斥）
+- 送出成功後才 mark_delivered()；送出前當掉或送出失敗的結果，認領過期後由 due_deliveries() 再次取出
+
+狀態：queued → running → done / dead
+
+指標：linebot_jobs_total{kind, result}、linebot_job_queue{status}、
+      linebot_job_seconds{job_class}（從 enqueue 到完成）、linebot_job_latency_seconds{job_class, quantile}
+"""
+import contextlib
+import json
+import math
+import sqlite3
+import time
+from collections import defaultdict
+
+from common import metrics
+from LineBot.admission import BUSY, USER_BUSY
+
+JOBS = metrics.counter("linebot_jobs_total", "工作佇列的狀態轉換", ["kind", "result"])
+DEPTH = metrics.gauge("linebot_job_queue", "佇列中各狀態的工作數", ["status"])
+COMPLETION = metrics.histogram("linebot_job_seconds", "工作從 enqueue 到完成的時間", ["job_class"],
+                               buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+QUANTILES = metrics.gauge("linebot_job_latency_seconds", "最近完成工作的完成時間分位數", ["job_class", "quantile"])
+
+RETRY_BASE = 5     # 第一次重試前等待秒數，之後每次加倍
+RETRY_MAX = 300
+CLAIM_TIMEOUT = 60  # 認領送出後這麼久還沒標記送達，視為送出失敗，可重新認領
+
+
+class QueueFull(Exception):
+    """佇列已達上限（reason 為 admission.BUSY 或 admission.USER_BUSY）"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Job:
+    def __init__(self, row):
+        (self.id, self.kind, payload, self.user_id, self.status, self.attempts,
+         self.max_attempts, self.reply_by, self.error, result, self.cost, self.job_class, self.created) = row
+        self.payload = json.loads(payload)
+        self.result = None if result is None else json.loads(result)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status} attempts={self.attempts}>"
+
+
+_COLUMNS = ("id, kind, payload, user_id, status, attempts, max_attempts, reply_by, error, result,"
+            " cost, job_class, created")
+
+
+def percentile(values, q):
+    """values 需已排序；q 介於 0 ~ 1（最近秩法）"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(q * len(values)) - 1))
+    return values[index]
+
+
+class JobQueue:
+    def __init__(self, path: str, lease_seconds: float = 120, max_attempts: int = 3, aging_rate: float = 0.5):
+        """
+        Args:
+            path (str): SQLite 檔案路徑
+            lease_seconds (float): 租約長度，worker 超過這個時間沒有回報就視為當掉
+            max_attempts (int): 最多執行次數
+            aging_rate (float): 每等待 1 秒，預估成本（秒）減少多少；0 表示只看成本
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.aging_rate = aging_rate
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " kind TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " user_id TEXT,"
+                " status TEXT NOT NULL,"          # queued / running / done / dead
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL,"
+                " available_at REAL NOT NULL,"    # 重試退避：這個時間之後才能取出
+                " lease_until REAL,"
+                " worker TEXT,"
+                " reply_by REAL,"                 # 在這之前完成就由 web 行程 reply
+                " delivered_by TEXT,"             # reply / push
+                " delivery_claimed REAL,"         # 最近一次認領送出的時間
+                " delivery_attempts INTEGER NOT NULL DEFAULT 0,"
+                " delivered REAL,"                # 送出成功的時間
+                " error TEXT,"
+                " result TEXT,"
+                " created REAL NOT NULL,"
+                " finished REAL,"
+                " cost REAL NOT NULL DEFAULT 0,"  # 預估處理秒數，用於排序
+                " job_class TEXT)"                # 統計完成時間用的分類
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "cost" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE jobs ADD COLUMN job_class TEXT")
+            if "delivered" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN delivery_claimed REAL")
+                conn.execute("ALTER TABLE jobs ADD COLUMN delivery_attempts INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE jobs ADD COLUMN delivered REAL")
+                # 舊版在送出前就認領，已結束的工作視為已處理，不再重送
+                conn.execute("UPDATE jobs SET delivered = COALESCE(finished, created)"
+                             " WHERE status IN ('done', 'dead')")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_undelivered ON jobs (id)"
+                         " WHERE delivered IS NULL AND status IN ('done', 'dead')")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def _fetch(self, conn, job_id):
+        row = conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else Job(row)
+
+    def enqueue(self, kind, payload, user_id=None, reply_by=None, capacity=None, per_user=None,
+                cost: float = 0, job_class=None) -> int:
+        """
+        加入工作並回傳 ID。
+        capacity / per_user 限制未完成（queued + running）的工作數，超過時拋出 QueueFull。
+        cost 為預估處理秒數（越小越先執行），job_class 用於分類統計完成時間（預設為 kind）。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if per_user is not None and user_id is not None:
+                    (mine,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN "
+                                           "('queued', 'running')", (user_id,)).fetchone()
+                    if mine >= per_user:
+                        raise QueueFull(USER_BUSY)
+                if capacity is not None:
+                    (pending,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN "
+                                              "('queued', 'running')").fetchone()
+                    if pending >= capacity:
+                        raise QueueFull(BUSY)
+                cursor = conn.execute(
+                    "INSERT INTO jobs (kind, payload, user_id, status, max_attempts, available_at, reply_by, created,"
+                    " cost, job_class) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (kind, json.dumps(payload, ensure_ascii=False), user_id, self.max_attempts, now, reply_by, now,
+                     cost, job_class or kind),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        JOBS.inc(kind=kind, result="enqueued")
+        return cursor.lastrowid
+
+    def lease(self, worker: str):
+        """
+        取出一個可執行的工作（含租約到期、需要重跑的工作）；沒有時回傳 None。
+        優先順序：cost - 等待秒數 × aging_rate 越小越先，相同時先進先出。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs"
+                    " WHERE (status = 'queued' AND available_at <= ?)"
+                    "    OR (status = 'running' AND lease_until < ? AND attempts < max_attempts)"
+                    " ORDER BY cost - (? - created) * ?, id LIMIT 1",
+                    (now, now, now, self.aging_rate),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, worker = ?"
+                    " WHERE id = ?",
+                    (now + self.lease_seconds, worker, row[0]),
+                )
+                job = self._fetch(conn, row[0])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        JOBS.inc(kind=job.kind, result="leased")
+        return job
+
+    def heartbeat(self, job_id, worker: str) -> bool:
+        """延長租約；租約已被其他 worker 接手時回傳 False"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job, worker: str, result) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished = ?, lease_until = NULL"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False), now, job.id, worker),
+            )
+        if cursor.rowcount == 1:
+            JOBS.inc(kind=job.kind, result="done")
+            COMPLETION.observe(now - job.created, job_class=job.job_class)
+            return True
+        return False
+
+    def fail(self, job, worker: str, error: str) -> str:
+        """記錄失敗：還有次數就退避後重試（回傳 "retry"），否則移到 dead letter（回傳 "dead"）"""
+        now = time.time()
+        if job.attempts >= job.max_attempts:
+            status, available_at = "dead", now
+        else:
+            status = "queued"
+            available_at = now + min(RETRY_MAX, RETRY_BASE * (2 ** (job.attempts - 1)))
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_until = NULL,"
+                " finished = CASE WHEN ? = 'dead' THEN ? ELSE finished END"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, error, available_at, status, now, job.id, worker),
+            )
+        result = "dead" if status == "dead" else "retry"
+        JOBS.inc(kind=job.kind, result=result)
+        return result
+
+    def reap(self):
+        """把租約到期且已用完重試次數的工作（worker 反覆當掉）移到 dead letter，回傳這些工作"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT {_COLUMNS} FROM jobs"
+                    " WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                    (now,),
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE jobs SET status = 'dead', error = 'lease expired', finished = ?, lease_until = NULL"
+                    " WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        jobs = [Job(row) for row in rows]
+        for job in jobs:
+            JOBS.inc(kind=job.kind, result="dead")
+        return jobs
+
+    def claim_delivery(self, job_id, via: str) -> bool:
+        """
+        認領結果的送出：reply（web 行程）與 push（worker）互斥。
+        認領後超過 CLAIM_TIMEOUT 秒還沒 mark_delivered 時可重新認領，最多 max_attempts 次。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET delivered_by = ?, delivery_claimed = ?, delivery_attempts = delivery_attempts + 1"
+                " WHERE id = ? AND delivered IS NULL AND delivery_attempts < max_attempts"
+                " AND (delivered_by IS NULL OR delivery_claimed < ?)",
+                (via, now, job_id, now - CLAIM_TIMEOUT),
+            )
+        return cursor.rowcount == 1
+
+    def mark_delivered(self, job_id):
+        """結果已送到使用者手上"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET delivered = ? WHERE id = ?", (time.time(), job_id))
+
+    def due_deliveries(self, grace: float = 0, limit: int = 20):
+        """
+        需要 push 的已結束工作（done / dead）：reply_by + grace 之後仍未送達，
+        且沒有人認領或認領已過期（送出前當掉、送出失敗）。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs"
+                " WHERE delivered IS NULL AND status IN ('done', 'dead') AND user_id IS NOT NULL"
+                " AND COALESCE(reply_by, 0) + ? <= ? AND delivery_attempts < max_attempts"
+                " AND (delivered_by IS NULL OR delivery_claimed < ?)"
+                " ORDER BY id LIMIT ?",
+                (grace, now, now - CLAIM_TIMEOUT, limit),
+            ).fetchall()
+        return [Job(row) for row in rows]
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            return self._fetch(conn, job_id)
+
+    def dead_letters(self, limit: int = 100):
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+                                (limit,)).fetchall()
+        return [Job(row) for row in rows]
+
+    def counts(self):
+        """各狀態的工作數，同時更新 linebot_job_queue 指標"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in ("queued", "running", "done", "dead")}
+        counts.update(dict(rows))
+        for status, n in counts.items():
+            DEPTH.set(n, status=status)
+        return counts
+
+    def latency_report(self, window: float = 3600):
+        """
+        最近 window 秒內完成的工作，依 job_class 統計完成時間（enqueue → 完成）的 p50 / p95，
+        同時更新 linebot_job_latency_seconds 指標。
+        回傳 {job_class: {"count": n, "p50": 秒, "p95": 秒}}
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT job_class, finished - created FROM jobs"
+                                " WHERE status = 'done' AND finished >= ?", (time.time() - window,)).fetchall()
+        durations = defaultdict(list)
+        for job_class, seconds in rows:
+            durations[job_class].append(seconds)
+        report = {}
+        for job_class, values in sorted(durations.items()):
+            values.sort()
+            report[job_class] = {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+            QUANTILES.set(report[job_class]["p50"], job_class=job_class, quantile="0.5")
+            QUANTILES.set(report[job_class]["p95"], job_class=job_class, quantile="0.95")
+        return report
+
+    def purge(self, older_than: float) -> int:
+        """刪除 older_than 秒前就已完成的工作（dead letter 保留）"""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE status = 'done' AND finished < ?",
+                                  (time.time() - older_than,))
+        return cursor.rowcount
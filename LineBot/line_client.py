@@ -0,0 +1,185 @@
+"""
+整個應用程式共用一個 LINE Messaging API 用戶端，取代每個 handler 各自 `with ApiClient(configuration)`。
+
+- 同一個 urllib3 連線池（keep-alive），reply / push / 下載圖片都重用已建立的 TLS 連線
+- 每個請求預設帶連線 / 讀取逾時；只重試連線失敗（push 不是冪等操作，不重送已送出的請求）
+- 記錄每個端點的延遲、狀態，以及連線重用率；每個請求也是一個 trace span（line_api）
+- asyncio 版本（asgi_app.py）：AsyncApiClient（aiohttp），同一個 event loop 共用一個連線池，
+  記錄同樣的延遲與狀態指標（aiohttp 不提供連線重用統計）
+
+指標：line_api_seconds{method, endpoint}、line_api_calls_total{method, endpoint, status}、
+      line_api_in_flight{endpoint}、
+      line_http_pool{stat}（requests / connections）、line_http_connection_reuse_ratio
+"""
+import atexit
+import re
+import socket
+import threading
+import time
+
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+import aiohttp
+from linebot.v3.messaging import (
+    Configuration, ApiClient, MessagingApi, MessagingApiBlob,
+    AsyncApiClient, AsyncMessagingApi, AsyncMessagingApiBlob,
+)
+from linebot.v3.messaging.exceptions import ApiException
+
+from common import metrics, tracing
+from LineBot import config
+
+LATENCY = metrics.histogram("line_api_seconds", "LINE API 請求延遲", ["method", "endpoint"])
+CALLS = metrics.counter("line_api_calls_total", "LINE API 請求次數", ["method", "endpoint", "status"])
+IN_FLIGHT = metrics.gauge("line_api_in_flight", "進行中的 LINE API 請求數", ["endpoint"])
+POOL = metrics.gauge("line_http_pool", "LINE API 連線池累計請求數與新建連線數", ["stat"])
+REUSE = metrics.gauge("line_http_connection_reuse_ratio", "LINE API 請求中重用既有連線的比例")
+
+# 把網址中的訊息 ID、使用者 ID 換成佔位符，避免指標標籤爆量
+_ID_PATTERN = re.compile(r"/(\d+|U[0-9a-f]{32})(?=/|$)")
+
+
+def _endpoint(url: str) -> str:
+    path = url.split("://", 1)[-1].split("?", 1)[0]
+    return _ID_PATTERN.sub("/{id}", path)
+
+
+class PooledApiClient(ApiClient):
+    """在 ApiClient.request 加上預設逾時與指標；連線池在所有執行緒間共用"""
+
+    def __init__(self, configuration, timeout):
+        super().__init__(configuration)
+        self.timeout = timeout
+
+    def request(self, method, url, *args, _request_timeout=None, **kwargs):
+        endpoint = _endpoint(url)
+        start = time.monotonic()
+        status = "error"
+        IN_FLIGHT.inc(endpoint=endpoint)
+        with tracing.span("line_api", method=method, endpoint=endpoint) as trace:
+            try:
+                response = super().request(method, url, *args,
+                                           _request_timeout=_request_timeout or self.timeout, **kwargs)
+                status = str(response.status)
+                trace.set(response_bytes=len(response.data or b""))
+                return response
+            except ApiException as e:
+                status = str(e.status)
+                raise
+            finally:
+                trace.set(status=status)
+                LATENCY.observe(time.monotonic() - start, method=method, endpoint=endpoint)
+                CALLS.inc(method=method, endpoint=endpoint, status=status)
+                IN_FLIGHT.dec(endpoint=endpoint)
+                self._record_pool()
+
+    def _record_pool(self):
+        pools = self.rest_client.pool_manager.pools
+        requests = connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests += pool.num_requests
+                connections += pool.num_connections
+        POOL.set(requests, stat="requests")
+        POOL.set(connections, stat="connections")
+        if requests:
+            REUSE.set(1 - connections / requests)
+
+
+class AsyncPooledApiClient(AsyncApiClient):
+    """PooledApiClient 的 asyncio 版本：預設逾時與指標"""
+
+    def __init__(self, configuration, timeout: aiohttp.ClientTimeout):
+        super().__init__(configuration)
+        self.timeout = timeout
+
+    async def request(self, method, url, *args, _request_timeout=None, **kwargs):
+        endpoint = _endpoint(url)
+        start = time.monotonic()
+        status = "error"
+        IN_FLIGHT.inc(endpoint=endpoint)
+        async with tracing.span("line_api", method=method, endpoint=endpoint) as trace:
+            try:
+                response = await super().request(method, url, *args,
+                                                 _request_timeout=_request_timeout or self.timeout, **kwargs)
+                status = str(response.status)
+                trace.set(response_bytes=len(response.data or b""))
+                return response
+            except ApiException as e:
+                status = str(e.status)
+                raise
+            finally:
+                trace.set(status=status)
+                LATENCY.observe(time.monotonic() - start, method=method, endpoint=endpoint)
+                CALLS.inc(method=method, endpoint=endpoint, status=status)
+                IN_FLIGHT.dec(endpoint=endpoint)
+
+
+def create_configuration() -> Configuration:
+    configuration = Configuration(host=config.LINE_API_HOST, access_token=config.CHANNEL_ACCESS_TOKEN)
+    configuration.connection_pool_maxsize = config.LINE_POOL_MAXSIZE
+    # 只重試建立連線失敗；請求送出後的錯誤交給呼叫端處理
+    configuration.retries = Retry(total=config.LINE_CONNECT_RETRIES, connect=config.LINE_CONNECT_RETRIES,
+                                  read=0, status=0, other=0, redirect=0, backoff_factor=0.2)
+    # 閒置連線送 TCP keepalive，避免被中間的 NAT / 負載平衡器靜默切斷
+    configuration.socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    return configuration
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_api_client() -> PooledApiClient:
+    """應用程式共用的 ApiClient（第一次使用時建立）"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = PooledApiClient(create_configuration(),
+                                      timeout=(config.LINE_CONNECT_TIMEOUT, config.LINE_READ_TIMEOUT))
+            atexit.register(_client.close)
+        return _client
+
+
+def messaging_api() -> MessagingApi:
+    return MessagingApi(get_api_client())
+
+
+def blob_api() -> MessagingApiBlob:
+    return MessagingApiBlob(get_api_client())
+
+
+_async_client = None
+
+
+def get_async_api_client() -> AsyncPooledApiClient:
+    """目前 event loop 共用的 AsyncApiClient（第一次使用時建立；aiohttp session 綁定 event loop）"""
+    global _async_client
+    if _async_client is None:
+        configuration = create_configuration()
+        configuration.connection_pool_maxsize = config.LINE_ASYNC_POOL_MAXSIZE
+        _async_client = AsyncPooledApiClient(
+            configuration,
+            timeout=aiohttp.ClientTimeout(sock_connect=config.LINE_CONNECT_TIMEOUT,
+                                          sock_read=config.LINE_READ_TIMEOUT),
+        )
+    return _async_client
+
+
+async def close_async_api_client():
+    """event loop 結束前呼叫（ASGI lifespan shutdown）"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+def async_messaging_api() -> AsyncMessagingApi:
+    return AsyncMessagingApi(get_async_api_client())
+
+
+def async_blob_api() -> AsyncMessagingApiBlob:
+    return AsyncMessagingApiBlob(get_async_api_client())
@@ -0,0 +1,184 @@
+"""
+LINE Messaging API / 內容下載 API 的本機替身，供壓力測試（LineBot.loadtest）與本機開發使用。
+
+支援：
+- POST /v2/bot/message/reply      記錄回覆；同一個 reply token 只能用一次（與 LINE 相同，重複使用回 400）
+- POST /v2/bot/message/push       記錄 push
+- GET  /v2/bot/message/{id}/content   回傳圖片（--images 目錄中的圖片依訊息 id 輪流使用，預設為 chat.webp）
+- GET  /_standin/messages?since=時間戳   取出記錄的回覆 / push（JSON）
+- GET  /_standin/stats            各端點的請求數
+- POST /_standin/reset            清除記錄
+
+執行：
+    python LineBot/line_standin.py --port 8790 --latency 0.05
+然後設定 app 的 LINE_API_HOST=http://127.0.0.1:8790（回覆、push、下載圖片都會送到這裡）
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE = os.path.join(project_root, "chat.webp")
+CONTENT_TYPES = {".webp": "image/webp", ".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+MAX_RECORDS = 100000
+
+
+class _Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = collections.deque(maxlen=MAX_RECORDS)
+        self.used_tokens = set()
+        self.counts = collections.Counter()
+
+    def record(self, kind, body):
+        """記錄一次回覆 / push；reply token 重複使用時回傳 False"""
+        with self.lock:
+            if kind == "reply":
+                token = body.get("replyToken")
+                if token in self.used_tokens:
+                    self.counts["reply_invalid_token"] += 1
+                    return False
+                self.used_tokens.add(token)
+            self.counts[kind] += 1
+            self.records.append({
+                "time": time.time(),
+                "kind": kind,
+                "to": body.get("to"),
+                "reply_token": body.get("replyToken"),
+                "messages": body.get("messages", []),
+            })
+            return True
+
+    def since(self, timestamp):
+        with self.lock:
+            return [r for r in self.records if r["time"] >= timestamp]
+
+    def reset(self):
+        with self.lock:
+            self.records.clear()
+            self.used_tokens.clear()
+            self.counts.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "line-standin"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        latency = self.server.latency
+        if latency:
+            time.sleep(random.uniform(0.5 * latency, 1.5 * latency))
+
+    def _authorized(self):
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._send(401, {"message": "Authentication failed. Confirm that the access token in the authorization header is valid."})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if url.path == "/_standin/messages":
+            since = float(parse_qs(url.query).get("since", ["0"])[0])
+            self._send(200, self.server.recorder.since(since))
+        elif url.path == "/_standin/stats":
+            with self.server.recorder.lock:
+                self._send(200, dict(self.server.recorder.counts))
+        elif len(parts) == 5 and parts[:3] == ["v2", "bot", "message"] and parts[4] == "content":
+            if not self._authorized():
+                return
+            self._delay()
+            images = self.server.images
+            path = images[zlib.crc32(parts[3].encode()) % len(images)]
+            with self.server.recorder.lock:
+                self.server.recorder.counts["content"] += 1
+            with open(path, "rb") as f:
+                content = f.read()
+            self._send(200, content, CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream"))
+        else:
+            self._send(404, {"message": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if url.path == "/_standin/reset":
+            self.server.recorder.reset()
+            self._send(200, {})
+            return
+        kind = {"/v2/bot/message/reply": "reply", "/v2/bot/message/push": "push"}.get(url.path)
+        if kind is None:
+            self._send(404, {"message": "Not found"})
+            return
+        if not self._authorized():
+            return
+        self._delay()
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send(400, {"message": "The request body has 1 error(s)"})
+            return
+        if not self.server.recorder.record(kind, payload):
+            self._send(400, {"message": "Invalid reply token"})
+            return
+        self._send(200, {"sentMessages": [{"id": str(random.getrandbits(60)), "quoteToken": "q"}
+                                          for _ in payload.get("messages", [])]})
+
+
+def list_images(directory=None):
+    """替身回傳的圖片清單（目錄中的圖片依檔名排序，沒有時使用 chat.webp）"""
+    if directory:
+        images = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                        if os.path.splitext(name)[1].lower() in CONTENT_TYPES)
+        if images:
+            return images
+    return [DEFAULT_IMAGE]
+
+
+def serve(host="127.0.0.1", port=8790, images=None, latency=0.0, background=False):
+    """
+    啟動替身伺服器。
+
+    Args:
+        images (str): 圖片目錄（下載訊息內容時回傳）
+        latency (float): 每個 API 請求的平均延遲（秒，實際為 0.5 ~ 1.5 倍隨機）
+        background (bool): True 時在背景執行緒執行並回傳 server（壓力測試程式內嵌使用）
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.recorder = _Recorder()
+    server.images = list_images(images)
+    server.latency = latency
+    if background:
+        threading.Thread(target=server.serve_forever, name="line-standin", daemon=True).start()
+        return server
+    print(f"🧪 LINE 替身：http://{host}:{port}（{len(server.images)} 張圖片，延遲 {latency}s）")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LINE Messaging API 本機替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--images", help="圖片目錄（預設使用 chat.webp）")
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的平均延遲（秒）")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.images, args.latency)
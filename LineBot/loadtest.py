@@ -0,0 +1,273 @@
+"""
+端對端壓力測試：模擬多位使用者送出帶正確 X-Line-Signature 的 webhook
+（加好友 → 選功能 → 傳圖片 → 開始分析），以固定速率打到 /callback，
+再從 LINE 替身（LineBot/line_standin.py）收集回覆 / push，統計：
+- webhook 吞吐量、各類事件的回應延遲百分位、HTTP 錯誤率
+- 「開始分析」到收到結果的端對端時間（reply 或 push）、被拒絕 / 失敗 / 逾時的比例
+
+執行（app 的 LINE_API_HOST 指向替身，CHANNEL_SECRET 與本程式相同）：
+    python LineBot/line_standin.py --port 8790
+    LINE_API_HOST=http://127.0.0.1:8790 python app.py            （或 uvicorn asgi_app:app --port 5000）
+    python -m LineBot.loadtest --url http://127.0.0.1:5000/callback --users 100 --rate 5 --images 3
+
+--start-standin 會在本程式內啟動替身（app 仍需指向同一個埠）。
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+# 將專案根目錄加入 Python 路徑（直接以檔案執行時）
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from LineBot import config
+from LineBot.job_queue import percentile
+
+MODES = {"analysis": "感情分析", "sticker": "智慧表情包"}
+INTERIM_PREFIX = "🔄"            # 「正在分析…」，結果之後會 push
+REJECTED_PREFIXES = ("⏳", "🚦")  # 准入控制拒絕
+FAILED_PREFIX = "❌"
+
+
+def sign(body: bytes, secret: str) -> str:
+    """LINE webhook 簽章：HMAC-SHA256(channel secret, body) 的 base64"""
+    return base64.b64encode(hmac.new(secret.encode("utf8"), body, hashlib.sha256).digest()).decode()
+
+
+def _event(kind, user_id, **fields):
+    event = {
+        "type": kind,
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+    }
+    event.update(fields)
+    return event
+
+
+def follow_event(user_id):
+    return _event("follow", user_id, follow={"isUnblocked": False})
+
+
+def text_event(user_id, text):
+    return _event("message", user_id, message={
+        "id": str(random.getrandbits(52)), "type": "text", "text": text, "quoteToken": uuid.uuid4().hex,
+    })
+
+
+def image_event(user_id):
+    return _event("message", user_id, message={
+        "id": str(random.getrandbits(52)), "type": "image", "quoteToken": uuid.uuid4().hex,
+        "contentProvider": {"type": "line"},
+    })
+
+
+class LoadTest:
+    def __init__(self, url, standin, secret, images=2, think=0.5, timeout=30):
+        self.url = url
+        self.standin = standin.rstrip("/")
+        self.secret = secret
+        self.images = images
+        self.think = think
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.requests = []   # (事件種類, HTTP 狀態或錯誤, 延遲秒數)
+        self.starts = {}     # user_id → (送出「開始分析」的時間, reply token)
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def post(self, kind, event):
+        """送出一個帶簽章的 webhook，回傳送出的時間"""
+        body = json.dumps({"destination": "Uloadtest", "events": [event]}, ensure_ascii=False).encode("utf8")
+        headers = {"Content-Type": "application/json", "X-Line-Signature": sign(body, self.secret)}
+        start = time.time()
+        try:
+            status = self._session().post(self.url, data=body, headers=headers, timeout=self.timeout).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        with self.lock:
+            self.requests.append((kind, status, time.time() - start))
+        return start
+
+    def run_user(self, index):
+        """一位使用者的完整流程"""
+        user_id = "U" + hashlib.md5(f"loadtest-{index}".encode()).hexdigest()
+        mode = list(MODES)[index % len(MODES)]
+        self.post("follow", follow_event(user_id))
+        time.sleep(self.think)
+        self.post("text", text_event(user_id, MODES[mode]))
+        for _ in range(self.images):
+            time.sleep(self.think)
+            self.post("image", image_event(user_id))
+        time.sleep(self.think)
+        event = text_event(user_id, "開始分析")
+        sent = self.post("start", event)
+        with self.lock:
+            self.starts[user_id] = (sent, event["replyToken"])
+
+    def run(self, users, rate, concurrency):
+        """每秒 rate 位新使用者，同時最多 concurrency 位進行中"""
+        begin = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadtest") as pool:
+            for i in range(users):
+                delay = begin + i / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.run_user, i)
+        return begin
+
+    def collect(self, begin, wait):
+        """等待所有「開始分析」的結果（最多 wait 秒），回傳 user_id → (結果, 端對端秒數)"""
+        deadline = time.time() + wait
+        while True:
+            records = requests.get(f"{self.standin}/_standin/messages", params={"since": begin}, timeout=10).json()
+            outcomes = self._outcomes(records)
+            if all(outcome != "pending" for outcome, _ in outcomes.values()) or time.time() >= deadline:
+                return {user: (("timeout", None) if outcome == "pending" else (outcome, elapsed))
+                        for user, (outcome, elapsed) in outcomes.items()}
+            time.sleep(1)
+
+    def _outcomes(self, records):
+        replies = {r["reply_token"]: r for r in records if r["kind"] == "reply"}
+        pushes = {}
+        for r in records:
+            if r["kind"] == "push":
+                pushes.setdefault(r["to"], []).append(r)
+        outcomes = {}
+        for user_id, (sent, token) in self.starts.items():
+            reply = replies.get(token)
+            text = _first_text(reply)
+            if reply is None:
+                outcomes[user_id] = ("pending", None)
+            elif text.startswith(REJECTED_PREFIXES):
+                outcomes[user_id] = ("rejected", reply["time"] - sent)
+            elif not text.startswith(INTERIM_PREFIX):
+                outcomes[user_id] = ("failed" if text.startswith(FAILED_PREFIX) else "reply", reply["time"] - sent)
+            else:
+                push = next((p for p in pushes.get(user_id, []) if p["time"] >= sent), None)
+                if push is None:
+                    outcomes[user_id] = ("pending", None)
+                else:
+                    failed = _first_text(push).startswith(FAILED_PREFIX)
+                    outcomes[user_id] = ("failed" if failed else "push", push["time"] - sent)
+        return outcomes
+
+
+def _first_text(record):
+    if record is None:
+        return ""
+    return next((m.get("text", "") for m in record["messages"] if m.get("type") == "text"), "")
+
+
+def _latency_stats(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "p99": percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+
+def summarize(test, begin, end, outcomes):
+    webhook = {}
+    for kind in sorted({kind for kind, _, _ in test.requests}):
+        rows = [(status, elapsed) for k, status, elapsed in test.requests if k == kind]
+        webhook[kind] = _latency_stats([elapsed for _, elapsed in rows])
+        webhook[kind]["errors"] = sum(1 for status, _ in rows if status != 200)
+    statuses = {}
+    for _, status, _ in test.requests:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    results = {}
+    for outcome, _ in outcomes.values():
+        results[outcome] = results.get(outcome, 0) + 1
+    total = len(test.requests)
+    return {
+        "duration_seconds": end - begin,
+        "webhooks": total,
+        "throughput_rps": total / (end - begin) if end > begin else 0.0,
+        "error_rate": (total - statuses.get("200", 0)) / total if total else 0.0,
+        "statuses": statuses,
+        "webhook_latency": webhook,
+        "analysis_results": results,
+        "analysis_latency": _latency_stats([elapsed for outcome, elapsed in outcomes.values()
+                                            if outcome in ("reply", "push")]),
+    }
+
+
+def print_report(report):
+    print(f"📊 {report['webhooks']} 個 webhook，{report['duration_seconds']:.1f} 秒，"
+          f"{report['throughput_rps']:.1f} req/s，錯誤率 {report['error_rate']:.2%}")
+    print(f"   HTTP 狀態：{report['statuses']}")
+    for kind, stats in report["webhook_latency"].items():
+        if stats["count"]:
+            print(f"   {kind:<7} n={stats['count']:<6} p50={stats['p50'] * 1000:.0f}ms "
+                  f"p90={stats['p90'] * 1000:.0f}ms p99={stats['p99'] * 1000:.0f}ms "
+                  f"max={stats['max'] * 1000:.0f}ms errors={stats['errors']}")
+    print(f"🧾 分析結果：{report['analysis_results']}")
+    stats = report["analysis_latency"]
+    if stats["count"]:
+        print(f"   端對端 n={stats['count']} p50={stats['p50']:.2f}s p90={stats['p90']:.2f}s "
+              f"p99={stats['p99']:.2f}s max={stats['max']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE Bot 端對端壓力測試")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/callback", help="webhook 網址")
+    parser.add_argument("--standin", default="http://127.0.0.1:8790", help="LINE 替身網址（app 的 LINE_API_HOST）")
+    parser.add_argument("--start-standin", action="store_true", help="在本程式內啟動 LINE 替身")
+    parser.add_argument("--standin-latency", type=float, default=0.0, help="內建替身的 API 延遲（秒）")
+    parser.add_argument("--users", type=int, default=50, help="模擬使用者數")
+    parser.add_argument("--rate", type=float, default=5, help="每秒開始的使用者數")
+    parser.add_argument("--images", type=int, default=2, help="每位使用者上傳的圖片數")
+    parser.add_argument("--think", type=float, default=0.5, help="同一位使用者兩個事件之間的間隔（秒）")
+    parser.add_argument("--concurrency", type=int, default=200, help="同時進行中的使用者上限")
+    parser.add_argument("--wait", type=float, default=300, help="送完後最多等待分析結果幾秒")
+    parser.add_argument("--json", help="另外把統計結果寫成 JSON 檔")
+    args = parser.parse_args()
+
+    if not config.CHANNEL_SECRET:
+        parser.error("請先設定環境變數 CHANNEL_SECRET（需與受測的 app 相同）")
+    if args.start_standin:
+        from LineBot import line_standin
+
+        standin = urlparse(args.standin)
+        line_standin.serve(standin.hostname, standin.port, latency=args.standin_latency, background=True)
+
+    test = LoadTest(args.url, args.standin, config.CHANNEL_SECRET, args.images, args.think)
+    print(f"🚀 {args.users} 位使用者，每秒 {args.rate} 位 → {args.url}")
+    begin = test.run(args.users, args.rate, args.concurrency)
+    end = time.time()
+    outcomes = test.collect(begin, args.wait)
+    report = summarize(test, begin, end, outcomes)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+LINE 訊息的組裝：Flask 版（app.py）與 asyncio 版（asgi_app.py）共用，兩邊回覆的內容一致。
+"""
+from linebot.v3.messaging import (
+    TextMessage,
+    ImageMessage,
+    TemplateMessage,
+    ButtonsTemplate,
+    MessageAction,
+    QuickReply,
+    QuickReplyItem
+)
+
+from LineBot.admission import USER_BUSY
+
+MAX_TEXT_LENGTH = 5000     # LINE 單則文字訊息上限
+MAX_MESSAGES = 5           # LINE 一次最多發送 5 則訊息
+
+
+def get_menu_message():
+    """建立功能選單的 Buttons Template 訊息"""
+    return TemplateMessage(
+        alt_text="請選擇功能",
+        template=ButtonsTemplate(
+            title="💬 聊天分析助手",
+            text="請選擇你想要的功能：",
+            actions=[
+                MessageAction(
+                    label="❤️ 感情分析",
+                    text="感情分析"
+                ),
+                MessageAction(
+                    label="😆 智慧表情包",
+                    text="智慧表情包"
+                )
+            ]
+        )
+    )
+
+
+def get_quick_reply():
+    """建立 Quick Reply 按鈕（選擇功能）"""
+    return QuickReply(
+        items=[
+            QuickReplyItem(
+                action=MessageAction(
+                    label="❤️ 感情分析",
+                    text="感情分析"
+                )
+            ),
+            QuickReplyItem(
+                action=MessageAction(
+                    label="😆 智慧表情包",
+                    text="智慧表情包"
+                )
+            ),
+            QuickReplyItem(
+                action=MessageAction(
+                    label="📋 功能選單",
+                    text="選單"
+                )
+            )
+        ]
+    )
+
+
+def get_upload_quick_reply(image_count):
+    """建立上傳圖片時的 Quick Reply 按鈕"""
+    items = [
+        QuickReplyItem(
+            action=MessageAction(
+                label="❌ 取消",
+                text="取消"
+            )
+        )
+    ]
+    
+    # 有 1 張以上圖片時，顯示「開始分析」按鈕
+    if image_count >= 1:
+        items.insert(0, QuickReplyItem(
+            action=MessageAction(
+                label=f"🚀 開始分析 ({image_count}張)",
+                text="開始分析"
+            )
+        ))
+    
+    return QuickReply(items=items)
+
+
+def analysis_result_messages(ai_result):
+    """感情分析的最終回覆（結果太長時截斷）"""
+    if len(ai_result) > MAX_TEXT_LENGTH:
+        ai_result = ai_result[:MAX_TEXT_LENGTH - 100] + "\n\n...（內容過長已截斷）"
+
+    return [
+        TextMessage(
+            text=ai_result,
+            quick_reply=get_quick_reply()
+        )
+    ]
+
+
+def sticker_result_messages(image_urls):
+    """智慧表情包的最終回覆：只保留有效的 https 網址"""
+    messages = [
+        ImageMessage(
+            original_content_url=image_url,
+            preview_image_url=image_url
+        )
+        for image_url in image_urls
+        if isinstance(image_url, str) and image_url.startswith("https")
+    ]
+
+    if not messages:
+        return [
+            TextMessage(
+                text="找不到適合的表情包 QQ\n要不要換張圖片試試？",
+                quick_reply=get_quick_reply()
+            )
+        ]
+
+    # 保留最後一則給說明文字
+    messages = messages[:MAX_MESSAGES - 1]
+    messages.append(
+        TextMessage(
+            text=f"✨ 以上是推薦給你的 {len(messages)} 個表情包！",
+            quick_reply=get_quick_reply()
+        )
+    )
+    return messages
+
+
+# ===== 各指令的回覆 =====
+
+def welcome_messages():
+    """加入好友：歡迎訊息與功能選單"""
+    return [
+        TextMessage(
+            text="👋 歡迎使用聊天分析助手！\n\n我可以幫你：\n❤️ 分析聊天對話的感情狀態\n😆 根據對話推薦適合的表情包\n\n請選擇下方功能開始使用 ⬇️"
+        ),
+        get_menu_message()
+    ]
+
+
+UPLOAD_PROMPTS = {
+    "analysis": "📸 請傳送聊天截圖\n\n💡 可以傳送多張圖片，傳完後點「開始分析」按鈕",
+    "sticker": "📸 請傳送聊天截圖\n\n� 可以傳送多張圖片，傳完後點「開始分析」按鈕",
+}
+
+
+def upload_prompt_message(mode):
+    """選擇功能後，請使用者上傳截圖"""
+    return TextMessage(text=UPLOAD_PROMPTS[mode], quick_reply=get_upload_quick_reply(0))
+
+
+def no_images_messages():
+    """還沒上傳圖片就按「開始分析」，或 session 在等待期間過期 / 被取消"""
+    return [
+        TextMessage(text="⚠️ 還沒有上傳圖片喔！請先選擇功能並上傳圖片"),
+        get_menu_message()
+    ]
+
+
+def busy_message(reason, image_count):
+    """超過同時分析上限（reason 為 admission.BUSY 或 USER_BUSY）；已上傳的圖片保留，稍後再按即可"""
+    if reason == USER_BUSY:
+        text = "⏳ 你的上一個分析還在進行中，完成後再試一次喔！"
+    else:
+        text = "🚦 目前使用的人比較多，請稍後再點「開始分析」"
+    return TextMessage(text=text, quick_reply=get_upload_quick_reply(image_count))
+
+
+def analyzing_message(image_count):
+    """分析來不及在 reply 期限內完成時的處理中訊息"""
+    return TextMessage(text=f"🔄 正在分析 {image_count} 張圖片，請稍候...")
+
+
+def cancelled_messages():
+    return [TextMessage(text="已取消 ✅"), get_menu_message()]
+
+
+def unknown_command_messages():
+    """未知指令：顯示選單"""
+    return [
+        TextMessage(
+            text="你想做什麼呢？請點選下方按鈕選擇功能 �",
+            quick_reply=get_quick_reply()
+        ),
+        get_menu_message()
+    ]
+
+
+def choose_feature_messages():
+    """還沒選擇功能就傳圖片"""
+    return [TextMessage(text="請先選擇功能 😊"), get_menu_message()]
+
+
+def image_limit_message(limit, image_count):
+    """已達每次分析的張數上限"""
+    return TextMessage(
+        text=f"⚠️ 每次最多分析 {limit} 張圖片，請點「開始分析」",
+        quick_reply=get_upload_quick_reply(image_count)
+    )
+
+
+def image_received_message(image_count):
+    """收到圖片：依張數回覆不同訊息"""
+    if image_count == 1:
+        text = "✅ 收到第 1 張圖片！\n\n👆 點「開始分析」立即處理\n📸 或繼續傳送更多圖片"
+    else:
+        text = f"✅ 已收到 {image_count} 張圖片！\n\n👆 點「開始分析」開始處理\n📸 或繼續傳送更多圖片"
+    return TextMessage(text=text, quick_reply=get_upload_quick_reply(image_count))
+
+
+def no_text_messages():
+    """感情分析：所有圖片都辨識不到文字"""
+    return [
+        TextMessage(
+            text="⚠️ 無法辨識任何圖片中的文字，請確認是否為聊天截圖。",
+            quick_reply=get_quick_reply()
+        )
+    ]
+
+
+def error_messages(error):
+    """分析過程發生錯誤（web 行程直接回覆；worker 改由佇列重試）"""
+    return [
+        TextMessage(
+            text=f"❌ 處理過程發生錯誤：{str(error)}",
+            quick_reply=get_quick_reply()
+        )
+    ]
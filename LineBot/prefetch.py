@@ -0,0 +1,180 @@
+"""
+圖片一上傳就在背景開始處理，按下「開始分析」時只需等待尚未完成的部分。
+
+- 感情分析模式：預先做 OCR
+- 智慧表情包模式：預先做完整的表情包推薦
+
+結果寫回 session（sessions.set_result），所以其他 worker 處理「開始分析」時也拿得到；
+本行程送出的工作另以 Future 保存，取結果時優先等待它，避免重做。
+取不到結果（工作失敗、在其他 worker 尚未完成）時就地重新處理。
+排隊中的工作超過 max_pending 時不再預先處理（之後就地處理），避免尖峰時無限堆積。
+背景工作在送出時的 context 執行，OCR / Gemini 的 span 會掛在上傳圖片那個請求的 trace 下。
+
+AsyncPrefetcher 是 asyncio 版本（asgi_app.py）：處理函式為 coroutine，以 Task 取代執行緒，
+同時進行的數量由 concurrency 限制。
+
+指標：linebot_prefetch_results_total{mode, source}、linebot_prefetch_shed_total{mode}
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common import metrics, tracing
+from AI_response.quota import user_context
+
+RESULTS = metrics.counter("linebot_prefetch_results_total", "預先處理結果的來源", ["mode", "source"])
+SHED = metrics.counter("linebot_prefetch_shed_total", "因佇列已滿而略過的預先處理", ["mode"])
+
+
+class Prefetcher:
+    def __init__(self, sessions, tasks: dict, workers: int = 4, wait: float = 120, max_pending: int = 64):
+        """
+        Args:
+            sessions: SessionStore，結果寫回這裡
+            tasks (dict): 模式 → 處理函式 fn(圖片參照)，回傳值需可 JSON 序列化
+            workers (int): 背景執行緒數
+            wait (float): 取結果時最多等待背景工作幾秒，逾時改為就地處理
+            max_pending (int): 未完成的背景工作上限
+        """
+        self.sessions = sessions
+        self.tasks = tasks
+        self.wait = wait
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._futures = {}   # 圖片參照 → Future
+
+    def _run(self, user_id, mode, ref):
+        # 背景執行緒不會繼承 contextvar，Gemini 配額需重新指定使用者
+        with user_context(user_id):
+            return self.tasks[mode](ref)
+
+    def submit(self, user_id, mode, ref):
+        """圖片收到後立刻呼叫，在背景開始處理"""
+        if mode not in self.tasks:
+            return
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                SHED.inc(mode=mode)
+                return
+            future = self._executor.submit(contextvars.copy_context().run, self._run, user_id, mode, ref)
+            self._futures[ref] = future
+        future.add_done_callback(lambda f: self._store(user_id, ref, f))
+
+    def _store(self, user_id, ref, future):
+        try:
+            if not future.cancelled() and future.exception() is None:
+                self.sessions.set_result(user_id, ref, future.result())
+        except Exception as e:
+            print(f"⚠️ 預先處理結果寫入 session 失敗：{e}")
+        finally:
+            with self._lock:
+                if self._futures.get(ref) is future:
+                    del self._futures[ref]
+
+    @tracing.traced("prefetch_result")
+    def result(self, user_id, mode, ref):
+        """取得某張圖片的處理結果：本行程的 Future → session 內的結果 → 就地處理"""
+        with self._lock:
+            future = self._futures.get(ref)
+        if future is not None:
+            try:
+                value = future.result(timeout=self.wait)
+                RESULTS.inc(mode=mode, source="future")
+                tracing.set_attributes(source="future")
+                return value
+            except Exception as e:
+                print(f"⚠️ 預先處理失敗，改為就地處理：{e}")
+
+        session = self.sessions.get(user_id)
+        if session and ref in session["results"]:
+            RESULTS.inc(mode=mode, source="session")
+            tracing.set_attributes(source="session")
+            return session["results"][ref]
+
+        RESULTS.inc(mode=mode, source="inline")
+        tracing.set_attributes(source="inline")
+        return self.tasks[mode](ref)
+
+    def forget(self, refs):
+        """session 結束時呼叫：取消還沒開始的工作"""
+        with self._lock:
+            futures = [self._futures.pop(ref) for ref in refs if ref in self._futures]
+        for future in futures:
+            future.cancel()
+
+
+class AsyncPrefetcher:
+    def __init__(self, sessions, tasks: dict, concurrency: int = 64, wait: float = 120, max_pending: int = 1024):
+        """
+        Args:
+            sessions: SessionStore（阻塞式操作在 thread pool 執行）
+            tasks (dict): 模式 → async 處理函式 fn(圖片參照)，回傳值需可 JSON 序列化
+            concurrency (int): 同時進行的處理數
+            wait (float): 取結果時最多等待背景工作幾秒，逾時改為就地處理
+            max_pending (int): 未完成的背景工作上限
+        """
+        self.sessions = sessions
+        self.tasks = tasks
+        self.wait = wait
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending = {}   # 圖片參照 → Task
+
+    async def _run(self, user_id, mode, ref):
+        async with self._semaphore:
+            # Task 建立時已複製 contextvar，這裡仍明確指定，與同步版本一致
+            with user_context(user_id):
+                result = await self.tasks[mode](ref)
+        try:
+            await asyncio.to_thread(self.sessions.set_result, user_id, ref, result)
+        except Exception as e:
+            print(f"⚠️ 預先處理結果寫入 session 失敗：{e}")
+        return result
+
+    def submit(self, user_id, mode, ref):
+        """圖片收到後立刻呼叫（需在 event loop 內），在背景開始處理"""
+        if mode not in self.tasks:
+            return
+        if len(self._pending) >= self.max_pending:
+            SHED.inc(mode=mode)
+            return
+        task = asyncio.create_task(self._run(user_id, mode, ref))
+        self._pending[ref] = task
+        task.add_done_callback(lambda t: self._pending.pop(ref, None) if self._pending.get(ref) is t else None)
+
+    @tracing.traced("prefetch_result")
+    async def result(self, user_id, mode, ref):
+        """取得某張圖片的處理結果：本行程的 Task → session 內的結果 → 就地處理"""
+        task = self._pending.get(ref)
+        if task is not None:
+            try:
+                # shield：逾時只放棄等待，背景工作繼續把結果寫回 session
+                value = await asyncio.wait_for(asyncio.shield(task), self.wait)
+                RESULTS.inc(mode=mode, source="future")
+                tracing.set_attributes(source="future")
+                return value
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise   # 取消的是呼叫端自己
+                print("⚠️ 預先處理已取消，改為就地處理")
+            except Exception as e:
+                print(f"⚠️ 預先處理失敗，改為就地處理：{e}")
+
+        session = await asyncio.to_thread(self.sessions.get, user_id)
+        if session and ref in session["results"]:
+            RESULTS.inc(mode=mode, source="session")
+            tracing.set_attributes(source="session")
+            return session["results"][ref]
+
+        RESULTS.inc(mode=mode, source="inline")
+        tracing.set_attributes(source="inline")
+        return await self.tasks[mode](ref)
+
+    def forget(self, refs):
+        """session 結束時呼叫：取消還沒完成的工作"""
+        for ref in refs:
+            task = self._pending.pop(ref, None)
+            if task is not None:
+                task.cancel()
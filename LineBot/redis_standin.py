@@ -0,0 +1,237 @@
+"""
+Redis 的本機替身（RESP2 / RESP3），只實作 RedisSessionStore 用到的指令，
+讓多個 worker 在沒有真正 Redis 的開發環境也能共用 session。
+
+支援：PING、SET（NX / EX）、DEL、EXISTS、RPUSH、RPUSHX、LRANGE、LREM、HSET、HGETALL、EXPIRE、TTL、MULTI/EXEC/DISCARD、
+      WATCH/UNWATCH、
+      HELLO / SELECT / CLIENT（redis-py 連線時會送）
+
+執行：
+    python LineBot/redis_standin.py --port 6390
+然後設定 SESSION_STORE_URL=redis://127.0.0.1:6390/0
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()   # 每個指令（或整個 MULTI）在鎖內執行，等同 Redis 的單執行緒語意
+        self.data = {}      # key → list[bytes] 或 dict[bytes, bytes]
+        self.expires = {}   # key → 到期時間
+        self.versions = {}  # key → 修改次數（WATCH 用；刪除、過期也算修改）
+
+    def _alive(self, key):
+        exp = self.expires.get(key)
+        if exp is not None and exp <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self._changed(key)
+        return key in self.data
+
+    def _changed(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def version(self, key):
+        self._alive(key)
+        return self.versions.get(key, 0)
+
+    def execute(self, cmd, args):
+        name = cmd.upper()
+        if name == "PING":
+            return "+PONG"
+        if name in ("SELECT", "CLIENT"):
+            return "+OK"
+        if name == "HELLO":
+            # 新版 redis-py 預設以 HELLO 3 協商 RESP3；除了 map 以外，本替身用到的回應型別在 RESP2/3 相同
+            proto = int(args[0]) if args else 2
+            return {b"server": b"redis", b"version": b"7.0.0", b"proto": proto, b"mode": b"standalone"}
+        if name == "SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            if "NX" in options and self._alive(key):
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            self._changed(key)
+            if "EX" in options:
+                self.expires[key] = time.time() + int(options[options.index("EX") + 1])
+            return "+OK"
+        if name == "DEL":
+            n = 0
+            for key in args:
+                if self._alive(key):
+                    n += 1
+                    self._changed(key)
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return n
+        if name == "EXISTS":
+            return sum(1 for key in args if self._alive(key))
+        if name in ("RPUSH", "RPUSHX"):
+            key, values = args[0], args[1:]
+            if not self._alive(key):
+                if name == "RPUSHX":
+                    return 0
+                self.data[key] = []
+            self.data[key].extend(values)
+            self._changed(key)
+            return len(self.data[key])
+        if name == "LRANGE":
+            key, start, stop = args[0], int(args[1]), int(args[2])
+            items = self.data.get(key, []) if self._alive(key) else []
+            stop = len(items) if stop == -1 else stop + 1
+            return list(items[start:stop])
+        if name == "LREM":
+            key, count, value = args[0], int(args[1]), args[2]
+            items = self.data.get(key, []) if self._alive(key) else []
+            indexes = [i for i, item in enumerate(items) if item == value]
+            if count < 0:
+                indexes = indexes[::-1][:-count]
+            elif count > 0:
+                indexes = indexes[:count]
+            for i in sorted(indexes, reverse=True):
+                del items[i]
+            if indexes:
+                self._changed(key)
+            return len(indexes)
+        if name == "HSET":
+            key, pairs = args[0], args[1:]
+            if not self._alive(key):
+                self.data[key] = {}
+            added = sum(1 for field in pairs[0::2] if field not in self.data[key])
+            self.data[key].update(zip(pairs[0::2], pairs[1::2]))
+            self._changed(key)
+            return added
+        if name == "HGETALL":
+            key = args[0]
+            return dict(self.data.get(key, {}) if self._alive(key) else {})
+        if name == "EXPIRE":
+            key, seconds = args[0], int(args[1])
+            if not self._alive(key):
+                return 0
+            self.expires[key] = time.time() + seconds
+            self._changed(key)
+            return 1
+        if name == "TTL":
+            key = args[0]
+            if not self._alive(key):
+                return -2
+            exp = self.expires.get(key)
+            return -1 if exp is None else int(exp - time.time())
+        return Exception(f"ERR unknown command '{cmd}'")
+
+
+def _encode(value, proto=2) -> bytes:
+    if isinstance(value, str) and value.startswith("+"):
+        return value.encode() + b"\r\n"
+    if isinstance(value, Exception):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if value is None:
+        return b"_\r\n" if proto == 3 else b"$-1\r\n"
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v, proto) for v in value)
+    if isinstance(value, dict):
+        # HELLO / HGETALL 的回應：RESP3 為 map，RESP2 為攤平的 array
+        if proto == 3:
+            return b"%%%d\r\n" % len(value) + b"".join(_encode(k, proto) + _encode(v, proto)
+                                                         for k, v in value.items())
+        return _encode([x for kv in value.items() for x in kv], proto)
+    raise TypeError(value)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()   # inline 指令（redis-cli / telnet）
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        queued = None
+        watched = {}   # WATCH 的 key → 當時的修改次數
+        proto = 2
+        while True:
+            parts = self._read_command()
+            if parts is None:
+                return
+            if not parts:
+                continue
+            cmd = parts[0].decode()
+            upper = cmd.upper()
+            # key 與數字參數轉成字串，list / hash 的值保留 bytes
+            if upper in ("RPUSH", "RPUSHX", "HSET"):
+                args = [p.decode() for p in parts[1:2]] + parts[2:]
+            elif upper == "LREM":
+                args = [p.decode() for p in parts[1:3]] + parts[3:]
+            else:
+                args = [p.decode() for p in parts[1:]]
+
+            if upper == "WATCH" and queued is not None:
+                reply = Exception("ERR WATCH inside MULTI is not allowed")
+            elif upper == "WATCH":
+                with store.lock:
+                    watched.update((key, store.version(key)) for key in args)
+                reply = "+OK"
+            elif upper == "UNWATCH":
+                watched = {}
+                reply = "+OK"
+            elif upper == "MULTI":
+                queued = []
+                reply = "+OK"
+            elif upper == "DISCARD":
+                queued = None
+                watched = {}
+                reply = "+OK"
+            elif upper == "EXEC":
+                with store.lock:
+                    if any(store.version(key) != v for key, v in watched.items()):
+                        reply = None   # WATCH 的 key 被改過：交易不執行
+                    else:
+                        reply = [store.execute(c, a) for c, a in (queued or [])]
+                queued = None
+                watched = {}
+            elif queued is not None:
+                queued.append((cmd, args))
+                reply = "+QUEUED"
+            else:
+                with store.lock:
+                    reply = store.execute(cmd, args)
+                if upper == "HELLO" and isinstance(reply, dict):
+                    proto = reply[b"proto"]
+            self.wfile.write(_encode(reply, proto))
+
+
+class RedisStandin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=6390):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis 本機替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    server = RedisStandin(args.host, args.port)
+    print(f"🧪 Redis 替身啟動：redis://{args.host}:{args.port}/0")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+回覆結果時優先使用 reply token，來不及才改用 push。
+
+處理函式在背景執行，webhook 最多等待 wait 秒：
+- 時間內完成：直接用 reply token 回覆最終結果（少一則「處理中」訊息，也不佔 push 額度）
+- 逾時：先用 reply token 回覆處理中訊息，結果完成後再 push
+- reply 失敗（token 過期等）時同樣改用 push
+
+使用持久化佇列時（respond_from_queue），工作由 worker 行程執行：
+web 行程在 wait 秒內輪詢結果，拿到就 reply；否則回覆處理中，由 worker push。
+送出成功後才標記為已送達，reply 與 push 都失敗時由 worker 重送。
+
+AsyncResponder 是 asyncio 版本（asgi_app.py）：處理函式為 coroutine，等待期間不佔執行緒。
+
+指標：linebot_responses_total{via}、linebot_response_seconds{via}
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from linebot.v3.messaging import Message, ReplyMessageRequest, PushMessageRequest
+
+from common import metrics
+from LineBot import line_client
+
+RESPONSES = metrics.counter("linebot_responses_total", "最終結果的送出方式", ["via"])
+LATENCY = metrics.histogram("linebot_response_seconds", "從收到請求到送出最終結果的時間", ["via"])
+
+
+class Responder:
+    def __init__(self, workers: int = 8, wait: float = 2.0):
+        """
+        Args:
+            workers (int): 背景處理的執行緒數
+            wait (float): webhook 內最多等待結果幾秒，超過就改走 push
+        """
+        self.wait = wait
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="responder")
+
+    def respond(self, reply_token, user_id, fn, interim_messages):
+        """
+        在背景執行 fn()（回傳要送出的訊息 list），依完成時間選擇 reply 或 push。
+
+        目前的 contextvar（例如 Gemini 配額的使用者）會帶進背景執行緒。
+        回傳 "reply" 或 "push"。
+        """
+        start = time.monotonic()
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, fn)
+        try:
+            messages = future.result(timeout=self.wait)
+        except FutureTimeout:
+            self._reply(reply_token, interim_messages)
+            # 在同一個 context 裡 push，LINE API 的 span 仍屬於這次請求的 trace
+            future.add_done_callback(lambda f: context.run(self._push_result, user_id, f, start))
+            return "push"
+
+        if self._reply(reply_token, messages):
+            RESPONSES.inc(via="reply")
+            LATENCY.observe(time.monotonic() - start, via="reply")
+            return "reply"
+        self._push(user_id, messages, start)
+        return "push"
+
+    def respond_from_queue(self, queue, job_id, reply_token, user_id, interim_messages, poll: float = 0.1):
+        """等待 worker 完成佇列中的工作：wait 秒內完成就 reply，否則回覆處理中（結果由 worker push）"""
+        start = time.monotonic()
+        while True:
+            job = queue.get(job_id)
+            if job is not None and job.status == "done":
+                if not queue.claim_delivery(job_id, "reply"):
+                    return "push"   # worker 已經 push
+                messages = [Message.from_dict(m) for m in job.result]
+                if self._reply(reply_token, messages):
+                    RESPONSES.inc(via="reply")
+                    LATENCY.observe(time.monotonic() - start, via="reply")
+                    queue.mark_delivered(job_id)
+                    return "reply"
+                if self._push(user_id, messages, start):
+                    queue.mark_delivered(job_id)
+                return "push"
+            if time.monotonic() - start >= self.wait:
+                break
+            time.sleep(poll)
+        self._reply(reply_token, interim_messages)
+        return "push"
+
+    def _reply(self, reply_token, messages) -> bool:
+        try:
+            line_client.messaging_api().reply_message(
+                ReplyMessageRequest(reply_token=reply_token, messages=messages)
+            )
+            return True
+        except Exception as e:
+            print(f"⚠️ reply 失敗，改用 push：{e}")
+            return False
+
+    def _push_result(self, user_id, future, start):
+        try:
+            messages = future.result()
+        except Exception as e:
+            print(f"❌ 背景處理失敗：{e}")
+            return
+        self._push(user_id, messages, start)
+
+    def _push(self, user_id, messages, start) -> bool:
+        try:
+            line_client.messaging_api().push_message(
+                PushMessageRequest(to=user_id, messages=messages)
+            )
+            RESPONSES.inc(via="push")
+            LATENCY.observe(time.monotonic() - start, via="push")
+            return True
+        except Exception as e:
+            print(f"❌ push 失敗：{e}")
+            return False
+
+
+class AsyncResponder:
+    def __init__(self, wait: float = 2.0):
+        """
+        Args:
+            wait (float): webhook 內最多等待結果幾秒，超過就改走 push
+        """
+        self.wait = wait
+        self._tasks = set()   # 保留背景 Task 的參照，避免被回收
+
+    async def respond(self, reply_token, user_id, coro, interim_messages):
+        """
+        在背景執行 coro（完成時回傳要送出的訊息 list），依完成時間選擇 reply 或 push。
+        回傳 "reply" 或 "push"。
+        """
+        start = time.monotonic()
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        try:
+            messages = await asyncio.wait_for(asyncio.shield(task), self.wait)
+        except asyncio.TimeoutError:
+            await self._reply(reply_token, interim_messages)
+            follow_up = asyncio.create_task(self._push_result(user_id, task, start))
+            self._tasks.add(follow_up)
+            follow_up.add_done_callback(self._tasks.discard)
+            return "push"
+
+        if await self._reply(reply_token, messages):
+            RESPONSES.inc(via="reply")
+            LATENCY.observe(time.monotonic() - start, via="reply")
+            return "reply"
+        await self._push(user_id, messages, start)
+        return "push"
+
+    async def _reply(self, reply_token, messages) -> bool:
+        try:
+            await line_client.async_messaging_api().reply_message(
+                ReplyMessageRequest(reply_token=reply_token, messages=messages)
+            )
+            return True
+        except Exception as e:
+            print(f"⚠️ reply 失敗，改用 push：{e}")
+            return False
+
+    async def _push_result(self, user_id, task, start):
+        try:
+            messages = await task
+        except Exception as e:
+            print(f"❌ 背景處理失敗：{e}")
+            return
+        await self._push(user_id, messages, start)
+
+    async def _push(self, user_id, messages, start):
+        try:
+            await line_client.async_messaging_api().push_message(
+                PushMessageRequest(to=user_id, messages=messages)
+            )
+            RESPONSES.inc(via="push")
+            LATENCY.observe(time.monotonic() - start, via="push")
+        except Exception as e:
+            print(f"❌ push 失敗：{e}")
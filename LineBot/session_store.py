@@ -0,0 +1,325 @@
+"""
+使用者 session 的儲存介面與實作，取代 app.py 中行程內的 user_states dict。
+
+session 格式：{"mode": "analysis/sticker", "images": [圖片參照, ...], "results": {圖片參照: 預先處理結果}}
+
+- MemorySessionStore：單一行程用（預設、開發用）
+- SQLiteSessionStore：同一台機器上多個 Gunicorn worker 共用（WAL 模式）
+- RedisSessionStore：跨機器共用；可以連到 Redis，或本機替身 LineBot/redis_standin.py
+
+所有實作都保證：
+- append_image() 是原子操作，同時上傳的多張圖片不會互相覆蓋，也不會超過 max_images
+- session 在最後一次更新後 ttl 秒過期
+"""
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+
+
+class SessionFull(Exception):
+    """session 的圖片數已達上限"""
+
+    def __init__(self, limit):
+        super().__init__(f"每次最多 {limit} 張圖片")
+        self.limit = limit
+
+
+class SessionStore(ABC):
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, user_id):
+        """回傳 session dict；不存在或已過期時回傳 None"""
+
+    @abstractmethod
+    def start(self, user_id, mode):
+        """建立新的空 session（覆蓋舊的）"""
+
+    @abstractmethod
+    def append_image(self, user_id, ref, max_images=None):
+        """
+        原子地加入一張圖片參照，回傳目前張數；session 不存在時回傳 None。
+        已有 max_images 張時不加入並拋出 SessionFull。
+        """
+
+    @abstractmethod
+    def set_result(self, user_id, ref, result):
+        """記錄某張圖片的預先處理結果（JSON 可序列化）；session 不存在時忽略"""
+
+    @abstractmethod
+    def pop(self, user_id):
+        """刪除並回傳 session；不存在時回傳 None"""
+
+    @abstractmethod
+    def sweep(self):
+        """移除並回傳所有已過期的 session（供清理執行緒刪除圖片）"""
+
+    @abstractmethod
+    def count(self):
+        """目前的 session 數；無法便宜取得時回傳 None"""
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        self._lock = threading.Lock()
+        self._sessions = {}   # user_id → (到期時間, session)
+
+    def _live(self, user_id):
+        entry = self._sessions.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._sessions[user_id]
+            return None
+        return entry[1]
+
+    def get(self, user_id):
+        with self._lock:
+            session = self._live(user_id)
+            if session is None:
+                return None
+            return {"mode": session["mode"], "images": list(session["images"]),
+                    "results": dict(session["results"])}
+
+    def start(self, user_id, mode):
+        with self._lock:
+            self._sessions[user_id] = (time.time() + self.ttl, {"mode": mode, "images": [], "results": {}})
+
+    def append_image(self, user_id, ref, max_images=None):
+        with self._lock:
+            session = self._live(user_id)
+            if session is None:
+                return None
+            if max_images is not None and len(session["images"]) >= max_images:
+                raise SessionFull(max_images)
+            session["images"].append(ref)
+            self._sessions[user_id] = (time.time() + self.ttl, session)
+            return len(session["images"])
+
+    def set_result(self, user_id, ref, result):
+        with self._lock:
+            session = self._live(user_id)
+            if session is not None and ref in session["images"]:
+                session["results"][ref] = result
+
+    def pop(self, user_id):
+        with self._lock:
+            session = self._live(user_id)
+            self._sessions.pop(user_id, None)
+            return session
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [uid for uid, (exp, _) in self._sessions.items() if exp < now]
+            return [self._sessions.pop(uid)[1] for uid in expired]
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str, ttl: int):
+        super().__init__(ttl)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                         "(user_id TEXT PRIMARY KEY, mode TEXT, images TEXT, expires REAL, results TEXT DEFAULT '{}')")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if "results" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN results TEXT DEFAULT '{}'")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def get(self, user_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT mode, images, results FROM sessions WHERE user_id = ? AND expires >= ?",
+                               (user_id, time.time())).fetchone()
+        if row is None:
+            return None
+        return {"mode": row[0], "images": json.loads(row[1]), "results": json.loads(row[2])}
+
+    def start(self, user_id, mode):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (user_id, mode, images, expires, results) "
+                         "VALUES (?, ?, '[]', ?, '{}')",
+                         (user_id, mode, time.time() + self.ttl))
+
+    def append_image(self, user_id, ref, max_images=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT images FROM sessions WHERE user_id = ? AND expires >= ?",
+                                   (user_id, now)).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return None
+                images = json.loads(row[0])
+                if max_images is not None and len(images) >= max_images:
+                    raise SessionFull(max_images)
+                images.append(ref)
+                conn.execute("UPDATE sessions SET images = ?, expires = ? WHERE user_id = ?",
+                             (json.dumps(images), now + self.ttl, user_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return len(images)
+
+    def set_result(self, user_id, ref, result):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT images, results FROM sessions WHERE user_id = ? AND expires >= ?",
+                                   (user_id, time.time())).fetchone()
+                if row is not None and ref in json.loads(row[0]):
+                    results = json.loads(row[1])
+                    results[ref] = result
+                    conn.execute("UPDATE sessions SET results = ? WHERE user_id = ?",
+                                 (json.dumps(results, ensure_ascii=False), user_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def pop(self, user_id):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT mode, images, expires, results FROM sessions WHERE user_id = ?",
+                               (user_id,)).fetchone()
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            conn.execute("COMMIT")
+        if row is None or row[2] < time.time():
+            return None
+        return {"mode": row[0], "images": json.loads(row[1]), "results": json.loads(row[3])}
+
+    def sweep(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT mode, images, results FROM sessions WHERE expires < ?", (now,)).fetchall()
+            conn.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+            conn.execute("COMMIT")
+        return [{"mode": mode, "images": json.loads(images), "results": json.loads(results)}
+                for mode, images, results in rows]
+
+    def count(self):
+        with self._connect() as conn:
+            (n,) = conn.execute("SELECT COUNT(*) FROM sessions WHERE expires >= ?", (time.time(),)).fetchone()
+        return n
+
+
+class RedisSessionStore(SessionStore):
+    """
+    每個 session 是一個 list：[mode, 圖片1, 圖片2, ...]。
+    加入圖片用 RPUSHX（只在 key 存在時 push），本身就是原子操作；
+    超過張數上限時再以 LREM 移除自己剛加入的那一筆。
+    預先處理結果另存在 hash：<key>:results，{圖片參照: JSON}，與 list 同時過期；
+    只在 session 存在且包含該圖片時寫入（WATCH 交易）。
+    """
+
+    def __init__(self, url: str, ttl: int, prefix: str = "linebot:session:"):
+        super().__init__(ttl)
+        import redis  # 只有使用 Redis 後端時才需要安裝
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    @staticmethod
+    def _decode(items, results):
+        if not items:
+            return None
+        images = items[1:]
+        return {"mode": items[0], "images": images,
+                "results": {ref: json.loads(v) for ref, v in (results or {}).items() if ref in images}}
+
+    def get(self, user_id):
+        key = self._key(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.hgetall(f"{key}:results")
+        return self._decode(*pipe.execute())
+
+    def start(self, user_id, mode):
+        key = self._key(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(key, f"{key}:results")
+        pipe.rpush(key, mode)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def append_image(self, user_id, ref, max_images=None):
+        key = self._key(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpushx(key, ref)
+        pipe.expire(key, self.ttl)
+        pipe.expire(f"{key}:results", self.ttl)
+        length, _, _ = pipe.execute()
+        if not length:
+            return None
+        if max_images is not None and length - 1 > max_images:
+            self.client.lrem(key, -1, ref)
+            raise SessionFull(max_images)
+        return length - 1
+
+    def set_result(self, user_id, ref, result):
+        key = self._key(user_id)
+        value = json.dumps(result, ensure_ascii=False)
+
+        def write(pipe):
+            # 與其他實作相同：session 已過期 / 已 pop 或圖片不屬於它時不寫，避免留下孤立的 results
+            if ref not in pipe.lrange(key, 1, -1):
+                return
+            pipe.multi()
+            pipe.hset(f"{key}:results", ref, value)
+            pipe.expire(f"{key}:results", self.ttl)
+
+        # WATCH session：檢查之後、寫入之前 session 被 pop / 重建時交易不執行並重試
+        self.client.transaction(write, key)
+
+    def pop(self, user_id):
+        key = self._key(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.hgetall(f"{key}:results")
+        pipe.delete(key, f"{key}:results")
+        items, results, _ = pipe.execute()
+        return self._decode(items, results)
+
+    def sweep(self):
+        # Redis 以 EXPIRE 自動過期，圖片由 ImageBuffer 的 max_age 保底清除
+        return []
+
+    def count(self):
+        return None
+
+
+def create_session_store(url: str, ttl: int) -> SessionStore:
+    """
+    依網址建立 session store：
+        memory://                   行程內
+        sqlite:///path/to/file.db   SQLite
+        redis://host:6379/0         Redis（或本機替身）
+    """
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemorySessionStore(ttl)
+    if scheme == "sqlite":
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl)
+    if scheme in ("redis", "rediss"):
+        return RedisSessionStore(url, ttl)
+    raise ValueError(f"不支援的 session store：{url}")
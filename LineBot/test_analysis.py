@@ -0,0 +1,89 @@
+"""analysis：Flask / worker 與 asyncio 版的「開始分析」流程回覆相同，錯誤時的 session 處理"""
+import asyncio
+
+import pytest
+
+from LineBot import analysis
+from LineBot.analysis import ImagePipeline, AsyncImagePipeline
+from LineBot.session_store import MemorySessionStore
+
+
+def fake_ocr(image):
+    return None if image == b"blank" else f"ocr:{image.decode()}"
+
+
+def fake_analyze(text):
+    if "boom" in text:
+        raise ConnectionError("Gemini 503")
+    return f"分析：{text}"
+
+
+async def fake_ocr_async(image):
+    return fake_ocr(image)
+
+
+async def fake_analyze_async(text):
+    return fake_analyze(text)
+
+
+@pytest.fixture(autouse=True)
+def backends(monkeypatch):
+    monkeypatch.setattr(analysis, "process_image_ocr_only", fake_ocr)
+    monkeypatch.setattr(analysis, "analyze_combined_dialogue", fake_analyze)
+    monkeypatch.setattr(analysis, "process_image_ocr_only_async", fake_ocr_async)
+    monkeypatch.setattr(analysis, "analyze_combined_dialogue_async", fake_analyze_async)
+
+
+class SyncRunner:
+    def __init__(self):
+        self.sessions = MemorySessionStore(ttl=60)
+        self.pipeline = ImagePipeline(self.sessions)
+
+    def __call__(self, method, user_id):
+        return getattr(self.pipeline, method)(user_id)
+
+
+class AsyncRunner(SyncRunner):
+    def __init__(self):
+        self.sessions = MemorySessionStore(ttl=60)
+        self.pipeline = AsyncImagePipeline(self.sessions)
+
+    def __call__(self, method, user_id):
+        return asyncio.run(getattr(self.pipeline, method)(user_id))
+
+
+@pytest.fixture(params=[SyncRunner, AsyncRunner], ids=["sync", "async"])
+def run(request):
+    return request.param()
+
+
+def upload(run, user_id, *images):
+    run.sessions.start(user_id, "analysis")
+    for image in images:
+        run.sessions.append_image(user_id, run.pipeline.image_buffer.put(image))
+
+
+def texts(messages):
+    return [getattr(m, "text", m.type) for m in messages]
+
+
+def test_ocr_texts_are_merged_in_order(run):
+    upload(run, "U1", b"a", b"blank", b"c")
+    assert texts(run("process_all_images", "U1")) == ["分析：【第1張截圖】\nocr:a\n\n【第3張截圖】\nocr:c"]
+    assert run.sessions.get("U1") is None
+
+
+def test_no_text_and_no_session(run):
+    upload(run, "U1", b"blank")
+    assert texts(run("process_all_images", "U1")) == ["⚠️ 無法辨識任何圖片中的文字，請確認是否為聊天截圖。"]
+    assert texts(run("process_all_images", "U2")) == ["⚠️ 還沒有上傳圖片喔！請先選擇功能並上傳圖片", "template"]
+
+
+def test_analyze_raises_and_keeps_the_session(run):
+    upload(run, "U1", b"boom")
+    with pytest.raises(ConnectionError):
+        run("analyze", "U1")
+    assert len(run.sessions.get("U1")["images"]) == 1   # worker 重試時還在
+
+    assert texts(run("process_all_images", "U1")) == ["❌ 處理過程發生錯誤：Gemini 503"]
+    assert run.sessions.get("U1") is None
@@ -6,28 +6,35 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
 # 引用後端模組（不複製程式碼，後端更改時前端自動同步）
-from image_recognition.structured_ocr import detect_chat_structure
-from AI_response.chat_analyze import analyze_message, convert_dialogue
-from mygo.test_recommend_mygo_image import recommend_mygo_image
+from image_recognition.structured_ocr import detect_chat_structure, detect_chat_structure_async
+from AI_response.chat_analyze import analyze_message, analyze_message_async, convert_dialogue
+from mygo.test_recommend_mygo_image import recommend_mygo_image, recommend_mygo_image_async
 
 
-def process_image_ocr_only(image_path):
+def _describe(image):
+    """log 用：路徑照印，bytes 只印大小"""
+    if isinstance(image, (bytes, bytearray)):
+        return f"<{len(image)} bytes>"
+    return image if isinstance(image, str) else repr(image)
+
+
+def process_image_ocr_only(image):
     """
     只執行 OCR 辨識，回傳對話文字。
     用於多張圖片時，先分別 OCR，再合併文字一次傳給 AI。
 
     Args:
-        image_path (str): 圖片檔案的路徑。
+        image: 圖片檔案的路徑、bytes 或 file-like 物件。
 
     Returns:
         str: 轉換後的對話文字，若辨識失敗則回傳 None。
     """
-    print(f"📷 正在 OCR 處理圖片: {image_path}")
+    print(f"📷 正在 OCR 處理圖片: {_describe(image)}")
 
     try:
         # Step 1: OCR 辨識聊天結構（左右發話者）
         print("🔍 執行 OCR 辨識...")
-        dialogue = detect_chat_structure(image_path)
+        dialogue = detect_chat_structure(image)
         
         if not dialogue:
             return None
@@ -66,7 +73,7 @@ def analyze_combined_dialogue(combined_text):
         return error_msg
 
 
-def process_image(image_path):
+def process_image(image):
     """
     處理圖片的主要邏輯：
     1. 使用 Google Vision OCR 辨識聊天截圖
@@ -74,17 +81,17 @@ def process_image(image_path):
     3. 使用 Gemini AI 分析對話語氣、情緒與意圖
 
     Args:
-        image_path (str): 圖片檔案的路徑。
+        image: 圖片檔案的路徑、bytes 或 file-like 物件。
 
     Returns:
         str: AI 分析結果的文字描述。
     """
-    print(f"📷 正在處理圖片: {image_path}")
+    print(f"📷 正在處理圖片: {_describe(image)}")
 
     try:
         # Step 1: OCR 辨識聊天結構（左右發話者）
         print("🔍 Step 1: 執行 OCR 辨識...")
-        dialogue = detect_chat_structure(image_path)
+        dialogue = detect_chat_structure(image)
         
         if not dialogue:
             return "⚠️ 無法辨識圖片中的文字，請確認是否為聊天截圖。"
@@ -104,7 +111,7 @@ def process_image(image_path):
         print(error_msg)
         return error_msg
 
-def process_image_mygo(image_path):
+def process_image_mygo(image):
     """
     處理圖片的主要邏輯：
     1. 使用 Google Vision OCR 辨識聊天截圖
@@ -112,17 +119,17 @@ def process_image_mygo(image_path):
     3. 使用 Gemini AI 分析對話語氣、情緒與意圖
 
     Args:
-        image_path (str): 圖片檔案的路徑。
+        image: 圖片檔案的路徑、bytes 或 file-like 物件。
 
     Returns:
         str: AI 分析結果的文字描述。
     """
-    print(f"📷 正在處理圖片: {image_path}")
+    print(f"📷 正在處理圖片: {_describe(image)}")
 
     try:
         # Step 1: OCR 辨識聊天結構（左右發話者）
         print("🔍 Step 1: 執行 OCR 辨識...")
-        dialogue = detect_chat_structure(image_path)
+        dialogue = detect_chat_structure(image)
         
         if not dialogue:
             return "⚠️ 無法辨識圖片中的文字，請確認是否為聊天截圖。"
@@ -140,4 +147,74 @@ def process_image_mygo(image_path):
     except Exception as e:
         error_msg = f"❌ 處理失敗：{str(e)}"
         print(error_msg)
-        return error_msg
\ No newline at end of file
+        return error_msg
+
+
+# ===== asyncio 版本（asgi_app.py 使用）：流程與回傳值同上，Vision / Gemini 改用非同步用戶端 =====
+
+async def process_image_ocr_only_async(image):
+    """process_image_ocr_only 的 asyncio 版本"""
+    print(f"📷 正在 OCR 處理圖片: {_describe(image)}")
+
+    try:
+        dialogue = await detect_chat_structure_async(image)
+
+        if not dialogue:
+            return None
+
+        return convert_dialogue(dialogue)
+
+    except Exception as e:
+        print(f"❌ OCR 處理失敗：{str(e)}")
+        return None
+
+
+async def analyze_combined_dialogue_async(combined_text):
+    """analyze_combined_dialogue 的 asyncio 版本"""
+    print("🤖 AI 分析合併後的對話...")
+
+    try:
+        result = await analyze_message_async(combined_text)
+        return result.text
+
+    except Exception as e:
+        error_msg = f"❌ AI 分析失敗：{str(e)}"
+        print(error_msg)
+        return error_msg
+
+
+async def process_image_async(image):
+    """process_image 的 asyncio 版本"""
+    print(f"📷 正在處理圖片: {_describe(image)}")
+
+    try:
+        dialogue = await detect_chat_structure_async(image)
+
+        if not dialogue:
+            return "⚠️ 無法辨識圖片中的文字，請確認是否為聊天截圖。"
+
+        result = await analyze_message_async(convert_dialogue(dialogue))
+        return result.text
+
+    except Exception as e:
+        error_msg = f"❌ 處理失敗：{str(e)}"
+        print(error_msg)
+        return error_msg
+
+
+async def process_image_mygo_async(image):
+    """process_image_mygo 的 asyncio 版本"""
+    print(f"📷 正在處理圖片: {_describe(image)}")
+
+    try:
+        dialogue = await detect_chat_structure_async(image)
+
+        if not dialogue:
+            return "⚠️ 無法辨識圖片中的文字，請確認是否為聊天截圖。"
+
+        return await recommend_mygo_image_async(convert_dialogue(dialogue))
+
+    except Exception as e:
+        error_msg = f"❌ 處理失敗：{str(e)}"
+        print(error_msg)
+        return error_msg
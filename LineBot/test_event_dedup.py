@@ -0,0 +1,128 @@
+"""event_dedup：以簽章正確的 webhook 經由 LINE SDK 的 WebhookHandler 分派"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+from linebot.v3 import WebhookHandler
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import FollowEvent, MessageEvent, TextMessageContent
+
+from LineBot.event_dedup import EventDedup, MemoryEventDedup, SQLiteEventDedup
+
+SECRET = "test-channel-secret"
+
+
+def sign(body: str) -> str:
+    return base64.b64encode(hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).digest()).decode()
+
+
+def _event(event_id, redelivery=False, **fields):
+    return dict({
+        "timestamp": 1700000000000,
+        "source": {"type": "user", "userId": "U0001"},
+        "mode": "active",
+        "replyToken": f"reply-{event_id}",
+        "webhookEventId": event_id,
+        "deliveryContext": {"isRedelivery": redelivery},
+    }, **fields)
+
+
+def follow_event(event_id, redelivery=False):
+    return _event(event_id, redelivery, type="follow", follow={"isUnblocked": False})
+
+
+def text_event(event_id, text, redelivery=False):
+    return _event(event_id, redelivery, type="message",
+                  message={"type": "text", "id": f"m-{event_id}", "text": text, "quoteToken": "q"})
+
+
+def deliver(handler, *events):
+    body = json.dumps({"destination": "Ubot", "events": list(events)})
+    handler.handle(body, sign(body))
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def dedup(request, tmp_path):
+    if request.param == "memory":
+        return MemoryEventDedup(ttl=60)
+    return SQLiteEventDedup(str(tmp_path / "events.db"), ttl=60)
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def handler(dedup, calls):
+    # 與 app.py 相同的裝飾順序：handler.add → dedup.once → 只收 event 的 handler
+    handler = WebhookHandler(SECRET)
+
+    @handler.add(FollowEvent)
+    @dedup.once
+    def handle_follow(event):
+        calls.append(("follow", event.webhook_event_id))
+
+    @handler.add(MessageEvent, message=TextMessageContent)
+    @dedup.once
+    def handle_text_message(event):
+        if event.message.text == "boom" and not event.delivery_context.is_redelivery:
+            raise RuntimeError("handler failed")
+        calls.append(("text", event.message.text))
+
+    return handler
+
+
+def test_handlers_receive_only_the_event(handler, calls):
+    deliver(handler, follow_event("e1"), text_event("e2", "感情分析"))
+    assert calls == [("follow", "e1"), ("text", "感情分析")]
+
+
+def test_redelivered_event_is_skipped(handler, calls):
+    deliver(handler, text_event("e1", "1"))
+    deliver(handler, text_event("e1", "1", redelivery=True))
+    deliver(handler, text_event("e2", "1"))
+    assert calls == [("text", "1"), ("text", "1")]
+
+
+def test_failed_handler_releases_claim(handler, calls):
+    with pytest.raises(RuntimeError):
+        deliver(handler, text_event("e1", "boom"))
+    deliver(handler, text_event("e1", "boom", redelivery=True))
+    assert calls == [("text", "boom")]
+
+
+def test_bad_signature_is_rejected(handler, calls):
+    body = json.dumps({"destination": "Ubot", "events": [follow_event("e1")]})
+    with pytest.raises(InvalidSignatureError):
+        handler.handle(body, sign(body + " "))
+    assert calls == []
+
+
+def test_once_async_skips_duplicates(dedup):
+    calls = []
+
+    @dedup.once_async
+    async def handle(event):
+        calls.append(event.webhook_event_id)
+
+    event = FollowEvent.from_dict(follow_event("e1"))
+
+    async def main():
+        await handle(event)
+        await handle(event)
+
+    asyncio.run(main())
+    assert calls == ["e1"]
+
+
+def test_incomplete_backend_fails_on_creation():
+    class ClaimOnly(EventDedup):
+        def claim(self, event_id):
+            return True
+
+    with pytest.raises(TypeError):
+        ClaimOnly(ttl=60)
@@ -0,0 +1,155 @@
+"""job_queue：租約、重試、dead letter，以及結果送達後才標記、未送達的結果由 worker 重送"""
+import time
+
+import pytest
+
+from LineBot import job_queue, worker
+from LineBot.job_queue import JobQueue, QueueFull
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BASE", 0)   # 重試不退避
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2)
+
+
+class Pushed(list):
+    """送出的 (user_id, messages)；fail 設為 True 時 push 失敗"""
+    fail = False
+
+
+@pytest.fixture
+def pushed(monkeypatch):
+    """以記錄取代真正的 LINE push"""
+    pushed = Pushed()
+
+    def push(user_id, messages):
+        if pushed.fail:
+            raise ConnectionError("push failed")
+        pushed.append((user_id, messages))
+
+    monkeypatch.setattr(worker, "push", push)
+    return pushed
+
+
+def test_lease_is_exclusive_until_it_expires(queue):
+    job_id = queue.enqueue("analysis", {"n": 1}, user_id="U1")
+    job = queue.lease("w1")
+    assert (job.id, job.status, job.attempts) == (job_id, "running", 1)
+    assert queue.lease("w2") is None
+    assert queue.heartbeat(job_id, "w1")
+    assert not queue.heartbeat(job_id, "w2")
+
+    queue.lease_seconds = 0          # 之後的租約立即到期：w2 當掉
+    queue.heartbeat(job_id, "w1")
+    time.sleep(0.01)
+    again = queue.lease("w2")
+    assert (again.id, again.attempts) == (job_id, 2)
+    assert not queue.heartbeat(job_id, "w1")
+    assert not queue.complete(job, "w1", ["late"])   # 原本的 worker 已失去租約
+
+
+def test_failed_job_is_retried_then_dead_lettered(queue):
+    job_id = queue.enqueue("analysis", {}, user_id="U1")
+    assert queue.fail(queue.lease("w1"), "w1", "boom") == "retry"
+    job = queue.lease("w1")
+    assert (job.id, job.attempts) == (job_id, 2)
+    assert queue.fail(job, "w1", "boom again") == "dead"
+    assert queue.lease("w1") is None
+    assert [(j.id, j.error) for j in queue.dead_letters()] == [(job_id, "boom again")]
+
+
+def test_reap_dead_letters_jobs_whose_worker_keeps_crashing(queue):
+    job_id = queue.enqueue("analysis", {}, user_id="U1")
+    queue.lease_seconds = 0
+    queue.lease("w1")
+    time.sleep(0.01)
+    queue.lease("w2")
+    time.sleep(0.01)
+    assert queue.lease("w3") is None     # 已用完次數，不再取出
+    assert [job.id for job in queue.reap()] == [job_id]
+    assert queue.get(job_id).status == "dead"
+
+
+def test_capacity_and_per_user_limits(queue):
+    queue.enqueue("analysis", {}, user_id="U1", capacity=2, per_user=1)
+    with pytest.raises(QueueFull) as e:
+        queue.enqueue("analysis", {}, user_id="U1", capacity=2, per_user=1)
+    assert e.value.reason == job_queue.USER_BUSY
+    queue.enqueue("analysis", {}, user_id="U2", capacity=2, per_user=1)
+    with pytest.raises(QueueFull) as e:
+        queue.enqueue("analysis", {}, user_id="U3", capacity=2, per_user=1)
+    assert e.value.reason == job_queue.BUSY
+
+
+def finish(queue, reply_by=None):
+    job_id = queue.enqueue("analysis", {}, user_id="U1", reply_by=reply_by)
+    job = queue.lease("w1")
+    assert queue.complete(job, "w1", [{"type": "text", "text": "done"}])
+    return job_id
+
+
+def test_reply_and_push_are_exclusive(queue):
+    job_id = finish(queue, reply_by=time.time() + 60)
+    assert queue.due_deliveries() == []   # web 行程還在等，不 push
+    assert queue.claim_delivery(job_id, "reply")
+    assert not queue.claim_delivery(job_id, "push")
+    queue.mark_delivered(job_id)
+    assert not queue.claim_delivery(job_id, "reply")
+
+
+def test_completed_job_is_pushed_by_the_delivery_pass(queue, pushed):
+    job_id = finish(queue, reply_by=time.time() - 1)
+    for job in queue.due_deliveries(worker.DELIVERY_GRACE):
+        worker.deliver(queue, job)
+    assert pushed == [("U1", [{"type": "text", "text": "done"}])]
+    assert queue.due_deliveries() == []
+    assert not queue.claim_delivery(job_id, "push")
+
+
+def test_crash_before_push_is_redelivered(queue, pushed, monkeypatch):
+    job_id = finish(queue)
+    assert queue.claim_delivery(job_id, "push")   # worker 認領後、push 前當掉
+    assert queue.due_deliveries() == []
+
+    monkeypatch.setattr(job_queue, "CLAIM_TIMEOUT", 0)
+    time.sleep(0.01)
+    [job] = queue.due_deliveries()
+    worker.deliver(queue, job)
+    assert len(pushed) == 1
+    assert queue.get(job_id).status == "done"
+    assert queue.due_deliveries() == []
+
+
+def test_failed_push_is_retried_up_to_max_attempts(queue, pushed, monkeypatch):
+    finish(queue)
+    monkeypatch.setattr(job_queue, "CLAIM_TIMEOUT", 0)
+    pushed.fail = True
+    for _ in range(queue.max_attempts):
+        [job] = queue.due_deliveries()
+        worker.deliver(queue, job)
+        time.sleep(0.01)
+    assert pushed == []
+    assert queue.due_deliveries() == []   # 不會無限重送
+
+
+def test_dead_letter_notifies_the_user_once(queue, pushed):
+    queue.enqueue("analysis", {}, user_id="U1")
+    queue.fail(queue.lease("w1"), "w1", "boom")
+    job = queue.lease("w1")
+    assert queue.fail(job, "w1", "boom") == "dead"
+    worker.notify_dead(queue, job)
+    assert pushed == [("U1", [{"type": "text", "text": worker.DEAD_MESSAGE}])]
+    assert queue.due_deliveries() == []
+
+
+def test_migration_does_not_resend_old_results(tmp_path):
+    path = str(tmp_path / "old.db")
+    queue = JobQueue(path)
+    job_id = finish(queue)
+    with queue._connect() as conn:   # 模擬舊版資料表：沒有送達欄位
+        conn.execute("DROP INDEX jobs_undelivered")
+        for column in ("delivery_claimed", "delivery_attempts", "delivered"):
+            conn.execute(f"ALTER TABLE jobs DROP COLUMN {column}")
+    assert JobQueue(path).due_deliveries() == []
+    assert JobQueue(path).get(job_id).status == "done"
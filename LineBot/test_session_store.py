@@ -0,0 +1,102 @@
+"""session_store：三種後端的共同行為（Redis 連到行程內的 redis_standin）"""
+import threading
+
+import pytest
+
+from LineBot.session_store import (
+    SessionStore, MemorySessionStore, SQLiteSessionStore, RedisSessionStore, SessionFull,
+)
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    pytest.importorskip("redis")
+    from LineBot.redis_standin import RedisStandin
+
+    server = RedisStandin(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}/0"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(ttl=60)
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=60)
+    url = request.getfixturevalue("redis_url")
+    return RedisSessionStore(url, ttl=60, prefix=f"test:{request.node.name}:")
+
+
+def test_append_image_respects_limit(store):
+    assert store.append_image("u1", "a.jpg") is None   # 沒有 session
+    store.start("u1", "analysis")
+    assert store.append_image("u1", "a.jpg", max_images=2) == 1
+    assert store.append_image("u1", "b.jpg", max_images=2) == 2
+    with pytest.raises(SessionFull):
+        store.append_image("u1", "c.jpg", max_images=2)
+    assert store.get("u1")["images"] == ["a.jpg", "b.jpg"]
+
+
+def test_concurrent_appends_are_not_lost(store):
+    store.start("u1", "sticker")
+    threads = [threading.Thread(target=store.append_image, args=("u1", f"{i}.jpg")) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(store.get("u1")["images"]) == sorted(f"{i}.jpg" for i in range(20))
+
+
+def test_set_result_only_for_images_in_session(store):
+    store.start("u1", "analysis")
+    store.append_image("u1", "a.jpg")
+    store.set_result("u1", "a.jpg", {"ocr": "你好"})
+    store.set_result("u1", "other.jpg", {"ocr": "x"})
+    store.set_result("nobody", "a.jpg", {"ocr": "x"})
+    assert store.pop("u1") == {"mode": "analysis", "images": ["a.jpg"], "results": {"a.jpg": {"ocr": "你好"}}}
+    assert store.pop("u1") is None
+
+
+def test_start_discards_previous_results(store):
+    store.start("u1", "analysis")
+    store.append_image("u1", "a.jpg")
+    store.set_result("u1", "a.jpg", {"ocr": "舊"})
+    store.start("u1", "sticker")
+    store.append_image("u1", "a.jpg")
+    assert store.get("u1")["results"] == {}
+
+
+def test_redis_set_result_after_pop_leaves_no_keys(redis_url):
+    store = RedisSessionStore(redis_url, ttl=60, prefix="test:orphan:")
+    store.start("u1", "analysis")
+    store.append_image("u1", "a.jpg")
+    store.pop("u1")
+    store.set_result("u1", "a.jpg", {"ocr": "late"})   # 背景 OCR 在使用者結束後才完成
+    assert store.client.exists("test:orphan:u1", "test:orphan:u1:results") == 0
+
+
+def test_redis_standin_watch_aborts_changed_transaction(redis_url):
+    import redis
+
+    client = redis.Redis.from_url(redis_url, decode_responses=True)
+    client.rpush("test:watch", "a")
+    with client.pipeline(transaction=True) as pipe:
+        pipe.watch("test:watch")
+        client.rpush("test:watch", "b")   # 另一個連線在 WATCH 之後修改
+        pipe.multi()
+        pipe.rpush("test:watch", "c")
+        with pytest.raises(redis.WatchError):
+            pipe.execute()
+    assert client.lrange("test:watch", 0, -1) == ["a", "b"]
+
+
+def test_incomplete_backend_fails_on_creation():
+    class PartialStore(SessionStore):
+        def get(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore(ttl=60)
@@ -0,0 +1,70 @@
+"""worker：分析失敗時交給佇列重試，session 保留到工作完成或移到 dead letter"""
+import pytest
+from linebot.v3.messaging import TextMessage
+
+from LineBot import job_queue, worker
+from LineBot.job_queue import JobQueue
+
+
+class FakePipeline:
+    """取代 ImagePipeline：前 failures 次 analyze 拋出例外"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self.cleaned = []
+
+    def analyze(self, user_id):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("Gemini 503")
+        return [TextMessage(text=f"結果 {user_id}")]
+
+    def cleanup_user_images(self, user_id):
+        self.cleaned.append(user_id)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BASE", 0)
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2)
+
+
+@pytest.fixture
+def pushed(monkeypatch):
+    pushed = []
+    monkeypatch.setattr(worker, "push", lambda user_id, messages: pushed.append((user_id, messages)))
+    return pushed
+
+
+def run(queue, pipeline, monkeypatch):
+    monkeypatch.setattr(worker, "_pipeline", pipeline)
+    job_id = queue.enqueue("analysis", {"user_id": "U1"}, user_id="U1")
+    worker.execute(queue, queue.lease("w1"), "w1")
+    return job_id
+
+
+def test_failed_analysis_is_retried_with_the_session_kept(queue, pushed, monkeypatch):
+    pipeline = FakePipeline(failures=1)
+    job_id = run(queue, pipeline, monkeypatch)
+    job = queue.get(job_id)
+    assert (job.status, job.attempts) == ("queued", 1)
+    assert "Gemini 503" in job.error
+    assert pipeline.cleaned == [] and pushed == []
+
+    worker.execute(queue, queue.lease("w1"), "w1")
+    job = queue.get(job_id)
+    assert (job.status, job.result) == ("done", [{"type": "text", "text": "結果 U1"}])
+    assert pipeline.cleaned == ["U1"]
+    assert pushed == [("U1", job.result)]
+
+
+def test_analysis_failing_every_attempt_is_dead_lettered(queue, pushed, monkeypatch):
+    pipeline = FakePipeline(failures=2)
+    job_id = run(queue, pipeline, monkeypatch)
+    assert pipeline.cleaned == []
+
+    worker.execute(queue, queue.lease("w1"), "w1")
+    assert queue.get(job_id).status == "dead"
+    assert pipeline.cleaned == ["U1"]
+    assert pushed == [("U1", [{"type": "text", "text": worker.DEAD_MESSAGE}])]
@@ -0,0 +1,233 @@
+"""
+分析工作的 worker 行程：從 JOB_QUEUE_PATH 的持久化佇列取出工作、執行、送出結果。
+
+執行（需與 web 行程共用 session store 與圖片目錄，即 SESSION_STORE_URL 不能是 memory://）：
+    JOB_QUEUE_PATH=/var/lib/linebot/jobs.db python -m LineBot.worker --processes 4
+
+查看最近一小時各類工作的完成時間 p50 / p95 與佇列狀態：
+    JOB_QUEUE_PATH=/var/lib/linebot/jobs.db python -m LineBot.worker --report
+
+吞吐量靠增加 worker 行程擴充；web 行程只負責收 webhook 與 enqueue。
+每個 worker 行程另有一條送出執行緒，push reply_by 後 web 行程沒拿走的結果，
+以及 push 失敗或送出前當掉而尚未送達的結果（工作執行緒不必等到 reply_by）。
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+# 將專案根目錄加入 Python 路徑（直接以檔案執行時）
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from linebot.v3.messaging import Message, PushMessageRequest, TextMessage
+
+from AI_response.quota import user_context
+from common import tracing
+from LineBot import config, line_client
+from LineBot.job_queue import JobQueue
+from LineBot.responder import RESPONSES
+from LineBot.session_store import create_session_store
+
+POLL_INTERVAL = 0.5       # 佇列為空時的輪詢間隔（秒）
+DELIVERY_GRACE = 0.5      # reply_by 之後再等多久才改用 push，讓 web 行程有機會先 reply
+DEAD_MESSAGE = "❌ 分析失敗了，請重新上傳圖片再試一次 🙏"
+PURGE_INTERVAL = 600      # 每隔幾秒清除舊的已完成工作，並輸出完成時間統計
+KEEP_DONE = 86400         # 已完成工作保留秒數
+REPORT_WINDOW = 3600      # 完成時間統計的時間範圍（秒）
+
+_pipeline = None
+
+
+def get_pipeline():
+    """與 web 行程相同的處理流程（LineBot/analysis.py）；第一次執行工作時才建立，--report 不需載入 OCR / Gemini"""
+    global _pipeline
+    if _pipeline is None:
+        from LineBot.analysis import ImagePipeline
+
+        _pipeline = ImagePipeline(create_session_store(config.SESSION_STORE_URL, config.SESSION_TTL))
+    return _pipeline
+
+
+def run_analysis(payload):
+    """「開始分析」：回傳可 JSON 序列化的訊息；失敗時拋出例外，由佇列重試"""
+    with user_context(payload["user_id"]):
+        return [message.to_dict() for message in get_pipeline().analyze(payload["user_id"])]
+
+
+def cleanup_analysis(payload):
+    """重試時還需要 session 與暫存圖片：工作完成或移到 dead letter 後才刪除"""
+    get_pipeline().cleanup_user_images(payload["user_id"])
+
+
+HANDLERS = {
+    "analysis": run_analysis,
+}
+
+CLEANUP = {
+    "analysis": cleanup_analysis,
+}
+
+
+def push(user_id, messages):
+    line_client.messaging_api().push_message(
+        PushMessageRequest(to=user_id, messages=[Message.from_dict(m) for m in messages])
+    )
+    RESPONSES.inc(via="push")
+
+
+def deliver(queue, job):
+    """push 工作結果（dead letter 則通知失敗）；成功才標記送達，失敗時認領過期後由 run_deliveries 重送"""
+    if not job.user_id or not queue.claim_delivery(job.id, "push"):
+        return
+    messages = job.result if job.status == "done" else [TextMessage(text=DEAD_MESSAGE).to_dict()]
+    try:
+        push(job.user_id, messages)
+    except Exception as e:
+        print(f"❌ 工作 {job.id} 的結果 push 失敗，稍後重送：{e}")
+        return
+    queue.mark_delivered(job.id)
+
+
+def run_deliveries(queue):
+    """送出執行緒：定期 push 到期且尚未送達的結果"""
+    while True:
+        try:
+            for job in queue.due_deliveries(DELIVERY_GRACE):
+                deliver(queue, job)
+        except Exception as e:
+            print(f"⚠️ 送出結果時發生錯誤：{e}")
+        time.sleep(POLL_INTERVAL)
+
+
+def cleanup(job):
+    fn = CLEANUP.get(job.kind)
+    if fn is None:
+        return
+    try:
+        fn(job.payload)
+    except Exception as e:
+        print(f"⚠️ 工作 {job.id} 清理失敗：{e}")
+
+
+def notify_dead(queue, job):
+    print(f"☠️ 工作 {job.id} 移到 dead letter：{job.error}")
+    cleanup(job)
+    job.status = "dead"
+    deliver(queue, job)
+
+
+def execute(queue, job, worker):
+    stop = threading.Event()
+
+    def keep_lease():
+        while not stop.wait(queue.lease_seconds / 3):
+            if not queue.heartbeat(job.id, worker):
+                print(f"⚠️ 工作 {job.id} 的租約已被接手")
+                return
+
+    heartbeat = threading.Thread(target=keep_lease, name=f"lease-{job.id}", daemon=True)
+    heartbeat.start()
+    # 接續 web 行程在 enqueue 時的 trace
+    with tracing.span(f"job:{job.kind}", parent=job.payload.get("trace"),
+                      job_id=job.id, attempt=job.attempts, worker=worker,
+                      queued_ms=round((time.time() - job.created) * 1000)):
+        _execute(queue, job, worker, stop)
+
+
+def _execute(queue, job, worker, stop):
+    try:
+        print(f"🛠️ {worker} 開始工作 {job.id}（{job.kind}，第 {job.attempts} 次）")
+        messages = HANDLERS[job.kind](job.payload)
+    except Exception as e:
+        stop.set()
+        print(f"❌ 工作 {job.id} 失敗：{e}")
+        tracing.set_attributes(error=repr(e))
+        if queue.fail(job, worker, repr(e)) == "dead":
+            job.error = repr(e)
+            notify_dead(queue, job)
+        return
+    stop.set()
+    if queue.complete(job, worker, messages):
+        cleanup(job)
+        job.status, job.result = "done", messages
+        # web 行程還在等的話留給它 reply，否則由送出執行緒在 reply_by 後 push
+        if time.time() >= (job.reply_by or 0) + DELIVERY_GRACE:
+            deliver(queue, job)
+
+
+def open_queue():
+    return JobQueue(config.JOB_QUEUE_PATH, config.JOB_LEASE_SECONDS, config.JOB_MAX_ATTEMPTS,
+                    config.JOB_AGING_RATE)
+
+
+def print_report(queue):
+    print(f"📊 佇列：{queue.counts()}")
+    for job_class, stats in queue.latency_report(REPORT_WINDOW).items():
+        print(f"   {job_class:<14} n={stats['count']:<5} p50={stats['p50']:.1f}s p95={stats['p95']:.1f}s")
+
+
+def run_worker(worker):
+    queue = open_queue()
+    print(f"👷 worker {worker} 啟動")
+    threading.Thread(target=run_deliveries, args=(queue,), name="deliveries", daemon=True).start()
+    last_purge = 0.0
+    while True:
+        try:
+            for job in queue.reap():
+                notify_dead(queue, job)
+            if time.time() - last_purge > PURGE_INTERVAL:
+                queue.purge(KEEP_DONE)
+                print_report(queue)
+                last_purge = time.time()
+            job = queue.lease(worker)
+        except Exception as e:
+            print(f"⚠️ 佇列錯誤：{e}")
+            time.sleep(POLL_INTERVAL)
+            continue
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        execute(queue, job, worker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE Bot 分析 worker")
+    parser.add_argument("--processes", type=int, default=config.WORKER_PROCESSES, help="worker 行程數")
+    parser.add_argument("--report", action="store_true", help="只輸出佇列狀態與完成時間統計")
+    args = parser.parse_args()
+
+    if not config.JOB_QUEUE_PATH:
+        parser.error("請先設定環境變數 JOB_QUEUE_PATH")
+
+    if args.report:
+        print_report(open_queue())
+        return
+    if config.SESSION_STORE_URL.startswith("memory"):
+        parser.error("worker 需與 web 行程共用 session：SESSION_STORE_URL 需為 sqlite 或 redis")
+
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    if args.processes <= 1:
+        run_worker(f"{prefix}-0")
+        return
+
+    # 子行程意外結束時重新啟動，未完成的工作在租約到期後由其他 worker 接手
+    ctx = multiprocessing.get_context("spawn")
+    children = {}
+    while True:
+        for i in range(args.processes):
+            child = children.get(i)
+            if child is None or not child.is_alive():
+                if child is not None:
+                    print(f"⚠️ worker {i} 結束（exit code {child.exitcode}），重新啟動")
+                child = ctx.Process(target=run_worker, args=(f"{prefix}-{i}",), daemon=True)
+                child.start()
+                children[i] = child
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,98 @@
-from flask import Flask, request, abort
+import hmac
+import time
+
+from flask import Flask, Response, request, abort, jsonify
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    MessagingApiBlob,
-    ReplyMessageRequest,
-    PushMessageRequest,
-    TextMessage,
-    ImageMessage,
-    TemplateMessage,
-    ButtonsTemplate,
-    MessageAction,
-    QuickReply,
-    QuickReplyItem
-)
+from linebot.v3.messaging import ReplyMessageRequest
 from linebot.v3.webhooks import (
     MessageEvent,
     TextMessageContent,
     ImageMessageContent,
     FollowEvent
 )
-import os
-import tempfile
+from common import metrics, tracing
 from LineBot import config
-from LineBot.test_backend_logic import (
-    process_image, 
-    process_image_mygo,
-    process_image_ocr_only,
-    analyze_combined_dialogue
+from LineBot import line_client
+from AI_response import usage
+from AI_response.quota import WAIT_WINDOW, get_scheduler, user_context
+from LineBot.session_store import create_session_store, SessionFull
+from LineBot.event_dedup import create_event_dedup
+from LineBot.image_buffer import start_sweeper
+from LineBot.analysis import ImagePipeline
+from LineBot.responder import Responder
+from LineBot.admission import Admission
+from LineBot.job_queue import JobQueue, QueueFull
+from LineBot.messages import (
+    get_menu_message,
+    welcome_messages,
+    upload_prompt_message,
+    no_images_messages,
+    busy_message,
+    analyzing_message,
+    cancelled_messages,
+    unknown_command_messages,
+    choose_feature_messages,
+    image_limit_message,
+    image_received_message
 )
 
 app = Flask(__name__)
 
-# 從 config.py 讀取設定 (LINE Bot SDK v3)
-configuration = Configuration(access_token=config.CHANNEL_ACCESS_TOKEN)
+# 從 config.py 讀取設定 (LINE Bot SDK v3)；所有 handler 共用 line_client 的連線池
 handler = WebhookHandler(config.CHANNEL_SECRET)
 
-# 儲存用戶狀態：{"user_id": {"mode": "analysis/sticker", "images": [path1, path2, ...]}}
-user_states = {}
-
-
-def get_menu_message():
-    """建立功能選單的 Buttons Template 訊息"""
-    return TemplateMessage(
-        alt_text="請選擇功能",
-        template=ButtonsTemplate(
-            title="💬 聊天分析助手",
-            text="請選擇你想要的功能：",
-            actions=[
-                MessageAction(
-                    label="❤️ 感情分析",
-                    text="感情分析"
-                ),
-                MessageAction(
-                    label="😆 智慧表情包",
-                    text="智慧表情包"
-                )
-            ]
-        )
-    )
+# 儲存用戶狀態：{"mode": "analysis/sticker", "images": [圖片參照1, 圖片參照2, ...], "results": {圖片參照: 預先處理結果}}
+# 存在可跨 worker / 主機共用的 session store（見 LineBot/session_store.py）
+sessions = create_session_store(config.SESSION_STORE_URL, config.SESSION_TTL)
 
+# 已接受的 webhook 事件 ID，LINE 重送同一事件時直接略過
+dedup = create_event_dedup(config.EVENT_DEDUP_URL, config.EVENT_DEDUP_TTL)
 
-def get_quick_reply():
-    """建立 Quick Reply 按鈕（選擇功能）"""
-    return QuickReply(
-        items=[
-            QuickReplyItem(
-                action=MessageAction(
-                    label="❤️ 感情分析",
-                    text="感情分析"
-                )
-            ),
-            QuickReplyItem(
-                action=MessageAction(
-                    label="😆 智慧表情包",
-                    text="智慧表情包"
-                )
-            ),
-            QuickReplyItem(
-                action=MessageAction(
-                    label="📋 功能選單",
-                    text="選單"
-                )
-            )
-        ]
-    )
+# 上傳圖片的暫存與背景預先處理（LineBot/analysis.py，分析 worker 行程共用同一份流程）
+pipeline = ImagePipeline(sessions)
+image_buffer = pipeline.image_buffer
+prefetcher = pipeline.prefetcher
+start_sweeper(image_buffer, sessions, config.SWEEP_INTERVAL)
 
+# 最終結果：等待 REPLY_WAIT 秒內完成就用 reply token，否則改用 push
+responder = Responder(workers=config.RESPONDER_WORKERS, wait=config.REPLY_WAIT)
 
-def get_upload_quick_reply(image_count):
-    """建立上傳圖片時的 Quick Reply 按鈕"""
-    items = [
-        QuickReplyItem(
-            action=MessageAction(
-                label="❌ 取消",
-                text="取消"
-            )
-        )
-    ]
-    
-    # 有 1 張以上圖片時，顯示「開始分析」按鈕
-    if image_count >= 1:
-        items.insert(0, QuickReplyItem(
-            action=MessageAction(
-                label=f"🚀 開始分析 ({image_count}張)",
-                text="開始分析"
-            )
-        ))
-    
-    return QuickReply(items=items)
+# 同時進行 / 排隊中的分析數上限，超過就回覆忙碌中
+admission = Admission(
+    concurrency=config.RESPONDER_WORKERS,
+    queue=config.ANALYSIS_QUEUE,
+    per_user=config.ANALYSIS_PER_USER,
+)
+
+# 有設定 JOB_QUEUE_PATH 時，分析交給 worker 行程（LineBot/worker.py）
+job_queue = None
+if config.JOB_QUEUE_PATH:
+    if config.SESSION_STORE_URL.startswith("memory"):
+        raise RuntimeError("使用 JOB_QUEUE_PATH 時，SESSION_STORE_URL 需為 sqlite 或 redis，worker 行程才讀得到 session")
+    job_queue = JobQueue(config.JOB_QUEUE_PATH, config.JOB_LEASE_SECONDS, config.JOB_MAX_ATTEMPTS,
+                         config.JOB_AGING_RATE)
+
+# 預估處理秒數（工作佇列依此排序，小工作優先）
+OCR_SECONDS = 2        # 單張圖片 OCR
+LLM_SECONDS = 6        # 一次 Gemini 呼叫
+
+
+def estimate_cost(session):
+    """依模式、張數與已預先處理的結果，估計還需要幾秒"""
+    pending = sum(1 for ref in session["images"] if ref not in session["results"])
+    if session["mode"] == "sticker":
+        # 每張圖片各自 OCR + 推薦
+        return pending * (OCR_SECONDS + LLM_SECONDS)
+    # 感情分析：未完成的 OCR + 最後一次合併分析
+    return pending * OCR_SECONDS + LLM_SECONDS
+
+
+def job_class(session):
+    """統計完成時間用的分類：模式 + 張數區間"""
+    count = len(session["images"])
+    size = "1" if count <= 1 else "2-4" if count <= 4 else "5+"
+    return f"{session['mode']}:{size}"
 
 
 @app.route("/callback", methods=['POST'])
@@ -121,9 +104,10 @@ def callback():
     body = request.get_data(as_text=True)
     app.logger.info("Request body: " + body)
 
-    # handle webhook body
+    # handle webhook body（這個請求之後的處理都記在同一個 trace）
     try:
-        handler.handle(body, signature)
+        with tracing.span("webhook", body_bytes=len(body)):
+            handler.handle(body, signature)
     except InvalidSignatureError:
         print("Invalid signature. Please check your channel access token/channel secret.")
         abort(400)
@@ -131,298 +115,256 @@ def callback():
     return 'OK'
 
 
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    # Prometheus 文字格式；每個 Gunicorn worker 各自一份，需分別抓取（或只開一個 worker）
+    # gemini_usage_window_* 來自共用的用量帳本，包含所有行程（含 LineBot.worker）
+    usage.get_ledger().refresh_gauges()
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+def check_admin():
+    # 管理端點：未設定 ADMIN_TOKEN 時關閉，否則需要 Bearer token
+    if not config.ADMIN_TOKEN:
+        abort(404)
+    expected = f"Bearer {config.ADMIN_TOKEN}".encode("utf8")
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode("utf8"), expected):
+        abort(401)
+
+
+@app.route("/admin/usage", methods=['GET'])
+def admin_usage():
+    # Gemini token 用量與費用：?window=秒數&by=call_site,model|user&limit=筆數
+    check_admin()
+    window = request.args.get("window", default=usage.USAGE_WINDOW, type=float)
+    by = tuple(request.args.get("by", "call_site,model").split(","))
+    limit = request.args.get("limit", default=100, type=int)
+    return jsonify(usage.get_ledger().report(window, by, limit))
+
+
+@app.route("/admin/quota", methods=['GET'])
+def admin_quota():
+    # 各使用者的 Gemini 配額排隊時間（所有行程）：?window=秒數&limit=筆數
+    check_admin()
+    scheduler = get_scheduler()
+    if scheduler is None:
+        abort(404)   # GEMINI_RPM=0，沒有配額排程
+    window = request.args.get("window", default=WAIT_WINDOW, type=float)
+    limit = request.args.get("limit", default=100, type=int)
+    return jsonify(scheduler.wait_report(window, limit))
+
+
 # 處理用戶加入好友事件：顯示歡迎訊息和功能選單
 @handler.add(FollowEvent)
+@dedup.once
+@tracing.traced("handle_follow")
 def handle_follow(event):
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        
-        welcome_message = TextMessage(
-            text="👋 歡迎使用聊天分析助手！\n\n我可以幫你：\n❤️ 分析聊天對話的感情狀態\n😆 根據對話推薦適合的表情包\n\n請選擇下方功能開始使用 ⬇️"
-        )
-        
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[welcome_message, get_menu_message()]
-            )
-        )
+    line_bot_api = line_client.messaging_api()
 
-
-def cleanup_user_images(user_id):
-    """清理用戶的暫存圖片"""
-    if user_id in user_states and "images" in user_states[user_id]:
-        for img_path in user_states[user_id]["images"]:
-            if os.path.exists(img_path):
-                os.remove(img_path)
-    user_states.pop(user_id, None)
+    line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=welcome_messages()
+        )
+    )
 
 
 # 處理文字訊息
 @handler.add(MessageEvent, message=TextMessageContent)
+@dedup.once
+@tracing.traced("handle_text_message")
 def handle_text_message(event):
     user_id = event.source.user_id
     text = event.message.text.strip()
-
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-
-        if text in ["感情分析", "1"]:
-            # 清理之前的狀態
-            cleanup_user_images(user_id)
-            user_states[user_id] = {"mode": "analysis", "images": []}
-            
-            reply_message = TextMessage(
-                text="📸 請傳送聊天截圖\n\n💡 可以傳送多張圖片，傳完後點「開始分析」按鈕",
-                quick_reply=get_upload_quick_reply(0)
-            )
-
-        elif text in ["智慧表情包", "表情包", "2"]:
-            # 清理之前的狀態
-            cleanup_user_images(user_id)
-            user_states[user_id] = {"mode": "sticker", "images": []}
-            
-            reply_message = TextMessage(
-                text="📸 請傳送聊天截圖\n\n� 可以傳送多張圖片，傳完後點「開始分析」按鈕",
-                quick_reply=get_upload_quick_reply(0)
-            )
-
-        elif text == "開始分析":
-            # 開始處理所有圖片
-            if user_id not in user_states or not user_states[user_id].get("images"):
-                line_bot_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[
-                            TextMessage(text="⚠️ 還沒有上傳圖片喔！請先選擇功能並上傳圖片"),
-                            get_menu_message()
-                        ]
-                    )
-                )
-                return
-            
-            # 回覆處理中
-            image_count = len(user_states[user_id]["images"])
+    tracing.set_attributes(user_id=user_id, text_chars=len(text))
+
+    line_bot_api = line_client.messaging_api()
+
+    if text in ["感情分析", "1"]:
+        # 清理之前的狀態
+        pipeline.cleanup_user_images(user_id)
+        sessions.start(user_id, "analysis")
+        reply_message = upload_prompt_message("analysis")
+
+    elif text in ["智慧表情包", "表情包", "2"]:
+        # 清理之前的狀態
+        pipeline.cleanup_user_images(user_id)
+        sessions.start(user_id, "sticker")
+        reply_message = upload_prompt_message("sticker")
+
+    elif text == "開始分析":
+        # 開始處理所有圖片
+        session = sessions.get(user_id)
+        if not session or not session["images"]:
             line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"🔄 正在分析 {image_count} 張圖片，請稍候...")]
+                    messages=no_images_messages()
                 )
             )
-            
-            # 處理所有圖片
-            process_all_images(user_id, line_bot_api)
             return
-
-        elif text == "取消":
-            cleanup_user_images(user_id)
+        
+        # 超過同時分析上限時立刻告知，保留已上傳的圖片讓使用者稍後再按
+        image_count = len(session["images"])
+        interim = [analyzing_message(image_count)]
+        if job_queue is not None:
+            try:
+                job_id = job_queue.enqueue(
+                    "analysis",
+                    {"user_id": user_id, "trace": tracing.current_ids()},
+                    user_id=user_id,
+                    reply_by=time.time() + config.REPLY_WAIT,
+                    capacity=config.JOB_QUEUE_CAPACITY,
+                    per_user=config.ANALYSIS_PER_USER,
+                    cost=estimate_cost(session),
+                    job_class=job_class(session),
+                )
+                rejected = None
+            except QueueFull as e:
+                rejected = e.reason
+        else:
+            rejected = admission.admit(user_id)
+        if rejected:
             line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[
-                        TextMessage(text="已取消 ✅"),
-                        get_menu_message()
-                    ]
+                    messages=[busy_message(rejected, image_count)]
                 )
             )
             return
 
-        elif text in ["選單", "menu", "功能", "幫助", "help"]:
-            cleanup_user_images(user_id)
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[get_menu_message()]
-                )
-            )
+        if job_queue is not None:
+            # 工作已持久化，由 worker 行程處理；很快完成就 reply，否則 worker 完成後 push
+            responder.respond_from_queue(job_queue, job_id, event.reply_token, user_id, interim)
             return
 
-        else:
-            # 未知指令，顯示選單
-            reply_message = TextMessage(
-                text="你想做什麼呢？請點選下方按鈕選擇功能 �",
-                quick_reply=get_quick_reply()
+        def run_analysis():
+            try:
+                return pipeline.process_all_images(user_id)
+            finally:
+                admission.release(user_id)
+
+        # 處理所有圖片（Gemini 配額算在這個使用者身上）：
+        # 很快完成（例如結果都已預先處理好）就直接用 reply token 回覆，
+        # 否則先回覆處理中訊息，完成後再 push
+        with user_context(user_id):
+            responder.respond(
+                event.reply_token,
+                user_id,
+                run_analysis,
+                interim
             )
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[reply_message, get_menu_message()]
-                )
-            )
-            return
+        return
 
+    elif text == "取消":
+        pipeline.cleanup_user_images(user_id)
         line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[reply_message]
+                messages=cancelled_messages()
             )
         )
+        return
 
-
-def process_all_images(user_id, line_bot_api):
-    """處理用戶上傳的所有圖片"""
-    state = user_states.get(user_id, {})
-    mode = state.get("mode")
-    images = state.get("images", [])
-    
-    try:
-        if mode == "analysis":
-            # 感情分析：先對所有圖片進行 OCR，合併文字後再一次傳給 AI
-            all_ocr_texts = []
-            for i, img_path in enumerate(images):
-                print(f"📷 OCR 處理第 {i+1}/{len(images)} 張圖片: {img_path}")
-                ocr_text = process_image_ocr_only(img_path)
-                if ocr_text:
-                    all_ocr_texts.append(f"【第{i+1}張截圖】\n{ocr_text}")
-            
-            if not all_ocr_texts:
-                line_bot_api.push_message(
-                    PushMessageRequest(
-                        to=user_id,
-                        messages=[
-                            TextMessage(
-                                text="⚠️ 無法辨識任何圖片中的文字，請確認是否為聊天截圖。",
-                                quick_reply=get_quick_reply()
-                            )
-                        ]
-                    )
-                )
-                return
-            
-            # 合併所有 OCR 文字
-            combined_text = "\n\n".join(all_ocr_texts)
-            print(f"📝 合併 {len(all_ocr_texts)} 張圖片的 OCR 結果，準備傳給 AI...")
-            
-            # 一次性傳給 AI 分析
-            ai_result = analyze_combined_dialogue(combined_text)
-            
-            # 如果結果太長，截斷
-            if len(ai_result) > 5000:
-                ai_result = ai_result[:4900] + "\n\n...（內容過長已截斷）"
-            
-            line_bot_api.push_message(
-                PushMessageRequest(
-                    to=user_id,
-                    messages=[
-                        TextMessage(
-                            text=ai_result,
-                            quick_reply=get_quick_reply()
-                        )
-                    ]
-                )
+    elif text in ["選單", "menu", "功能", "幫助", "help"]:
+        pipeline.cleanup_user_images(user_id)
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[get_menu_message()]
             )
+        )
+        return
 
-        elif mode == "sticker":
-            # 智慧表情包：為每張圖片推薦表情包
-            messages = []
-            for i, img_path in enumerate(images):
-                print(f"📷 處理第 {i+1}/{len(images)} 張圖片: {img_path}")
-                image_url = process_image_mygo(img_path)
-                
-                if isinstance(image_url, str) and image_url.startswith("https"):
-                    messages.append(
-                        ImageMessage(
-                            original_content_url=image_url,
-                            preview_image_url=image_url
-                        )
-                    )
-            
-            if messages:
-                # LINE 一次最多發送 5 則訊息
-                messages = messages[:5]
-                messages.append(
-                    TextMessage(
-                        text=f"✨ 以上是推薦給你的 {len(messages)} 個表情包！",
-                        quick_reply=get_quick_reply()
-                    )
-                )
-                line_bot_api.push_message(
-                    PushMessageRequest(
-                        to=user_id,
-                        messages=messages
-                    )
-                )
-            else:
-                line_bot_api.push_message(
-                    PushMessageRequest(
-                        to=user_id,
-                        messages=[
-                            TextMessage(
-                                text="找不到適合的表情包 QQ\n要不要換張圖片試試？",
-                                quick_reply=get_quick_reply()
-                            )
-                        ]
-                    )
-                )
-    
-    except Exception as e:
-        print(f"❌ 處理錯誤: {e}")
-        line_bot_api.push_message(
-            PushMessageRequest(
-                to=user_id,
-                messages=[
-                    TextMessage(
-                        text=f"❌ 處理過程發生錯誤：{str(e)}",
-                        quick_reply=get_quick_reply()
-                    )
-                ]
+    else:
+        # 未知指令，顯示選單
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=unknown_command_messages()
             )
         )
-    
-    finally:
-        # 清理所有暫存圖片
-        cleanup_user_images(user_id)
+        return
+
+    line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[reply_message]
+        )
+    )
 
 
 # 處理圖片訊息
 @handler.add(MessageEvent, message=ImageMessageContent)
+@dedup.once
+@tracing.traced("handle_image_message")
 def handle_image_message(event):
     user_id = event.source.user_id
+    tracing.set_attributes(user_id=user_id)
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_blob_api = MessagingApiBlob(api_client)
+    line_bot_api = line_client.messaging_api()
+    line_bot_blob_api = line_client.blob_api()
 
-        # 檢查用戶是否已選擇功能
-        if user_id not in user_states or "mode" not in user_states[user_id]:
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[
-                        TextMessage(text="請先選擇功能 😊"),
-                        get_menu_message()
-                    ]
-                )
+    # 檢查用戶是否已選擇功能
+    session = sessions.get(user_id)
+    if session is None:
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=choose_feature_messages()
             )
-            return
+        )
+        return
 
-        # 下載並暫存圖片
+    # 已達張數上限就不必下載
+    if len(session["images"]) >= config.MAX_IMAGES_PER_SESSION:
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[image_limit_message(config.MAX_IMAGES_PER_SESSION, len(session["images"]))]
+            )
+        )
+        return
+
+    # 下載並暫存圖片
+    with metrics.track("line_download"):
         message_content = line_bot_blob_api.get_message_content(event.message.id)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tf:
-            tf.write(message_content)
-            temp_file_path = tf.name
-        
-        # 將圖片路徑加入用戶狀態
-        user_states[user_id]["images"].append(temp_file_path)
-        image_count = len(user_states[user_id]["images"])
-        
-        # 根據圖片數量回覆不同訊息
-        if image_count == 1:
-            reply_text = f"✅ 收到第 1 張圖片！\n\n👆 點「開始分析」立即處理\n📸 或繼續傳送更多圖片"
-        else:
-            reply_text = f"✅ 已收到 {image_count} 張圖片！\n\n👆 點「開始分析」開始處理\n📸 或繼續傳送更多圖片"
-        
+    tracing.set_attributes(image_bytes=len(message_content))
+    img_ref = image_buffer.put(message_content)
+    
+    # 將圖片參照加入用戶狀態（原子操作，連續上傳的圖片不會互相覆蓋）
+    try:
+        image_count = sessions.append_image(user_id, img_ref, max_images=config.MAX_IMAGES_PER_SESSION)
+    except SessionFull as e:
+        # 同時上傳多張時，下載期間其他圖片已先佔滿名額
+        image_buffer.discard(img_ref)
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[image_limit_message(e.limit, e.limit)]
+            )
+        )
+        return
+    if image_count is None:
+        # 下載期間 session 已過期或被取消
+        image_buffer.discard(img_ref)
         line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[
-                    TextMessage(
-                        text=reply_text,
-                        quick_reply=get_upload_quick_reply(image_count)
-                    )
-                ]
+                messages=choose_feature_messages()
             )
         )
+        return
+
+    # 不等「開始分析」，現在就在背景開始 OCR / 推薦
+    prefetcher.submit(user_id, session["mode"], img_ref)
+    
+    line_bot_api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[image_received_message(image_count)]
+        )
+    )
 
 
 if __name__ == "__main__":
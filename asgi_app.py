@@ -0,0 +1,350 @@
+"""
+asyncio 版本的 LINE Bot（ASGI）：功能與 app.py 相同，但 Vision / Gemini / LINE API 都使用非同步用戶端，
+等待上游回應時不佔執行緒，單一行程就能同時處理數百個 session。
+
+執行：
+    uvicorn asgi_app:app --port 5000
+
+- 路由：POST /callback、GET /metrics、GET /admin/usage、GET /admin/quota（與 app.py 相同），同一個 webhook 內的事件並行處理
+- 這裡只有 HTTP / webhook 的處理；分析流程在 LineBot/analysis.py（AsyncImagePipeline），回覆內容在 LineBot/messages.py
+- session store、事件去重、圖片暫存等阻塞式操作在 thread pool 執行（都是短暫的本機 / Redis 操作）
+- 不使用 JOB_QUEUE_PATH；需要持久化佇列時請使用 app.py + LineBot.worker
+"""
+import asyncio
+import hmac
+import json
+from urllib.parse import parse_qs
+
+from linebot.v3 import WebhookParser
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.messaging import ReplyMessageRequest
+from linebot.v3.webhooks import (
+    MessageEvent,
+    TextMessageContent,
+    ImageMessageContent,
+    FollowEvent
+)
+from common import google_rest, metrics, tracing
+from LineBot import config
+from LineBot import line_client
+from AI_response import usage
+from AI_response.quota import WAIT_WINDOW, get_scheduler, user_context
+from LineBot.session_store import create_session_store, SessionFull
+from LineBot.event_dedup import create_event_dedup
+from LineBot.image_buffer import start_sweeper
+from LineBot.analysis import AsyncImagePipeline
+from LineBot.responder import AsyncResponder
+from LineBot.admission import Admission
+from LineBot.messages import (
+    get_menu_message,
+    welcome_messages,
+    upload_prompt_message,
+    no_images_messages,
+    busy_message,
+    analyzing_message,
+    cancelled_messages,
+    unknown_command_messages,
+    choose_feature_messages,
+    image_limit_message,
+    image_received_message
+)
+
+parser = WebhookParser(config.CHANNEL_SECRET)
+
+# 與 app.py 相同的 session store / 事件去重設定
+sessions = create_session_store(config.SESSION_STORE_URL, config.SESSION_TTL)
+dedup = create_event_dedup(config.EVENT_DEDUP_URL, config.EVENT_DEDUP_TTL)
+
+# 圖片暫存、背景預先處理（Task，不佔執行緒）與「開始分析」（LineBot/analysis.py，與 app.py 共用同一份流程）
+pipeline = AsyncImagePipeline(sessions)
+image_buffer = pipeline.image_buffer
+prefetcher = pipeline.prefetcher
+start_sweeper(image_buffer, sessions, config.SWEEP_INTERVAL)
+
+# 最終結果：REPLY_WAIT 秒內完成就用 reply token，否則改用 push
+responder = AsyncResponder(wait=config.REPLY_WAIT)
+
+# 同時進行的分析數上限；分析都是 Task，不需要另外的排隊名額
+admission = Admission(
+    concurrency=config.ASYNC_MAX_ANALYSES,
+    queue=0,
+    per_user=config.ANALYSIS_PER_USER,
+)
+
+
+async def reply(reply_token, messages):
+    await line_client.async_messaging_api().reply_message(
+        ReplyMessageRequest(reply_token=reply_token, messages=messages)
+    )
+
+
+# 處理用戶加入好友事件：顯示歡迎訊息和功能選單
+@dedup.once_async
+@tracing.traced("handle_follow")
+async def handle_follow(event):
+    await reply(event.reply_token, welcome_messages())
+
+
+# 處理文字訊息
+@dedup.once_async
+@tracing.traced("handle_text_message")
+async def handle_text_message(event):
+    user_id = event.source.user_id
+    text = event.message.text.strip()
+    tracing.set_attributes(user_id=user_id, text_chars=len(text))
+
+    if text in ["感情分析", "1"]:
+        await pipeline.cleanup_user_images(user_id)
+        await asyncio.to_thread(sessions.start, user_id, "analysis")
+        await reply(event.reply_token, [upload_prompt_message("analysis")])
+
+    elif text in ["智慧表情包", "表情包", "2"]:
+        await pipeline.cleanup_user_images(user_id)
+        await asyncio.to_thread(sessions.start, user_id, "sticker")
+        await reply(event.reply_token, [upload_prompt_message("sticker")])
+
+    elif text == "開始分析":
+        session = await asyncio.to_thread(sessions.get, user_id)
+        if not session or not session["images"]:
+            await reply(event.reply_token, no_images_messages())
+            return
+
+        image_count = len(session["images"])
+        rejected = admission.admit(user_id)
+        if rejected:
+            await reply(event.reply_token, [busy_message(rejected, image_count)])
+            return
+
+        async def run_analysis():
+            try:
+                return await pipeline.process_all_images(user_id)
+            finally:
+                admission.release(user_id)
+
+        # Task 建立時複製 contextvar，Gemini 配額算在這個使用者身上
+        with user_context(user_id):
+            await responder.respond(
+                event.reply_token,
+                user_id,
+                run_analysis(),
+                [analyzing_message(image_count)]
+            )
+
+    elif text == "取消":
+        await pipeline.cleanup_user_images(user_id)
+        await reply(event.reply_token, cancelled_messages())
+
+    elif text in ["選單", "menu", "功能", "幫助", "help"]:
+        await pipeline.cleanup_user_images(user_id)
+        await reply(event.reply_token, [get_menu_message()])
+
+    else:
+        await reply(event.reply_token, unknown_command_messages())
+
+
+# 處理圖片訊息
+@dedup.once_async
+@tracing.traced("handle_image_message")
+async def handle_image_message(event):
+    user_id = event.source.user_id
+    tracing.set_attributes(user_id=user_id)
+
+    session = await asyncio.to_thread(sessions.get, user_id)
+    if session is None:
+        await reply(event.reply_token, choose_feature_messages())
+        return
+
+    # 已達張數上限就不必下載
+    if len(session["images"]) >= config.MAX_IMAGES_PER_SESSION:
+        await reply(event.reply_token, [
+            image_limit_message(config.MAX_IMAGES_PER_SESSION, len(session["images"]))
+        ])
+        return
+
+    async with metrics.track("line_download"):
+        message_content = await line_client.async_blob_api().get_message_content(event.message.id)
+    tracing.set_attributes(image_bytes=len(message_content))
+    img_ref = await asyncio.to_thread(image_buffer.put, message_content)
+
+    try:
+        image_count = await asyncio.to_thread(
+            sessions.append_image, user_id, img_ref, config.MAX_IMAGES_PER_SESSION
+        )
+    except SessionFull as e:
+        await asyncio.to_thread(image_buffer.discard, img_ref)
+        await reply(event.reply_token, [image_limit_message(e.limit, e.limit)])
+        return
+    if image_count is None:
+        # 下載期間 session 已過期或被取消
+        await asyncio.to_thread(image_buffer.discard, img_ref)
+        await reply(event.reply_token, choose_feature_messages())
+        return
+
+    # 不等「開始分析」，現在就在背景開始 OCR / 推薦
+    prefetcher.submit(user_id, session["mode"], img_ref)
+
+    await reply(event.reply_token, [image_received_message(image_count)])
+
+
+async def dispatch(event):
+    if isinstance(event, FollowEvent):
+        await handle_follow(event)
+    elif isinstance(event, MessageEvent):
+        if isinstance(event.message, TextMessageContent):
+            await handle_text_message(event)
+        elif isinstance(event.message, ImageMessageContent):
+            await handle_image_message(event)
+
+
+def _source_key(event):
+    """事件來源：同一個使用者（沒有 userId 時為群組 / 聊天室）的事件要依序處理"""
+    source = getattr(event, "source", None)
+    for attr in ("user_id", "group_id", "room_id"):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return id(event)
+
+
+async def dispatch_in_order(events):
+    """
+    依序處理同一來源的事件（例如先選模式再傳圖片 / 開始分析），與 Flask 版的處理順序相同。
+    某個事件失敗時不處理後面的事件：LINE 重送時已處理的事件由去重略過，其餘依原順序重跑。
+    """
+    for event in events:
+        await dispatch(event)
+
+
+async def callback(body: str, signature: str) -> int:
+    """處理一個 webhook 請求，回傳 HTTP 狀態碼"""
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        print("Invalid signature. Please check your channel access token/channel secret.")
+        return 400
+
+    # 不同使用者的事件同時處理，同一使用者的事件依序處理
+    by_source = {}
+    for event in events:
+        by_source.setdefault(_source_key(event), []).append(event)
+
+    # 與 Flask 版相同：處理失敗回 500，讓 LINE 重送（事件去重已釋放認領）
+    async with tracing.span("webhook", body_bytes=len(body), events=len(events)):
+        results = await asyncio.gather(*(dispatch_in_order(group) for group in by_source.values()),
+                                       return_exceptions=True)
+    failed = [r for r in results if isinstance(r, Exception)]
+    for error in failed:
+        print(f"❌ 處理 webhook 事件失敗：{error!r}")
+    return 500 if failed else 200
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_text(send, status, text, content_type=b"text/plain; charset=utf-8"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type)],
+    })
+    await send({"type": "http.response.body", "body": text.encode("utf8")})
+
+
+async def check_admin(scope, send) -> bool:
+    """管理端點：未設定 ADMIN_TOKEN 時關閉（404），否則需要 Bearer token（401）；未通過時已送出回應"""
+    if not config.ADMIN_TOKEN:
+        await _send_text(send, 404, "Not Found")
+        return False
+    headers = dict(scope["headers"])
+    if not hmac.compare_digest(headers.get(b"authorization", b""), f"Bearer {config.ADMIN_TOKEN}".encode("utf8")):
+        await _send_text(send, 401, "Unauthorized")
+        return False
+    return True
+
+
+def _query(scope):
+    return {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+
+
+async def admin_usage(scope, send):
+    """Gemini token 用量與費用：?window=秒數&by=call_site,model|user&limit=筆數"""
+    if not await check_admin(scope, send):
+        return
+    query = _query(scope)
+    try:
+        window = float(query.get("window", usage.USAGE_WINDOW))
+        limit = int(query.get("limit", 100))
+    except ValueError:
+        await _send_text(send, 400, "Bad Request")
+        return
+    by = tuple(query.get("by", "call_site,model").split(","))
+    report = await asyncio.to_thread(usage.get_ledger().report, window, by, limit)
+    await _send_text(send, 200, json.dumps(report, ensure_ascii=False), b"application/json")
+
+
+async def admin_quota(scope, send):
+    """各使用者的 Gemini 配額排隊時間（所有行程）：?window=秒數&limit=筆數"""
+    if not await check_admin(scope, send):
+        return
+    scheduler = get_scheduler()
+    if scheduler is None:
+        await _send_text(send, 404, "Not Found")   # GEMINI_RPM=0，沒有配額排程
+        return
+    query = _query(scope)
+    try:
+        window = float(query.get("window", WAIT_WINDOW))
+        limit = int(query.get("limit", 100))
+    except ValueError:
+        await _send_text(send, 400, "Bad Request")
+        return
+    report = await asyncio.to_thread(scheduler.wait_report, window, limit)
+    await _send_text(send, 200, json.dumps(report, ensure_ascii=False), b"application/json")
+
+
+async def app(scope, receive, send):
+    """ASGI 進入點（不依賴 web 框架）"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await line_client.close_async_api_client()
+                await google_rest.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/metrics" and scope["method"] == "GET":
+        await asyncio.to_thread(usage.get_ledger().refresh_gauges)
+        await _send_text(send, 200, metrics.render(), b"text/plain; version=0.0.4; charset=utf-8")
+        return
+    if scope["path"] == "/admin/usage" and scope["method"] == "GET":
+        await admin_usage(scope, send)
+        return
+    if scope["path"] == "/admin/quota" and scope["method"] == "GET":
+        await admin_quota(scope, send)
+        return
+    if scope["path"] != "/callback":
+        await _send_text(send, 404, "Not Found")
+        return
+    if scope["method"] != "POST":
+        await _send_text(send, 405, "Method Not Allowed")
+        return
+
+    headers = dict(scope["headers"])
+    signature = headers.get(b"x-line-signature")
+    body = (await _read_body(receive)).decode("utf8")
+    if signature is None:
+        await _send_text(send, 400, "Bad Request")
+        return
+
+    status = await callback(body, signature.decode("latin-1"))
+    await _send_text(send, status, "OK" if status == 200 else "Error")
@@ -0,0 +1,304 @@
+"""
+推薦與對話處理熱路徑的微基準測試，判斷最佳化是否真的有幫助。
+
+涵蓋：
+- find_image_by_text：在完整 mygo_data.json（9,320 筆）中查台詞
+- filter_candidates：build_candidates 中 Gemini 語氣分析以外的部分（固定語氣）
+- select_prompt / 單飛鍵值：select_mygo_reply 組 prompt 與計算 digest
+- convert_dialogue：OCR 結果轉成對話文字
+- _parse_response：detect_chat_structure 組合文字區塊的迴圈，使用錄製的 Vision 回應
+  （--recordings 目錄下的 vision/*.json；沒有時以 LineBot/google_standin.py 產生的版面代替）
+
+mygo_data.json 沒有語氣標籤：mygo_labeled.json 有的台詞沿用，其餘以固定種子從 TAGS 指定 3 個，
+讓語氣篩選的選擇率接近實際資料。
+
+執行：
+    python benchmark.py                                  # 全部
+    python benchmark.py -k select --json after.json      # 名稱包含 select 的項目，結果存成 JSON
+    python benchmark.py --compare before.json            # 與基準比較，最短時間變慢超過 --threshold 時 exit code 1
+"""
+import argparse
+import contextlib
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+os.chdir(project_root)   # mygo 模組以相對路徑讀取資料
+
+from mygo import test_recommend_mygo_image as recommender
+from AI_response.chat_analyze import convert_dialogue
+from common.singleflight import digest
+from image_recognition import structured_ocr
+
+USER_TEXT = "今天上班被主管念了一整天，好累喔，可是晚上還要去練團"
+SEED = 20240501
+
+BENCHMARKS = {}
+options = {"recordings": None}   # 由命令列設定
+
+
+def bench(name):
+    """註冊基準測試：被裝飾的函式做準備工作，回傳要計時的零參數函式"""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+# ===== 資料 =====
+
+def load_dataset():
+    """完整 mygo_data.json，並補上語氣標籤"""
+    with open("mygo/mygo_data.json", encoding="utf-8") as f:
+        rows = json.load(f)
+    with open("mygo/mygo_labeled.json", encoding="utf-8") as f:
+        labeled = {item["text"]: item["tones"] for item in json.load(f)}
+    rng = random.Random(SEED)
+    return [dict(row, tones=labeled.get(row["text"]) or rng.sample(recommender.TAGS, 3)) for row in rows]
+
+
+def load_vision_responses(recordings=None):
+    """錄製的 Vision 回應（AnnotateImageResponse）；沒有錄製時產生 20 張版面"""
+    from google.cloud import vision
+
+    paths = sorted(glob.glob(os.path.join(recordings, "vision", "*.json"))) if recordings else []
+    if paths:
+        payloads = []
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                payloads.append(f.read())
+        source = f"{len(paths)} 個錄製回應"
+    else:
+        from LineBot.google_standin import synthesize_vision
+
+        payloads = [json.dumps(synthesize_vision(f"benchmark-{i}".encode())) for i in range(20)]
+        source = "20 個產生的版面"
+    responses = [vision.AnnotateImageResponse.from_json(p, ignore_unknown_fields=True) for p in payloads]
+    return responses, source
+
+
+_dataset = None
+
+
+def dataset():
+    global _dataset
+    if _dataset is None:
+        _dataset = load_dataset()
+    return _dataset
+
+
+# ===== 基準測試 =====
+
+@bench("find_image_by_text[last]")
+def bench_find_last():
+    recommender.data = dataset()
+    text = dataset()[-1]["text"]
+    return lambda: recommender.find_image_by_text(text)
+
+
+@bench("find_image_by_text[miss]")
+def bench_find_miss():
+    recommender.data = dataset()
+    return lambda: recommender.find_image_by_text("不存在的台詞")
+
+
+@bench("filter_candidates[tone]")
+def bench_filter_tone():
+    data = dataset()
+    tone = {"emotion": "", "tone": "開心", "intent": "", "confidence": 0.9}
+    return lambda: recommender.filter_candidates(data, tone)
+
+
+@bench("filter_candidates[fallback]")
+def bench_filter_fallback():
+    data = dataset()
+    return lambda: recommender.filter_candidates(data, recommender.EMPTY_TONE)
+
+
+@bench("select_prompt[tone]")
+def bench_select_prompt_tone():
+    candidates = recommender.filter_candidates(dataset(), {"tone": "開心"})
+    return lambda: recommender.select_prompt(USER_TEXT, candidates)
+
+
+@bench("select_prompt[all]")
+def bench_select_prompt_all():
+    candidates = recommender.filter_candidates(dataset(), recommender.EMPTY_TONE)
+    return lambda: recommender.select_prompt(USER_TEXT, candidates)
+
+
+@bench("select_mygo_reply.key[all]")
+def bench_select_key():
+    # select_mygo_reply 的單飛鍵值，每次呼叫都會計算
+    candidates = recommender.filter_candidates(dataset(), recommender.EMPTY_TONE)
+    return lambda: digest(USER_TEXT, *(c["text"] for c in candidates))
+
+
+@bench("convert_dialogue[40]")
+def bench_convert_40():
+    rng = random.Random(SEED)
+    dialogue = [{"speaker": rng.choice(["left", "right", "middle"]), "text": row["text"]}
+                for row in dataset()[:40]]
+    return lambda: convert_dialogue(dialogue)
+
+
+@bench("convert_dialogue[400]")
+def bench_convert_400():
+    rng = random.Random(SEED)
+    dialogue = [{"speaker": rng.choice(["left", "right", "middle"]), "text": row["text"]}
+                for row in dataset()[:400]]
+    return lambda: convert_dialogue(dialogue)
+
+
+@bench("detect_chat_structure.parse")
+def bench_parse():
+    responses, source = load_vision_responses(options["recordings"])
+    print(f"   （{source}）")
+
+    def run():
+        for response in responses:
+            structured_ocr._parse_response(response, 0.5)
+    return run
+
+
+# ===== 計時 =====
+
+def measure(fn, rounds=7, min_time=0.1):
+    """
+    timeit 風格：先找出讓一輪至少 min_time 秒的呼叫次數，再量 rounds 輪（關閉 GC）。
+    回傳每次呼叫的秒數統計。
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            samples.append((time.perf_counter() - start) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    samples.sort()
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else [samples[0]] * 3
+    return {
+        "min": samples[0],
+        "max": samples[-1],
+        "mean": statistics.fmean(samples),
+        "median": statistics.median(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "iqr": quartiles[2] - quartiles[0],
+        "ops": 1 / statistics.median(samples),
+        "rounds": rounds,
+        "loops": loops,
+    }
+
+
+def _format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f}{unit}"
+    return f"{seconds / 1e-9:.1f}ns"
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=project_root, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "datetime": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results, baseline, threshold):
+    """印出與基準的比較（以最短時間比較，受背景負載影響最小），回傳變慢的項目"""
+    regressions = []
+    print(f"\n📐 與基準比較（{baseline['machine'].get('commit')}，門檻 ±{threshold:.0%}）")
+    for name, stats in results.items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            print(f"   {name:<32} （基準沒有這個項目）")
+            continue
+        ratio = stats["min"] / base["min"]
+        if ratio > 1 + threshold:
+            verdict = "🔴 變慢"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            verdict = "🟢 變快"
+        else:
+            verdict = "⚪ 差不多"
+        print(f"   {name:<32} {_format_time(base['min']):>10} → {_format_time(stats['min']):>10} "
+              f"×{ratio:.2f} {verdict}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推薦與對話處理熱路徑的微基準測試")
+    parser.add_argument("-k", dest="keyword", help="只執行名稱包含這個字串的項目")
+    parser.add_argument("--rounds", type=int, default=7, help="每個項目量幾輪")
+    parser.add_argument("--min-time", type=float, default=0.1, help="每輪至少幾秒")
+    parser.add_argument("--recordings", help="錄製的 Vision 回應目錄（vision/*.json）")
+    parser.add_argument("--json", help="把結果寫成 JSON 檔")
+    parser.add_argument("--compare", help="與基準 JSON 比較")
+    parser.add_argument("--threshold", type=float, default=0.1, help="最短時間差異超過多少比例算變快 / 變慢")
+    parser.add_argument("--list", action="store_true", help="只列出項目名稱")
+    args = parser.parse_args()
+
+    options["recordings"] = args.recordings
+    names = [name for name in BENCHMARKS if not args.keyword or args.keyword in name]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        for name in names:
+            print(f"⏱️ {name}")
+            fn = BENCHMARKS[name]()
+            with contextlib.redirect_stdout(devnull):   # find_image_by_text 等會 print
+                stats = measure(fn, args.rounds, args.min_time)
+            results[name] = stats
+            print(f"   median={_format_time(stats['median'])} min={_format_time(stats['min'])} "
+                  f"iqr={_format_time(stats['iqr'])} ops={stats['ops']:.1f}/s "
+                  f"({stats['rounds']}×{stats['loops']})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine_info(), "benchmarks": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 已寫入 {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
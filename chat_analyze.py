@@ -1,16 +1,6 @@
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
 from image_recognition.structured_ocr import detect_chat_structure
-
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise RuntimeError("環境變數 GEMINI_API_KEY 尚未設定")
-
-genai.configure(api_key=api_key)
-
-model = genai.GenerativeModel("gemini-2.5-flash")
+from AI_response.gemini_client import generate
 
 def analyze_message(text):
     prompt = f"""你是一位專業的對話分析師與伴侶諮商師。
@@ -37,7 +27,7 @@ def analyze_message(text):
     請分析以下聊天記錄：
     {text}
     """
-    message = model.generate_content(prompt)
+    message = generate(prompt, call_site="analyze_message")
     return message.text
 def convert_dialogue(json_list):
     """
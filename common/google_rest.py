@@ -0,0 +1,57 @@
+"""
+以 aiohttp 呼叫 Google REST API 的最小非同步用戶端，用於連到本機替身（LineBot/google_standin.py）。
+
+Vision / Gemini SDK 的非同步用戶端只支援 gRPC：設定 VISION_ENDPOINT / GEMINI_ENDPOINT 時，
+同步呼叫改用 SDK 的 REST transport，非同步呼叫則經由這裡送出相同格式的 JSON，
+回應再轉回 SDK 的型別。HTTP 錯誤轉成 google.api_core.exceptions（429 → TooManyRequests 等），
+重試與退避邏輯與正式環境相同。
+"""
+import asyncio
+import json
+
+import aiohttp
+from google.api_core import exceptions as gexc
+
+_session = None   # (event loop, aiohttp.ClientSession)：session 綁定建立時的 event loop
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    loop = asyncio.get_running_loop()
+    if _session is None or _session[0] is not loop or _session[1].closed:
+        _session = (loop, aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)))
+    return _session[1]
+
+
+async def close():
+    """event loop 結束前呼叫（ASGI lifespan shutdown）"""
+    global _session
+    if _session is not None:
+        await _session[1].close()
+        _session = None
+
+
+async def post_json(url: str, body: str, timeout: float = None) -> str:
+    """
+    POST JSON 字串，回傳回應內容。
+
+    Raises:
+        google.api_core.exceptions.GoogleAPICallError: 非 2xx 回應
+        ConnectionError: 連不上替身
+        TimeoutError: 超過 timeout 秒
+    """
+    try:
+        async with _get_session().post(url, data=body.encode("utf8"),
+                                       headers={"Content-Type": "application/json"},
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            status = response.status
+            text = await response.text()
+    except aiohttp.ClientConnectionError as e:
+        raise ConnectionError(f"{url}：{e}") from e
+    if status >= 400:
+        try:
+            message = json.loads(text)["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = text
+        raise gexc.from_http_status(status, message)
+    return text
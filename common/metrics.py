@@ -0,0 +1,220 @@
+"""
+行程內的簡易指標（計數器、量表、直方圖），執行緒安全。
+
+用法：
+    from common import metrics
+    GEMINI_CALLS = metrics.counter("gemini_calls_total", "Gemini 呼叫次數", ["call_site"])
+    GEMINI_CALLS.inc(call_site="analyze_message")
+
+處理階段的耗時用 track（context manager 或裝飾器，sync / async 皆可）：
+    with metrics.track("line_download"): ...
+
+    @metrics.track("convert_dialogue")
+    def convert_dialogue(...): ...
+
+render() 輸出 Prometheus 文字格式，供 /metrics 使用。
+"""
+import functools
+import inspect
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+# 處理階段從毫秒級（格式轉換）到數十秒（OCR + LLM）都有
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self):
+        """回傳 {標籤值 tuple: 值} 的複本"""
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            return {k: {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]}
+                    for k, v in self._values.items()}
+
+
+def _get_or_create(cls, name, help_text, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, help_text, labelnames, **kwargs)
+            _registry[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(f"指標 {name} 已註冊為 {metric.kind}")
+        return metric
+
+
+def counter(name, help_text, labelnames=()):
+    return _get_or_create(Counter, name, help_text, labelnames)
+
+
+def gauge(name, help_text, labelnames=()):
+    return _get_or_create(Gauge, name, help_text, labelnames)
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+
+def all_metrics():
+    with _registry_lock:
+        return list(_registry.values())
+
+
+STAGE_SECONDS = histogram("pipeline_stage_seconds", "各處理階段耗時", ["stage"], buckets=STAGE_BUCKETS)
+STAGE_TOTAL = counter("pipeline_stage_total", "各處理階段的執行次數", ["stage", "status"])
+STAGE_IN_FLIGHT = gauge("pipeline_stage_in_flight", "各處理階段進行中的數量", ["stage"])
+
+
+class track:
+    """記錄一個處理階段的耗時、成功 / 失敗次數與進行中數量"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._start = None
+
+    def __enter__(self):
+        STAGE_IN_FLIGHT.inc(stage=self.stage)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.monotonic() - self._start, stage=self.stage)
+        STAGE_TOTAL.inc(stage=self.stage, status="ok" if exc_type is None else "error")
+        STAGE_IN_FLIGHT.dec(stage=self.stage)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def __call__(self, fn):
+        # 每次呼叫各自建立 track，同時進行的呼叫互不干擾
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with track(self.stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track(self.stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def _escape(value: str, quotes: bool = True) -> str:
+    """標籤值需跳脫反斜線、換行與雙引號；HELP 文字不跳脫雙引號"""
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in pairs) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def render() -> str:
+    """把本行程所有指標輸出成 Prometheus 文字格式（text/plain; version=0.0.4）"""
+    lines = []
+    for metric in sorted(all_metrics(), key=lambda m: m.name):
+        lines.append(f"# HELP {metric.name} {_escape(metric.help, quotes=False)}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in sorted(metric.samples().items()):
+            if metric.kind != "histogram":
+                lines.append(f"{metric.name}{_labels(metric.labelnames, key)} {_number(value)}")
+                continue
+            # observe 時已累加到所有上界 >= 值的 bucket，counts 即為累積值
+            for bound, count in zip(metric.buckets, value["counts"]):
+                le = _labels(metric.labelnames, key, [("le", _number(float(bound)))])
+                lines.append(f"{metric.name}_bucket{le} {count}")
+            le = _labels(metric.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{metric.name}_bucket{le} {value['count']}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labelnames, key)} {_number(float(value['sum']))}")
+            lines.append(f"{metric.name}_count{_labels(metric.labelnames, key)} {value['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,137 @@
+"""
+合併同時進行中的相同請求（singleflight）。
+
+同一個 key 的呼叫還沒結束時，後到的呼叫不會再打一次上游 API，
+而是等待第一個呼叫的結果（或例外）。呼叫結束後 key 立即移除，不做長期快取。
+
+用法：
+    @singleflight(lambda text: text)
+    def analyze_message(text): ...
+
+    @async_singleflight(lambda text: text)
+    async def analyze_message_async(text): ...
+"""
+import asyncio
+import functools
+import hashlib
+import threading
+from concurrent.futures import Future
+
+from common import metrics
+
+CALLS = metrics.counter("singleflight_calls_total", "singleflight 呼叫次數", ["name", "result"])
+IN_FLIGHT = metrics.gauge("singleflight_in_flight", "進行中的上游呼叫數", ["name"])
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}   # key → Future
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            CALLS.inc(name=self.name, result="shared")
+            return future.result()
+
+        CALLS.inc(name=self.name, result="leader")
+        IN_FLIGHT.inc(name=self.name)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            IN_FLIGHT.dec(name=self.name)
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的 asyncio 版本：上游呼叫在獨立的 Task 執行，所有呼叫者（包含第一個）以 shield 等待，不佔執行緒。
+    任何一個呼叫者被取消（例如使用者斷線）都不影響其他呼叫者；所有呼叫者都取消時才取消上游呼叫。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}   # key → [asyncio.Task, 等待中的呼叫者數]
+
+    async def do(self, key, fn, *args, **kwargs):
+        call = self._calls.get(key)
+        if call is None:
+            CALLS.inc(name=self.name, result="leader")
+            IN_FLIGHT.inc(name=self.name)
+            # Task 複製目前的 contextvars（追蹤 span、配額身分），與直接在呼叫者內執行相同
+            task = asyncio.get_running_loop().create_task(fn(*args, **kwargs))
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(functools.partial(self._finished, key))
+        else:
+            CALLS.inc(name=self.name, result="shared")
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                # 沒有人在等了，不必再等上游；之後的相同請求重新呼叫，不會拿到被取消的 Task
+                task.cancel()
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def _finished(self, key, task):
+        IN_FLIGHT.dec(name=self.name)
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()   # 呼叫者都已取消時不要出現 "exception was never retrieved"
+
+
+def singleflight(key_fn):
+    """裝飾器：以 key_fn(*args, **kwargs) 的結果作為合併鍵"""
+    def decorator(fn):
+        group = SingleFlight(fn.__name__)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(key_fn(*args, **kwargs), fn, *args, **kwargs)
+
+        wrapper.group = group
+        return wrapper
+    return decorator
+
+
+def async_singleflight(key_fn):
+    """singleflight 的 async 版本，用於 async def"""
+    def decorator(fn):
+        group = AsyncSingleFlight(fn.__name__)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await group.do(key_fn(*args, **kwargs), fn, *args, **kwargs)
+
+        wrapper.group = group
+        return wrapper
+    return decorator
+
+
+def digest(*parts) -> str:
+    """把文字或 bytes 組合成固定長度的 key"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
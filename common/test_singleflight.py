@@ -0,0 +1,134 @@
+"""singleflight：合併同時進行的相同請求，以及 async 版本的取消行為"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight("test_sync")
+    calls = []
+
+    def upstream(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return x * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", upstream, 21))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [42] * 5
+    assert calls == [21]
+    assert flight._calls == {}
+
+
+def test_exception_is_shared_and_key_released():
+    flight = SingleFlight("test_sync_error")
+
+    def upstream():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("k", upstream)
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+async def settle():
+    """讓已排程的 Task 都跑到下一個 await"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Upstream:
+    """可控制完成時機的上游呼叫"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = False
+        self.release = None
+
+    async def __call__(self, value):
+        self.calls += 1
+        self.release = asyncio.Event()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+def test_async_callers_share_one_upstream_call():
+    async def main():
+        flight, upstream = AsyncSingleFlight("test_async"), Upstream()
+        tasks = [asyncio.create_task(flight.do("k", upstream, "ok")) for _ in range(3)]
+        await settle()
+        upstream.release.set()
+        assert await asyncio.gather(*tasks) == ["ok"] * 3
+        assert upstream.calls == 1
+        await settle()
+        assert flight._calls == {}
+
+    asyncio.run(main())
+
+
+def test_cancelled_first_caller_does_not_cancel_the_others():
+    async def main():
+        flight, upstream = AsyncSingleFlight("test_async_cancel"), Upstream()
+        first = asyncio.create_task(flight.do("k", upstream, "ok"))
+        await settle()
+        others = [asyncio.create_task(flight.do("k", upstream, "ok")) for _ in range(2)]
+        await settle()
+
+        first.cancel()   # 第一個使用者斷線
+        await settle()
+        assert first.cancelled()
+        assert not upstream.cancelled
+
+        upstream.release.set()
+        assert await asyncio.gather(*others) == ["ok", "ok"]
+        assert upstream.calls == 1
+
+    asyncio.run(main())
+
+
+def test_upstream_is_cancelled_when_every_caller_is():
+    async def main():
+        flight, upstream = AsyncSingleFlight("test_async_cancel_all"), Upstream()
+        tasks = [asyncio.create_task(flight.do("k", upstream, "ok")) for _ in range(2)]
+        await settle()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await settle()
+        assert upstream.cancelled
+        assert flight._calls == {}
+
+        # 之後的相同請求重新呼叫上游
+        task = asyncio.create_task(flight.do("k", upstream, "again"))
+        await settle()
+        upstream.release.set()
+        assert await task == "again"
+        assert upstream.calls == 2
+
+    asyncio.run(main())
+
+
+def test_async_exception_reaches_every_caller():
+    async def main():
+        flight, upstream = AsyncSingleFlight("test_async_error"), Upstream()
+        tasks = [asyncio.create_task(flight.do("k", upstream, ValueError("boom"))) for _ in range(2)]
+        await settle()
+        upstream.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+
+    asyncio.run(main())
@@ -0,0 +1,280 @@
+"""
+請求範圍的追蹤（trace / span），找出一次分析慢在哪一步。
+
+webhook 進來時建立 trace，之後的 span（事件處理、OCR、Gemini、LINE API 呼叫）都掛在它底下，
+記錄開始 / 結束時間、狀態與大小（圖片 bytes、prompt / 輸出 token 數）。
+屬性只放大小、數量與 ID，不放使用者的訊息或 prompt 內容（span 會匯出到檔案 / collector）。
+目前的 span 存在 contextvar：同一個執行緒、asyncio Task、以 copy_context() 執行的背景工作都會延續；
+跨行程（持久化佇列的 worker）以 current_ids() 帶進 payload，再用 span(..., parent=ids) 接續。
+
+用法：
+    with tracing.span("webhook", body_bytes=len(body)):
+        ...
+    @tracing.traced("process_all_images")
+    def process_all_images(user_id): ...
+    tracing.set_attributes(image_bytes=len(content))
+
+匯出位置由 TRACE_EXPORT_URL 決定（未設定時只在行程內建立 span，不輸出）：
+- jsonl:///var/log/linebot/traces.jsonl      每個 span 一行 JSON
+- http://localhost:4318/v1/traces            OTLP/HTTP（JSON 編碼），送到本機 collector
+span 結束後放進佇列，由背景執行緒批次寫出，不拖慢請求；佇列滿時丟棄並計數。
+
+指標：tracing_spans_total{result}
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+
+from common import metrics
+
+EXPORT_URL = os.getenv("TRACE_EXPORT_URL", "")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "linebot")
+QUEUE_SIZE = 10000
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 1.0
+
+SPANS = metrics.counter("tracing_spans_total", "結束的 span 數", ["result"])
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        _export(self)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": SERVICE_NAME,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+def span(name, parent=None, **attributes) -> Span:
+    """
+    建立目前 span 的子 span（沒有進行中的 trace 時開一個新的 trace）。
+
+    Args:
+        name (str): span 名稱
+        parent (dict): 跨行程接續時傳入 current_ids() 的結果
+    """
+    if parent:
+        return Span(name, parent["trace_id"], parent.get("span_id"), attributes)
+    current = _current.get()
+    if current is None:
+        return Span(name, secrets.token_hex(16), None, attributes)
+    return Span(name, current.trace_id, current.span_id, attributes)
+
+
+def traced(name):
+    """裝飾器：整個函式包在一個 span 內（sync / async 皆可）"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                async with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_attributes(**attributes):
+    """在目前的 span 加上屬性；沒有進行中的 span 時忽略"""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def current_ids():
+    """目前 span 的 {"trace_id", "span_id"}（可 JSON 序列化，用於跨行程接續）；沒有時回傳 None"""
+    current = _current.get()
+    if current is None:
+        return None
+    return {"trace_id": current.trace_id, "span_id": current.span_id}
+
+
+# ===== 匯出 =====
+
+class JsonlExporter:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf8") as f:
+            for s in spans:
+                f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+class OtlpHttpExporter:
+    """OTLP/HTTP + JSON 編碼（/v1/traces），不需要 opentelemetry 套件"""
+
+    def __init__(self, url, timeout=5):
+        import requests  # 只有輸出到 collector 時才需要
+
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _encode(self, s):
+        encoded = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,   # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in s.attributes.items() if v is not None],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            encoded["parentSpanId"] = s.parent_id
+        return encoded
+
+    def export(self, spans):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "linebot"}, "spans": [self._encode(s) for s in spans]}],
+            }]
+        }
+        response = self.session.post(self.url, json=body, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def create_exporter(url):
+    """依網址建立匯出器；空字串表示不輸出"""
+    if not url:
+        return None
+    if url.startswith("jsonl://"):
+        return JsonlExporter(url[len("jsonl://"):])
+    if url.startswith(("http://", "https://")):
+        return OtlpHttpExporter(url)
+    raise ValueError(f"不支援的 trace 匯出位置：{url}")
+
+
+_exporter = create_exporter(EXPORT_URL)
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _export(s):
+    if _exporter is None:
+        SPANS.inc(result="not_exported")
+        return
+    _ensure_thread()
+    try:
+        _queue.put_nowait(s)
+        SPANS.inc(result="queued")
+    except queue.Full:
+        SPANS.inc(result="dropped")
+
+
+def _drain(block):
+    batch = []
+    try:
+        batch.append(_queue.get(timeout=FLUSH_INTERVAL) if block else _queue.get_nowait())
+        while len(batch) < BATCH_SIZE:
+            batch.append(_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return batch
+
+
+def flush():
+    """把佇列中的 span 全部寫出（行程結束前呼叫）"""
+    while True:
+        batch = _drain(block=False)
+        if not batch:
+            return
+        _write(batch)
+
+
+def _write(batch):
+    try:
+        _exporter.export(batch)
+        SPANS.inc(len(batch), result="exported")
+    except Exception as e:
+        SPANS.inc(len(batch), result="failed")
+        print(f"⚠️ trace 匯出失敗（{len(batch)} 個 span）：{e}")
+
+
+def _run():
+    while True:
+        batch = _drain(block=True)
+        if batch:
+            _write(batch)
+
+
+def _ensure_thread():
+    global _thread
+    if _thread is not None:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="trace-exporter", daemon=True)
+            _thread.start()
+            atexit.register(flush)
@@ -0,0 +1,18 @@
+"""
+pytest 設定：從專案根目錄執行 python -m pytest。
+
+下列 test_*.py 是手動執行的腳本（import 時就會呼叫 Vision / Gemini 或被其他模組引用），不收集。
+LINE 的 channel 設定在收集任何測試前就給預設值，LineBot.config 不論先被哪個測試 import 都讀得到。
+"""
+import os
+
+os.environ.setdefault("CHANNEL_SECRET", "test-channel-secret")
+os.environ.setdefault("CHANNEL_ACCESS_TOKEN", "test-token")
+
+collect_ignore = [
+    "app_test.py",
+    "AI_response/test_gemini.py",
+    "LineBot/test_backend_logic.py",
+    "mygo/test_recommend_mygo_image.py",
+    "mygo/test_tone.py",
+]
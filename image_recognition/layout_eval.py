@@ -0,0 +1,216 @@
+"""
+以錄製的 Vision 回應離線調整 detect_chat_structure 的版面 / 發話者判斷，不再呼叫 Vision。
+
+錄製檔：<recordings>/vision/<圖片 sha256>.json（執行中的 bot 設定 VISION_RECORD_DIR 也會寫到這裡）
+
+擷取截圖資料集（只呼叫尚未錄製的圖片）：
+    python -m image_recognition.layout_eval capture screenshots/ --recordings vision_rec
+評估目前的門檻（0.5，置中範圍 0.4 ~ 0.6）：
+    python -m image_recognition.layout_eval eval --recordings vision_rec --images screenshots/ --labels labels.json
+掃描門檻組合：
+    python -m image_recognition.layout_eval eval --recordings vision_rec --images screenshots/ --labels labels.json --sweep
+
+labels.json：{"檔名或圖片 sha256": ["left", "right", "middle", ...]}，依由上到下的順序列出每一行的發話者。
+沒有標註時，改為統計各發話者的行數與相對於目前設定有幾行改變。
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 將專案根目錄加入 Python 路徑（直接以檔案執行時）
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from google.cloud import vision
+
+from image_recognition import structured_ocr
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+SWEEP_THRESHOLDS = [round(0.30 + 0.05 * i, 2) for i in range(9)]      # 0.30 ~ 0.70
+SWEEP_MIDDLE_BANDS = [None, (0.45, 0.55), (0.4, 0.6), (0.35, 0.65)]
+
+
+def list_images(directory):
+    return sorted(path for path in glob.glob(os.path.join(directory, "*"))
+                  if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def image_hashes(directory):
+    """檔名 → 圖片 sha256"""
+    hashes = {}
+    for path in list_images(directory):
+        with open(path, "rb") as f:
+            hashes[os.path.basename(path)] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def capture(images_dir, recordings, workers=4):
+    """對尚未錄製的截圖呼叫 Vision 並存下原始回應，回傳 (新錄製, 已存在, 失敗) 數"""
+    client = vision.ImageAnnotatorClient(**structured_ocr._client_options())
+    todo, existing = [], 0
+    for path in list_images(images_dir):
+        with open(path, "rb") as f:
+            content = f.read()
+        if os.path.exists(structured_ocr.recording_path(recordings, content)):
+            existing += 1
+        else:
+            todo.append((path, content))
+
+    def annotate(item):
+        path, content = item
+        try:
+            response = client.document_text_detection(image=vision.Image(content=content))
+            if response.error.message:
+                raise RuntimeError(response.error.message)
+        except Exception as e:
+            print(f"❌ {os.path.basename(path)}：{e}")
+            return False
+        structured_ocr.record_response(content, response, recordings)
+        print(f"💾 {os.path.basename(path)}")
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(annotate, todo))
+    return sum(results), existing, len(results) - sum(results)
+
+
+def load_corpus(recordings):
+    """圖片 sha256 → extract_blocks 的結果（每張只解析一次，掃描門檻時重複使用）"""
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(recordings, "vision", "*.json"))):
+        response = structured_ocr.load_response(path)
+        if response.error.message:
+            print(f"⚠️ 略過有錯誤的錄製：{os.path.basename(path)}")
+            continue
+        corpus[os.path.splitext(os.path.basename(path))[0]] = structured_ocr.extract_blocks(response)
+    return corpus
+
+
+def load_labels(path, images_dir=None):
+    """標註的 key 可以是檔名（需搭配 --images）或圖片 sha256；統一轉成 sha256"""
+    with open(path, encoding="utf-8") as f:
+        labels = json.load(f)
+    names = image_hashes(images_dir) if images_dir else {}
+    return {names.get(key, key): speakers for key, speakers in labels.items()}
+
+
+def evaluate(corpus, threshold, middle_band, labels=None, reference=None):
+    """
+    以指定門檻重新判斷所有截圖。
+
+    Returns:
+        dict: lines、speakers（各發話者行數）；有標註時加上 accuracy（逐行）與 exact（整張全對的比例）；
+              有 reference（其他設定的結果）時加上 changed（發話者不同的行數）
+    """
+    stats = {"lines": 0, "speakers": {}, "changed": 0}
+    correct = total = exact = labeled = 0
+    dialogues = {}
+    for key, blocks in corpus.items():
+        dialogue = structured_ocr.assign_speakers(blocks, threshold, middle_band)
+        speakers = [line["speaker"] for line in dialogue]
+        dialogues[key] = speakers
+        stats["lines"] += len(speakers)
+        for speaker in speakers:
+            stats["speakers"][speaker] = stats["speakers"].get(speaker, 0) + 1
+        if reference is not None:
+            stats["changed"] += sum(1 for a, b in zip(speakers, reference[key]) if a != b)
+        if labels and key in labels:
+            expected = labels[key]
+            labeled += 1
+            correct += sum(1 for a, b in zip(speakers, expected) if a == b)
+            total += max(len(speakers), len(expected))
+            exact += speakers == expected
+    if labeled:
+        stats["accuracy"] = correct / total if total else 1.0
+        stats["exact"] = exact / labeled
+        stats["labeled"] = labeled
+    return stats, dialogues
+
+
+def _band(text):
+    if text in ("", "none"):
+        return None
+    low, high = (float(x) for x in text.split(","))
+    return low, high
+
+
+def _describe(threshold, band):
+    return f"threshold={threshold:.2f} middle={'-' if band is None else f'{band[0]:.2f}~{band[1]:.2f}'}"
+
+
+def _summary(stats):
+    line = f"{stats['lines']} 行 {stats['speakers']}"
+    if "accuracy" in stats:
+        line += f" 準確率 {stats['accuracy']:.1%}，整張全對 {stats['exact']:.1%}（{stats['labeled']} 張有標註）"
+    return line
+
+
+def run_eval(args):
+    start = time.perf_counter()
+    corpus = load_corpus(args.recordings)
+    if not corpus:
+        print(f"⚠️ {args.recordings}/vision 沒有錄製的回應")
+        return
+    labels = load_labels(args.labels, args.images) if args.labels else None
+    loaded = time.perf_counter() - start
+    print(f"📂 {len(corpus)} 張截圖（讀取 {loaded:.2f} 秒）")
+
+    band = _band(args.middle)
+    stats, baseline = evaluate(corpus, args.threshold, band, labels)
+    print(f"📏 {_describe(args.threshold, band)}：{_summary(stats)}")
+    if args.show:
+        names = {h: name for name, h in image_hashes(args.images).items()} if args.images else {}
+        for key, blocks in corpus.items():
+            print(f"\n🖼️ {names.get(key, key)}")
+            for line in structured_ocr.assign_speakers(blocks, args.threshold, band):
+                print(f"   [{line['speaker']:<6}] {line['text']}")
+
+    if args.sweep:
+        rows = []
+        for middle in SWEEP_MIDDLE_BANDS:
+            for threshold in SWEEP_THRESHOLDS:
+                result, _ = evaluate(corpus, threshold, middle, labels, reference=baseline)
+                rows.append((threshold, middle, result))
+        if labels:
+            rows = sorted(rows, key=lambda r: (-r[2]["accuracy"], -r[2]["exact"]))[:args.top]
+        print(f"\n🔍 掃描 {len(SWEEP_MIDDLE_BANDS) * len(SWEEP_THRESHOLDS)} 組"
+              f"（{'依準確率排序' if labels else '與目前設定比較'}）")
+        for threshold, middle, result in rows:
+            print(f"   {_describe(threshold, middle)}  {_summary(result)}  改變 {result['changed']} 行")
+    print(f"\n⏱️ 共 {time.perf_counter() - start:.2f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以錄製的 Vision 回應離線評估聊天版面判斷")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("capture", help="呼叫 Vision 錄製截圖資料集（已錄製的略過）")
+    p.add_argument("images", help="截圖目錄")
+    p.add_argument("--recordings", required=True, help="錄製目錄")
+    p.add_argument("--workers", type=int, default=4, help="同時呼叫 Vision 的數量")
+
+    p = sub.add_parser("eval", help="以錄製的回應重跑版面 / 發話者判斷")
+    p.add_argument("--recordings", required=True, help="錄製目錄")
+    p.add_argument("--images", help="截圖目錄（標註以檔名為 key 或 --show 顯示檔名時需要）")
+    p.add_argument("--labels", help="標註 JSON")
+    p.add_argument("--threshold", type=float, default=0.5, help="左右分界比例")
+    p.add_argument("--middle", default="%s,%s" % structured_ocr.MIDDLE_BAND, help="置中範圍，例如 0.4,0.6；none 表示不判斷")
+    p.add_argument("--sweep", action="store_true", help="掃描門檻組合")
+    p.add_argument("--top", type=int, default=15, help="有標註時，掃描結果顯示前幾名")
+    p.add_argument("--show", action="store_true", help="列出每張截圖的判斷結果")
+
+    args = parser.parse_args()
+    if args.command == "capture":
+        recorded, existing, failed = capture(args.images, args.recordings, args.workers)
+        print(f"📊 新錄製 {recorded} 張、已存在 {existing} 張、失敗 {failed} 張")
+    else:
+        run_eval(args)
+
+
+if __name__ == "__main__":
+    main()
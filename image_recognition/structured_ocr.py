@@ -1,37 +1,226 @@
+import asyncio
+import hashlib
 import io
 import json
+import threading
+from collections import OrderedDict
 from google.cloud import vision
-from typing import List, Dict
+from typing import List, Dict, Union, BinaryIO
 import os
 from dotenv import load_dotenv
+from common import google_rest, metrics, tracing
+from common.singleflight import SingleFlight, AsyncSingleFlight, digest
 
 load_dotenv()
 api_key = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-def detect_chat_structure(image_path: str, threshold_ratio: float = 0.5) -> List[Dict]:
+
+# 以圖片內容的雜湊快取最近的 OCR 結果（同一張截圖重複上傳時不再呼叫 Vision）
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "256"))
+# 設定時改連本機替身（LineBot/google_standin.py），例如 http://127.0.0.1:8791
+VISION_ENDPOINT = os.getenv("VISION_ENDPOINT") or None
+# 設定時把 Vision 原始回應存到 <目錄>/vision/<圖片 sha256>.json，之後可離線重跑版面判斷
+# （python -m image_recognition.layout_eval）或由替身重播
+VISION_RECORD_DIR = os.getenv("VISION_RECORD_DIR") or None
+# 發話者判斷：平均 x 落在這個範圍（相對寬度）內算置中（時間、系統訊息）
+MIDDLE_BAND = (0.4, 0.6)
+
+ImageInput = Union[str, bytes, bytearray, BinaryIO]
+
+CACHE = metrics.counter("ocr_cache_total", "OCR 結果快取查詢次數", ["result"])
+
+_flight = SingleFlight("detect_chat_structure")
+_async_flight = AsyncSingleFlight("detect_chat_structure_async")
+_async_client = None     # (event loop, ImageAnnotatorAsyncClient)：gRPC aio channel 綁定建立時的 event loop
+_cache = OrderedDict()   # 圖片雜湊 → 結構化對話
+_cache_lock = threading.Lock()
+
+
+def read_image(image: ImageInput) -> bytes:
+    """把檔案路徑、bytes 或 file-like 物件統一讀成 bytes"""
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    if isinstance(image, str):
+        with io.open(image, 'rb') as image_file:
+            return image_file.read()
+    return image.read()
+
+
+@tracing.traced("detect_chat_structure")
+@metrics.track("detect_chat_structure")
+def detect_chat_structure(image: ImageInput, threshold_ratio: float = 0.5) -> List[Dict]:
     """
     使用 Google Vision Document OCR 偵測聊天內容，並根據文字位置判斷左右發話者。
 
+    圖片只讀取一次並計算雜湊：命中快取直接回傳；同一張圖片同時進行中的請求會合併。
+
     Args:
-        image_path (str): 圖片路徑
+        image: 圖片路徑、bytes 或 file-like 物件
         threshold_ratio (float): 分界比例（0.5 表示圖片中線）
     Returns:
         List[Dict]: 包含發話者與文字的結構化列表
     """
-    client = vision.ImageAnnotatorClient()
+    with metrics.track("preprocess"):
+        content = read_image(image)
+        # 以圖片內容（而非暫存檔路徑）當 key，不同使用者上傳同一張截圖也能合併
+        key = digest(content, threshold_ratio)
+    tracing.set_attributes(image_bytes=len(content))
+
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    dialogue = _flight.do(key, _detect_content, content, threshold_ratio)
+    _cache_put(key, dialogue)
+    return [dict(r) for r in dialogue]
+
+
+@tracing.traced("detect_chat_structure")
+@metrics.track("detect_chat_structure")
+async def detect_chat_structure_async(image: ImageInput, threshold_ratio: float = 0.5) -> List[Dict]:
+    """
+    detect_chat_structure 的 asyncio 版本（Vision 非同步用戶端），快取與同步版本共用。
+
+    檔案路徑在 thread pool 讀取；bytes 直接使用。
+    """
+    async with metrics.track("preprocess"):
+        if isinstance(image, (bytes, bytearray)):
+            content = bytes(image)
+        else:
+            content = await asyncio.to_thread(read_image, image)
+        key = digest(content, threshold_ratio)
+    tracing.set_attributes(image_bytes=len(content))
+
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    dialogue = await _async_flight.do(key, _detect_content_async, content, threshold_ratio)
+    _cache_put(key, dialogue)
+    return [dict(r) for r in dialogue]
+
+
+def _cache_get(key):
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+    if cached is not None:
+        CACHE.inc(result="hit")
+        tracing.set_attributes(cache="hit", lines=len(cached))
+        return [dict(r) for r in cached]
+    CACHE.inc(result="miss")
+    tracing.set_attributes(cache="miss")
+    return None
+
+
+def _cache_put(key, dialogue):
+    with _cache_lock:
+        _cache[key] = dialogue
+        _cache.move_to_end(key)
+        while len(_cache) > OCR_CACHE_SIZE:
+            _cache.popitem(last=False)
+
 
-    # 讀取圖片
-    with io.open(image_path, 'rb') as image_file:
-        content = image_file.read()
+@tracing.traced("vision_ocr")
+@metrics.track("vision_ocr")
+def _detect_content(content: bytes, threshold_ratio: float) -> List[Dict]:
+    client = vision.ImageAnnotatorClient(**_client_options())
     image = vision.Image(content=content)
 
     # 使用 document_text_detection 取得完整版面資訊
     response = client.document_text_detection(image=image)
+    if VISION_RECORD_DIR:
+        record_response(content, response)
+    return _parse_response(response, threshold_ratio)
+
+
+def _client_options() -> dict:
+    """連到替身時使用 REST transport 與匿名憑證"""
+    if not VISION_ENDPOINT:
+        return {}
+    from google.api_core.client_options import ClientOptions
+    from google.auth.credentials import AnonymousCredentials
+
+    return {
+        "transport": "rest",
+        "client_options": ClientOptions(api_endpoint=VISION_ENDPOINT),
+        "credentials": AnonymousCredentials(),
+    }
+
+
+class _StandinAsyncClient:
+    """連到替身的 batch_annotate_images（SDK 的非同步用戶端只支援 gRPC，改用 REST）"""
+
+    async def batch_annotate_images(self, requests):
+        body = vision.BatchAnnotateImagesRequest.to_json(vision.BatchAnnotateImagesRequest(requests=requests))
+        text = await google_rest.post_json(f"{VISION_ENDPOINT}/v1/images:annotate", body)
+        return vision.BatchAnnotateImagesResponse.from_json(text, ignore_unknown_fields=True)
+
 
+def _get_async_client():
+    global _async_client
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client[0] is not loop:
+        client = _StandinAsyncClient() if VISION_ENDPOINT else vision.ImageAnnotatorAsyncClient()
+        _async_client = (loop, client)
+    return _async_client[1]
+
+
+@tracing.traced("vision_ocr")
+@metrics.track("vision_ocr")
+async def _detect_content_async(content: bytes, threshold_ratio: float) -> List[Dict]:
+    # 非同步用戶端沒有 document_text_detection 捷徑，直接送 batch_annotate_images
+    request = vision.AnnotateImageRequest(
+        image=vision.Image(content=content),
+        features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+    )
+    batch = await _get_async_client().batch_annotate_images(requests=[request])
+    if VISION_RECORD_DIR:
+        await asyncio.to_thread(record_response, content, batch.responses[0])
+    return _parse_response(batch.responses[0], threshold_ratio)
+
+
+def recording_path(directory: str, content: bytes) -> str:
+    """錄製檔的位置：<directory>/vision/<圖片 sha256>.json（與替身、benchmark.py 相同）"""
+    return os.path.join(directory, "vision", f"{hashlib.sha256(content).hexdigest()}.json")
+
+
+def record_response(content: bytes, response, directory: str = None):
+    """把 Vision 原始回應存成 JSON（先寫暫存檔再改名，不會留下寫到一半的檔案）；失敗只印警告"""
+    path = recording_path(directory or VISION_RECORD_DIR, content)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(vision.AnnotateImageResponse.to_json(response))
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"⚠️ 無法儲存 Vision 回應：{e}")
+
+
+def load_response(path: str):
+    """讀取錄製的 Vision 回應"""
+    with open(path, encoding="utf-8") as f:
+        return vision.AnnotateImageResponse.from_json(f.read(), ignore_unknown_fields=True)
+
+
+def _parse_response(response, threshold_ratio: float) -> List[Dict]:
+    """把 Vision 的 document_text_detection 回應轉成依垂直位置排序的左右對話"""
     if response.error.message:
         raise Exception(f"Vision API Error: {response.error.message}")
 
-    results = []
-    width = None
+    structured_dialogue = assign_speakers(extract_blocks(response), threshold_ratio)
+    tracing.set_attributes(lines=len(structured_dialogue))
+
+    return structured_dialogue
+
+
+def extract_blocks(response) -> List[Dict]:
+    """
+    版面資訊：每個文字區塊的文字、平均 x / y 與頁面寬度。
+    與發話者判斷分開，調整門檻時不必重新解析回應。
+    """
+    blocks = []
 
     # 遍歷每一頁（通常是單張）
     for page in response.full_text_annotation.pages:
@@ -45,37 +234,53 @@ def detect_chat_structure(image_path: str, threshold_ratio: float = 0.5) -> List
                     block_text += word_text
                 block_text += " "
 
-            # 判斷氣泡在左或右
-            x_positions = [v.x for v in block.bounding_box.vertices]
-            avg_x = sum(x_positions) / len(x_positions)
-            #side = "left" if avg_x < width * threshold_ratio else "right"
-            
-            if avg_x < width * 0.6 and avg_x > width * 0.4:
-                side = "middle"
-            elif avg_x < width * threshold_ratio:
-                side = "left"
-            else:
-                side = "right"
-            # 取平均 Y 位置（用於排序）
-            avg_y = sum([v.y for v in block.bounding_box.vertices]) / len(block.bounding_box.vertices)
-
-            results.append({
-                "speaker": side,
+            vertices = block.bounding_box.vertices
+            blocks.append({
                 "text": block_text.strip(),
-                "y_pos": avg_y
+                "x": sum(v.x for v in vertices) / len(vertices),
+                "y": sum(v.y for v in vertices) / len(vertices),
+                "width": width,
             })
 
+    return blocks
+
+
+def assign_speakers(blocks: List[Dict], threshold_ratio: float = 0.5, middle_band=MIDDLE_BAND) -> List[Dict]:
+    """
+    依區塊位置判斷左右發話者，依垂直位置排序。
+
+    Args:
+        blocks: extract_blocks 的結果
+        threshold_ratio (float): 左右分界比例
+        middle_band (tuple): 平均 x 落在 (low, high) 之間算置中；None 表示不判斷置中
+    """
+    results = []
+    for block in blocks:
+        avg_x, width = block["x"], block["width"]
+        #side = "left" if avg_x < width * threshold_ratio else "right"
+
+        if middle_band and width * middle_band[0] < avg_x < width * middle_band[1]:
+            side = "middle"
+        elif avg_x < width * threshold_ratio:
+            side = "left"
+        else:
+            side = "right"
+
+        results.append({
+            "speaker": side,
+            "text": block["text"],
+            "y_pos": block["y"]
+        })
+
     # 依照垂直位置排序
     results.sort(key=lambda r: r["y_pos"])
 
     # 移除空文字、只保留必要欄位
-    structured_dialogue = [
+    return [
         {"speaker": r["speaker"], "text": r["text"]}
         for r in results if r["text"]
     ]
 
-    return structured_dialogue
-
 def main():
     # 測試範例
     test_img = "chat.webp"  # 你可以換成你的聊天截圖
@@ -1,26 +1,44 @@
-import google.generativeai as genai
 import json
 import re
+import sys
 import time
 import csv
 import os
+import atexit
+import argparse
 from tqdm import tqdm
 from datetime import datetime
 
+# 將專案根目錄加入 Python 路徑，讓 mygo 內的腳本可以引用共用模組
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
 # ========== 設定 ==========
-from dotenv import load_dotenv
+from AI_response.gemini_client import generate
+from gemini_batch import GeminiBatchClient, LocalBatchClient, make_request_line, response_text
+from label_store import LabelStore, text_hash, version_of
 
-load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=api_key)
 MODEL = "gemini-2.5-flash"
 
 INPUT_FILE = "mygo/mygo_new_data.json"
 OUTPUT_FILE = "mygo/mygo_labeled.json"
-CHECKPOINT_FILE = "checkpoint.json"
+LABEL_STORE_FILE = "mygo/label_store.jsonl"   # 依 (句子雜湊, prompt 版本, 模型) 保存的標籤庫
 LOG_FILE = "log.csv"
+# 標籤庫之前的 checkpoint（append-only 日誌與更早的整包 JSON）：第一次執行時匯入標籤庫，之後改名為 *.imported
+CHECKPOINT_FILE = "checkpoint.jsonl"
+LEGACY_CHECKPOINT_FILE = "checkpoint.json"
+
+LOG_FLUSH_ROWS = 200      # log.csv 累積幾筆寫一次
+LOG_FLUSH_SECONDS = 10    # 或距離上次寫入超過幾秒
+BATCH_SIZE = 20      # 每個 prompt 一次送幾句（設為 1 即逐句呼叫）
+BATCH_REQUEST_FILE = "mygo/batch_requests.jsonl"   # Batch API 模式的請求檔
 
-SAVE_INTERVAL = 25   # 每 25 筆寫一次 checkpoint
+# --backend local（本機替身）的假標籤另存一份，並以不同的模型 id 記錄，不會被匯出到 OUTPUT_FILE
+LOCAL_MODEL = "local-standin"
+LOCAL_LABEL_STORE_FILE = "mygo/label_store.local.jsonl"
+LOCAL_OUTPUT_FILE = "mygo/mygo_labeled.local.json"
+LOCAL_LOG_FILE = "log.local.csv"
 
 # ========== 語氣標籤 ==========
 TAGS = [
@@ -54,11 +72,26 @@ def is_blocked(text: str):
     return {"blocked": False, "reason": ""}
 
 
+# ========== 回應解析與標籤驗證 ==========
+def parse_json(text: str):
+    # 移除 ```json ``` 或 ```
+    cleaned = re.sub(r"```(?:json)?", "", text or "").strip("` \n")
+    return json.loads(cleaned)
+
+
+def validate_tones(tones):
+    """回傳合法的標籤列表；格式錯誤或含有 TAGS 以外的標籤時回傳 None"""
+    if not isinstance(tones, list):
+        return None
+    if not all(isinstance(t, str) and t in TAGS for t in tones):
+        return None
+    return list(dict.fromkeys(tones))  # 去除重複但保留順序
+
+
 # ========== 語氣分類 ==========
-def classify_tone(text: str, max_retries=3):
-    prompt = f"""
+SINGLE_PROMPT = """
 請判斷下面句子的語氣，從以下標籤中多選（可多選）：
-{", ".join(TAGS)}
+{tags}
 
 句子：{text}
 
@@ -66,104 +99,359 @@ def classify_tone(text: str, max_retries=3):
 ["開心","輕鬆"]
 """
 
-    for attempt in range(max_retries):
-        try:
-            resp = genai.GenerativeModel(MODEL).generate_content(prompt)
-            return json.loads(resp.text)
-        except Exception as e:
-            print(f"API error: {e} (retry {attempt+1})")
-            time.sleep(3)
-
-    return []  # 如果失敗，回傳空列表
+BATCH_PROMPT = """
+請判斷下面每個句子的語氣，從以下標籤中多選（可多選）：
+{tags}
 
+句子：
+{numbered}
 
-# ========== checkpoint loader ==========
-def load_checkpoint():
-    try:
-        with open(CHECKPOINT_FILE, "r", encoding="utf8") as f:
-            return json.load(f)
-    except:
-        return {}
-
-
-# ========== Logger 初始化 ==========
-def init_log():
-    try:
-        with open(LOG_FILE, "x", newline="", encoding="utf8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["timestamp", "text", "blocked", "reason", "tones"])
-    except FileExistsError:
-        pass  # 已存在時不新建
-
-
-def log_record(text, blocked, reason, tones):
-    with open(LOG_FILE, "a", newline="", encoding="utf8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            datetime.now().isoformat(),
-            text,
-            blocked,
-            reason,
-            json.dumps(tones, ensure_ascii=False)
-        ])
-
+請只輸出純 JSON object，key 為句子編號，value 為標籤 array，例如：
+{{"1": ["開心","輕鬆"], "2": ["中性"]}}
+"""
 
-# ========== 主程式 ==========
-init_log()
+# prompt 範本改動時版本號跟著變，標籤庫會把舊版本的標籤視為需要重標
+PROMPT_VERSION = version_of(SINGLE_PROMPT, BATCH_PROMPT)
 
-# 讀進原始資料
-with open(INPUT_FILE, "r", encoding="utf8") as f:
-    data = json.load(f)
 
-# 載入 checkpoint（可中斷續跑）
-checkpoint = load_checkpoint()
-cache = checkpoint.get("cache", {})
-start_index = checkpoint.get("index", 0)
+def build_prompt(text: str) -> str:
+    """單句分類 prompt（online 與 batch 模式共用）"""
+    return SINGLE_PROMPT.format(tags=", ".join(TAGS), text=text)
 
-print(f"從第 {start_index} 筆開始（自動續跑）")
 
-api_calls = 0
+def parse_tones(raw: str):
+    """解析並驗證單句回應；不合法時回傳 None"""
+    try:
+        return validate_tones(parse_json(raw))
+    except json.JSONDecodeError:
+        return None
 
-for i in tqdm(range(start_index, len(data))):
-    item = data[i]
-    text = item["text"]
 
-    # ---- 檢查屏蔽 ----
-    blk = is_blocked(text)
-    if blk["blocked"]:
-        item["tones"] = []
-        log_record(text, True, blk["reason"], [])
-        continue
+def classify_tone(text: str, max_retries=3):
+    prompt = build_prompt(text)
 
-    # ---- 避免重複 ----
-    if text in cache:
-        item["tones"] = cache[text]
-        log_record(text, False, "", cache[text])
-        continue
+    # 連線錯誤的重試與退避由 gemini_client 處理，這裡只重試不合法的回應
+    for attempt in range(max_retries):
+        try:
+            resp = generate(prompt, call_site="classify_tone", model=MODEL)
+        except Exception as e:
+            print(f"API error: {e}")
+            break
+        tones = parse_tones(resp.text)
+        if tones is not None:
+            return tones
+        print(f"標籤不合法：{resp.text!r} (retry {attempt+1})")
 
-    # ---- API Rate limit: 每 100 次休息 ----
-    if api_calls > 0 and api_calls % 100 == 0:
-        print("API 使用達 100 次 → 休息 60 秒")
-        time.sleep(60)
+    return None  # 如果失敗，回傳 None（不寫入標籤庫，下次執行會重試）
 
-    # ---- 語氣分類 ----
-    tones = classify_tone(text)
-    item["tones"] = tones
 
-    cache[text] = tones
-    api_calls += 1
+def classify_tone_batch(texts, max_retries=3):
+    """
+    一次把多個句子放進同一個 prompt，回傳 {句子: 標籤列表}。
+    模型回傳 {"1": [...], "2": [...]}，以編號對應句子；
+    缺少或標籤不合法的句子不會出現在回傳結果中，由呼叫端改用 classify_tone() 補跑。
+    """
+    numbered = "\n".join(f"{i+1}. {t}" for i, t in enumerate(texts))
+    prompt = BATCH_PROMPT.format(tags=", ".join(TAGS), numbered=numbered)
 
-    # ---- Logger ----
-    log_record(text, False, "", tones)
+    for attempt in range(max_retries):
+        try:
+            resp = generate(prompt, call_site="classify_tone_batch", model=MODEL)
+        except Exception as e:
+            print(f"API error: {e}")
+            return {}
+        try:
+            result = parse_json(resp.text)
+        except json.JSONDecodeError:
+            result = None
+        if isinstance(result, dict):
+            break
+        print(f"不是 JSON object：{resp.text!r} (retry {attempt+1})")
+    else:
+        return {}
 
-    # ---- 每 SAVE_INTERVAL 筆儲存 checkpoint ----
-    if (i + 1) % SAVE_INTERVAL == 0:
-        with open(CHECKPOINT_FILE, "w", encoding="utf8") as f:
-            json.dump({"index": i + 1, "cache": cache}, f, ensure_ascii=False, indent=2)
-        print(f"Checkpoint saved at index {i+1}")
+    labeled = {}
+    for i, text in enumerate(texts):
+        tones = validate_tones(result.get(str(i + 1)))
+        if tones is not None:
+            labeled[text] = tones
+    return labeled
+
+
+def classify_pending(texts):
+    """
+    批次標註 texts，只有批次結果失敗的句子才逐句重送。
+    回傳 ({句子: 標籤列表}, API 呼叫次數)。
+    """
+    if len(texts) == 1:
+        return {texts[0]: classify_tone(texts[0])}, 1
+
+    labeled = classify_tone_batch(texts)
+    calls = 1
+    failed = [t for t in texts if t not in labeled]
+    if failed:
+        print(f"批次中有 {len(failed)} 句失敗 → 逐句重送")
+    for text in failed:
+        labeled[text] = classify_tone(text)
+        calls += 1
+    return labeled, calls
+
+
+# ========== Logger（緩衝寫入）==========
+class BufferedLogWriter:
+    """
+    log.csv 保持開啟，累積 LOG_FLUSH_ROWS 筆或超過 LOG_FLUSH_SECONDS 秒才寫入；
+    程式結束（含例外中斷）時由 atexit 寫出剩下的資料。
+    被屏蔽的句子每句只記一次（包含之前執行時已記過的）。
+    """
+
+    def __init__(self, path=LOG_FILE, flush_rows=LOG_FLUSH_ROWS, flush_seconds=LOG_FLUSH_SECONDS):
+        is_new = not os.path.exists(path)
+        self.file = open(path, "a", newline="", encoding="utf8")
+        self.writer = csv.writer(self.file)
+        self.rows = []
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.monotonic()
+        self.blocked = set() if is_new else self._logged_blocked(path)
+        if is_new:
+            self.writer.writerow(["timestamp", "text", "blocked", "reason", "tones"])
+        atexit.register(self.close)
+
+    @staticmethod
+    def _logged_blocked(path):
+        with open(path, "r", newline="", encoding="utf8") as f:
+            return {row["text"] for row in csv.DictReader(f) if row.get("blocked") == "True"}
+
+    def write(self, text, blocked, reason, tones):
+        self.rows.append([
+            datetime.now().isoformat(),
+            text,
+            blocked,
+            reason,
+            json.dumps(tones, ensure_ascii=False)
+        ])
+        if (len(self.rows) >= self.flush_rows
+                or time.monotonic() - self.last_flush >= self.flush_seconds):
+            self.flush()
+
+    def write_blocked(self, text, reason):
+        if text not in self.blocked:
+            self.blocked.add(text)
+            self.write(text, True, reason, [])
+
+    def flush(self):
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows.clear()
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+# ========== Batch API 模式 ==========
+def write_batch_requests(texts, path=BATCH_REQUEST_FILE):
+    """把每個待標註的句子寫成一行批次請求，回傳 {key: 句子}"""
+    keys = {}
+    with open(path, "w", encoding="utf8") as f:
+        for text in texts:
+            key = text_hash(text)
+            keys[key] = text
+            f.write(make_request_line(key, build_prompt(text)) + "\n")
+    return keys
+
+
+def collect_batch_results(results, keys):
+    """
+    把批次結果轉回 {句子: 標籤列表}，驗證規則與 online 模式相同；
+    失敗或標籤不合法的句子改用 classify_tone() 逐句補跑，仍失敗的為 None。
+    """
+    labeled = {}
+    for result in results:
+        text = keys.get(result.get("key"))
+        if text is None:
+            continue
+        tones = parse_tones(response_text(result))
+        if tones is not None:
+            labeled[text] = tones
+
+    failed = [t for t in keys.values() if t not in labeled]
+    if failed:
+        print(f"批次結果中有 {len(failed)} 句失敗 → 逐句重送")
+    for text in failed:
+        labeled[text] = classify_tone(text)
+    return labeled
+
+
+# ========== 舊版 checkpoint 匯入 ==========
+def read_checkpoints(paths=(LEGACY_CHECKPOINT_FILE, CHECKPOINT_FILE)):
+    """重播舊版 checkpoint，回傳 ({句子: 標籤}, 存在的檔案)；後面的檔案覆蓋前面的"""
+    cache, found = {}, []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                if path.endswith(".jsonl"):
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # 中斷時寫到一半的行，後面的紀錄照常讀取
+                        if "text" in entry:
+                            cache[entry["text"]] = entry["tones"]
+                else:
+                    cache.update(json.load(f).get("cache", {}))
+        except FileNotFoundError:
+            continue
+        except json.JSONDecodeError:
+            print(f"⚠️ 無法解析 {path}，略過（不改名）")
+            continue
+        found.append(path)
+    return cache, found
+
+
+def import_checkpoints(store, paths=(LEGACY_CHECKPOINT_FILE, CHECKPOINT_FILE)):
+    """
+    把舊版 checkpoint 的標籤匯入標籤庫，只做一次（匯入後檔案改名為 *.imported）。
+    舊版使用相同的 SINGLE_PROMPT、MODEL 與 TAGS，因此記在目前的 PROMPT_VERSION 下；
+    失敗時存下的空列表與不合法的標籤不匯入，之後照常重標。
+    """
+    cache, found = read_checkpoints(paths)
+    if not found:
+        return 0
+    imported = 0
+    for text, tones in cache.items():
+        tones = validate_tones(tones)
+        if tones and store.lookup(text, PROMPT_VERSION, MODEL, TAGS) is None:
+            store.put(text, PROMPT_VERSION, MODEL, TAGS, tones)
+            imported += 1
+    store.flush()
+    for path in found:
+        os.replace(path, f"{path}.imported")
+    print(f"📥 已從 {', '.join(found)} 匯入 {imported} 筆標籤（共 {len(cache)} 筆）")
+    return imported
 
-# 結束後儲存完整結果
-with open(OUTPUT_FILE, "w", encoding="utf8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
 
-print("🚀 全部完成！")
+# ========== 主程式 ==========
+def unlabeled_texts(data, store, logger, model=MODEL, relabel=False):
+    """
+    回傳目前版本下需要標註的唯一句子；重複的句子只標一次。
+    relabel=True 時，以舊標籤集合標註的句子也重新標註。
+    """
+    todo, seen = [], set()
+    for item in data:
+        text = item["text"]
+        if text in seen:
+            continue
+        seen.add(text)
+        blk = is_blocked(text)
+        if blk["blocked"]:
+            logger.write_blocked(text, blk["reason"])
+        elif store.lookup(text, PROMPT_VERSION, model, TAGS, exact_tagset=relabel) is None:
+            todo.append(text)
+    return todo
+
+
+def save_labels(labeled, store, logger, model=MODEL):
+    for text, tones in labeled.items():
+        if tones is None:
+            continue
+        store.put(text, PROMPT_VERSION, model, TAGS, tones)
+        logger.write(text, False, "", tones)
+
+
+def label_online(texts, store, logger):
+    """
+    以 BATCH_SIZE 句為一批即時呼叫 Gemini，每批結果立即寫入標籤庫。
+    速率限制由 gemini_client 的配額排程器負責（標註腳本以 "system" 身分、較低權重排隊）。
+    """
+    api_calls = 0
+    for start in tqdm(range(0, len(texts), BATCH_SIZE)):
+        # ---- 語氣分類（批次）----
+        labeled, calls = classify_pending(texts[start:start + BATCH_SIZE])
+        api_calls += calls
+        save_labels(labeled, store, logger)
+    print(f"共呼叫 API {api_calls} 次")
+
+
+def label_batch(texts, store, logger, client, model=MODEL):
+    """把所有未標註的唯一句子送進 Batch API，一次收回結果"""
+    keys = write_batch_requests(texts)
+    print(f"📦 已寫出 {len(keys)} 筆批次請求 → {BATCH_REQUEST_FILE}")
+    job = client.submit(BATCH_REQUEST_FILE)
+    print(f"🚀 已送出批次工作：{job}")
+    save_labels(collect_batch_results(client.wait(job), keys), store, logger, model)
+
+
+def export_labeled(data, store, path=OUTPUT_FILE, model=MODEL):
+    """把標籤庫的結果合併回原始資料（只查表，不呼叫 API）"""
+    missing = 0
+    for item in data:
+        text = item["text"]
+        if is_blocked(text)["blocked"]:
+            item["tones"] = []
+            continue
+        tones = store.lookup(text, PROMPT_VERSION, model, TAGS)
+        if tones is None:
+            missing += 1
+        item["tones"] = tones or []
+
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"💾 已輸出 {len(data)} 筆 → {path}（{missing} 筆尚未標註）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MyGO 台詞語氣標註")
+    parser.add_argument("--mode", choices=["online", "batch", "export"], default="online",
+                        help="online：即時呼叫；batch：透過 Gemini Batch API 離線標註；export：只從標籤庫輸出")
+    parser.add_argument("--backend", choices=["gemini", "local"], default="gemini",
+                        help="batch 模式的端點；local 為本機替身，測試用（標籤庫與輸出檔另存為 *.local.*）")
+    parser.add_argument("--relabel", action="store_true",
+                        help="TAGS 新增標籤後，重新標註以舊標籤集合標註的句子")
+    args = parser.parse_args()
+    if args.backend == "local" and args.mode == "online":
+        parser.error("--backend local 只適用於 batch / export 模式")
+
+    if args.backend == "local":
+        model, store_file, output_file, log_file = LOCAL_MODEL, LOCAL_LABEL_STORE_FILE, LOCAL_OUTPUT_FILE, LOCAL_LOG_FILE
+    else:
+        model, store_file, output_file, log_file = MODEL, LABEL_STORE_FILE, OUTPUT_FILE, LOG_FILE
+
+    logger = BufferedLogWriter(log_file)
+    store = LabelStore(store_file).load()
+    atexit.register(store.close)
+    if args.backend == "gemini":
+        import_checkpoints(store)
+
+    # 讀進原始資料
+    with open(INPUT_FILE, "r", encoding="utf8") as f:
+        data = json.load(f)
+
+    if args.mode != "export":
+        # 標籤庫已有的句子不會重打 API（可中斷續跑）
+        texts = unlabeled_texts(data, store, logger, model, args.relabel)
+        print(f"prompt 版本 {PROMPT_VERSION}：{len(texts)} 句需要標註")
+
+        if not texts:
+            pass
+        elif args.mode == "batch":
+            client = GeminiBatchClient(api_key, MODEL) if args.backend == "gemini" else LocalBatchClient()
+            label_batch(texts, store, logger, client, model)
+        else:
+            label_online(texts, store, logger)
+
+    store.close()
+    logger.close()
+
+    # 結束後由標籤庫合併出完整結果
+    export_labeled(data, store, output_file, model)
+
+    print("🚀 全部完成！")
+
+
+if __name__ == "__main__":
+    main()
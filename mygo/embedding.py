@@ -1,7 +1,14 @@
-from google.generativeai import embed_content
 import faiss
 import numpy as np
 import json
+import os
+import sys
+
+# 將專案根目錄加入 Python 路徑，讓 mygo 內的腳本可以引用共用模組
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from AI_response.gemini_client import embed
 
 EMB_MODEL = "text-embedding-004"
 
@@ -10,7 +17,7 @@ with open("mygo_labeled.json", "r", encoding="utf8") as f:
 
 embs = []
 for d in data:
-    emb = embed_content(model=EMB_MODEL, content=d["text"])["embedding"]
+    emb = embed(d["text"], call_site="embedding.build_index", model=EMB_MODEL)
     embs.append(emb)
 
 emb_matrix = np.array(embs).astype("float32")
@@ -0,0 +1,174 @@
+"""
+Gemini Batch API 的最小用戶端（REST），以及測試用的本機替身。
+
+兩者介面相同：
+    job = client.submit("requests.jsonl")   # 上傳並建立批次工作
+    results = client.wait(job)              # 等待完成，回傳每一行結果 dict
+
+請求檔每行格式：
+    {"key": "...", "request": {"contents": [{"parts": [{"text": "..."}]}]}}
+結果每行格式：
+    {"key": "...", "response": {"candidates": [...]}} 或 {"key": "...", "error": {...}}
+"""
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import requests
+
+API_ROOT = "https://generativelanguage.googleapis.com"
+
+DONE_STATES = {
+    "BATCH_STATE_SUCCEEDED",
+    "BATCH_STATE_FAILED",
+    "BATCH_STATE_CANCELLED",
+    "BATCH_STATE_EXPIRED",
+}
+
+
+def make_request_line(key: str, prompt: str) -> str:
+    """產生批次請求檔的一行"""
+    return json.dumps(
+        {"key": key, "request": {"contents": [{"parts": [{"text": prompt}]}]}},
+        ensure_ascii=False,
+    )
+
+
+def response_text(result: dict) -> str:
+    """從一行批次結果取出模型輸出文字；失敗時回傳空字串"""
+    try:
+        parts = result["response"]["candidates"][0]["content"]["parts"]
+        return "".join(p.get("text", "") for p in parts)
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+class GeminiBatchClient:
+    """透過 REST 呼叫 Gemini Batch API"""
+
+    def __init__(self, api_key: str, model: str, poll_seconds: int = 30, timeout: int = 60):
+        self.api_key = api_key
+        self.model = model
+        self.poll_seconds = poll_seconds
+        self.timeout = timeout
+
+    def _headers(self, **extra):
+        return {"x-goog-api-key": self.api_key, **extra}
+
+    def upload(self, path: str) -> str:
+        """以 resumable upload 上傳 JSONL，回傳 files/... 名稱"""
+        size = os.path.getsize(path)
+        start = requests.post(
+            f"{API_ROOT}/upload/v1beta/files",
+            headers=self._headers(**{
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(size),
+                "X-Goog-Upload-Header-Content-Type": "application/jsonl",
+            }),
+            json={"file": {"display_name": os.path.basename(path)}},
+            timeout=self.timeout,
+        )
+        start.raise_for_status()
+        upload_url = start.headers["x-goog-upload-url"]
+
+        with open(path, "rb") as f:
+            resp = requests.post(
+                upload_url,
+                headers={
+                    "Content-Length": str(size),
+                    "X-Goog-Upload-Offset": "0",
+                    "X-Goog-Upload-Command": "upload, finalize",
+                },
+                data=f,
+                timeout=self.timeout,
+            )
+        resp.raise_for_status()
+        return resp.json()["file"]["name"]
+
+    def submit(self, path: str, display_name: str = "mygo-labeling") -> str:
+        """上傳請求檔並建立批次工作，回傳 batches/... 名稱"""
+        file_name = self.upload(path)
+        resp = requests.post(
+            f"{API_ROOT}/v1beta/models/{self.model}:batchGenerateContent",
+            headers=self._headers(),
+            json={"batch": {
+                "display_name": display_name,
+                "input_config": {"file_name": file_name},
+            }},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return resp.json()["name"]
+
+    def wait(self, job: str) -> list:
+        """輪詢直到工作結束，下載並回傳結果"""
+        while True:
+            resp = requests.get(f"{API_ROOT}/v1beta/{job}", headers=self._headers(), timeout=self.timeout)
+            resp.raise_for_status()
+            op = resp.json()
+            state = op.get("metadata", {}).get("state", "")
+            print(f"⏳ 批次工作 {job}：{state}")
+            if state in DONE_STATES:
+                break
+            time.sleep(self.poll_seconds)
+
+        if state != "BATCH_STATE_SUCCEEDED":
+            raise RuntimeError(f"批次工作失敗：{state} {op.get('error', '')}")
+
+        responses_file = op["response"]["responsesFile"]
+        resp = requests.get(
+            f"{API_ROOT}/download/v1beta/{responses_file}:download",
+            params={"alt": "media"},
+            headers=self._headers(),
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return [json.loads(line) for line in resp.text.splitlines() if line.strip()]
+
+
+def _neutral_responder(prompt: str) -> str:
+    return '["中性"]'
+
+
+class LocalBatchClient:
+    """
+    Batch API 的本機替身，測試用。
+    submit() 立刻在本機處理整個請求檔，每個 prompt 交給 responder(prompt) 產生文字；
+    responder 丟出例外時，該行結果會是 error。
+    """
+
+    def __init__(self, responder=_neutral_responder, output_dir: str = tempfile.gettempdir()):
+        self.responder = responder
+        self.output_dir = output_dir
+        self.jobs = {}
+
+    def submit(self, path: str, display_name: str = "mygo-labeling") -> str:
+        job = f"batches/local-{uuid.uuid4().hex[:8]}"
+        results = []
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                req = json.loads(line)
+                prompt = "".join(p.get("text", "") for p in req["request"]["contents"][0]["parts"])
+                try:
+                    text = self.responder(prompt)
+                    results.append({"key": req["key"], "response": {
+                        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]
+                    }})
+                except Exception as e:
+                    results.append({"key": req["key"], "error": {"message": str(e)}})
+
+        out_path = os.path.join(self.output_dir, f"{job.split('/')[-1]}_responses.jsonl")
+        with open(out_path, "w", encoding="utf8") as f:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        self.jobs[job] = out_path
+        return job
+
+    def wait(self, job: str) -> list:
+        with open(self.jobs[job], "r", encoding="utf8") as f:
+            return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,112 @@
+"""
+以內容雜湊定址、帶版本的語氣標籤庫（append-only JSONL）。
+
+每筆標籤以 (句子 sha1, prompt 版本, 模型) 為鍵，另外記錄當時使用的標籤集合版本。
+標籤集合 (TAGS) 改變時，只有用到已刪除標籤的句子需要重新標註；
+新增標籤後要讓舊句子也有機會標上新標籤時，以 exact_tagset=True 查詢（classify_data --relabel）。
+prompt 或模型改變時，該版本沒有標籤的句子才會重新標註。
+
+檔案格式：
+    {"tagset": "ab12…", "tags": ["開心", ...]}                       標籤集合
+    {"hash": "…", "prompt": "…", "model": "…", "tagset": "…", "tones": [...]}  標籤
+"""
+import hashlib
+import json
+import os
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+
+def version_of(*parts) -> str:
+    """把 prompt 範本、標籤清單等內容雜湊成短版本號"""
+    joined = "\x1f".join(json.dumps(p, ensure_ascii=False) for p in parts)
+    return hashlib.sha1(joined.encode("utf8")).hexdigest()[:12]
+
+
+class LabelStore:
+    def __init__(self, path: str, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self.labels = {}    # (hash, prompt, model) → (tagset, tones)
+        self.tagsets = {}   # tagset 版本 → 標籤列表
+        self.file = None
+        self.unflushed = 0
+
+    def load(self):
+        try:
+            # 以 bytes 讀取：寫到一半的行可能斷在多位元組字元中間
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 中斷時寫到一半的行，後面的紀錄照常讀取
+                    if "tags" in entry:
+                        self.tagsets[entry["tagset"]] = entry["tags"]
+                    else:
+                        key = (entry["hash"], entry["prompt"], entry["model"])
+                        self.labels[key] = (entry["tagset"], entry["tones"])
+        except FileNotFoundError:
+            pass
+        return self
+
+    def lookup(self, text: str, prompt: str, model: str, tags, exact_tagset: bool = False):
+        """
+        回傳目前版本仍然有效的標籤，需要（重新）標註時回傳 None。
+        標籤集合只有新增標籤時，舊標籤仍視為有效；用到已刪除標籤時才失效。
+        exact_tagset=True 時，不是以目前標籤集合標註的一律視為需要重標。
+        """
+        found = self.labels.get((text_hash(text), prompt, model))
+        if found is None:
+            return None
+        tagset, tones = found
+        if tagset == version_of(tags):
+            return tones
+        if exact_tagset:
+            return None
+        allowed = set(tags)
+        if all(t in allowed for t in tones):
+            return tones
+        return None
+
+    def _open(self):
+        torn = False
+        try:
+            with open(self.path, "rb") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+        except FileNotFoundError:
+            pass
+        self.file = open(self.path, "a", encoding="utf8")
+        if torn:
+            self.file.write("\n")  # 上次中斷時最後一行沒寫完，新紀錄從新的一行開始，不接在壞掉的行後面
+
+    def _write(self, entry):
+        if self.file is None:
+            self._open()
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def put(self, text: str, prompt: str, model: str, tags, tones):
+        tagset = version_of(tags)
+        if tagset not in self.tagsets:
+            self.tagsets[tagset] = list(tags)
+            self._write({"tagset": tagset, "tags": list(tags)})
+        self.labels[(text_hash(text), prompt, model)] = (tagset, tones)
+        self._write({"hash": text_hash(text), "prompt": prompt, "model": model,
+                     "tagset": tagset, "tones": tones})
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+        self.unflushed = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,9 +1,15 @@
-import google.generativeai as genai
 import faiss
 import numpy as np
 import json
+import os
+import sys
 
-genai.configure(api_key="你的_Gemini_API_KEY")
+# 將專案根目錄加入 Python 路徑，讓 mygo 內的腳本可以引用共用模組
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from AI_response.gemini_client import generate, embed as gemini_embed
+from classify_data import TAGS
 
 # 載入資料
 with open("mygo_labeled.json", "r", encoding="utf8") as f:
@@ -24,13 +30,13 @@ def detect_tone(text):
 請只輸出 JSON array，例如：
 ["好奇","輕鬆"]
 """
-    resp = genai.GenerativeModel(MODEL).generate_content(prompt)
+    resp = generate(prompt, call_site="query.detect_tone", model=MODEL)
     return json.loads(resp.text)
 
 
 def embed(text):
     return np.array(
-        genai.embed_content(model=EMB_MODEL, content=text)["embedding"],
+        gemini_embed(text, call_site="query.embed", model=EMB_MODEL),
         dtype="float32"
     )
 
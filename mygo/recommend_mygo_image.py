@@ -1,14 +1,8 @@
 import json
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
 import requests
 import re
-load_dotenv()
-# 初始化 Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-model = genai.GenerativeModel("gemini-2.5-flash")
+from AI_response.gemini_client import generate
 
 TAGS = [
     "開心","興奮","好奇","困惑","傷心","難過","生氣","不耐煩","緊張","害羞","臉紅",
@@ -76,7 +70,7 @@ JSON 格式：
 """
 
     try:
-        response = model.generate_content(prompt)
+        response = generate(prompt, call_site="recommend.analyze_tone")
         return response.text or ""
     except Exception as e:
         print(f"⚠️ Gemini 呼叫失敗：{e}")
@@ -160,7 +154,7 @@ def select_mygo_reply(user_text, candidates):
 }}
 """
 
-    response = model.generate_content(prompt)
+    response = generate(prompt, call_site="recommend.select_mygo_reply")
     data = safe_json_loads(response.text)
     return data.get("selected_text", "")
 
@@ -1,12 +1,11 @@
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
+import sys
 
-load_dotenv()
-# 初始化 Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# 將專案根目錄加入 Python 路徑，讓 mygo 內的腳本可以引用共用模組
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
 
-model = genai.GenerativeModel("gemini-2.5-flash")
+from AI_response.gemini_client import generate
 
 TAGS = [
     "開心","興奮","好奇","困惑","傷心","難過","生氣","不耐煩","緊張","害羞","臉紅",
@@ -46,5 +45,5 @@ JSON 格式：
 }}
 """
 
-    response = model.generate_content(prompt)
+    response = generate(prompt, call_site="sentiment.analyze_tone")
     return response.text
@@ -0,0 +1,100 @@
+"""classify_data：標籤庫、匯出與 --backend local 的隔離（不呼叫 Gemini）"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))   # classify_data 以同目錄 import gemini_batch / label_store
+
+import classify_data
+from label_store import LabelStore
+
+DATA = [{"text": "你好"}, {"text": "你好"}, {"text": "祥子"}, {"text": "為什麼要演奏春日影"}]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """classify_data 以相對路徑讀寫 mygo/ 與 log.csv：在暫存目錄執行"""
+    (tmp_path / "mygo").mkdir()
+    (tmp_path / "mygo" / "mygo_new_data.json").write_text(json.dumps(DATA, ensure_ascii=False), encoding="utf8")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["classify_data.py", *args])
+    classify_data.main()
+
+
+def read_json(path):
+    with open(path, encoding="utf8") as f:
+        return json.load(f)
+
+
+def test_local_backend_keeps_fake_labels_out_of_the_real_store(workdir, monkeypatch):
+    run(monkeypatch, "--mode", "batch", "--backend", "local")
+
+    assert not os.path.exists(classify_data.LABEL_STORE_FILE)
+    assert not os.path.exists(classify_data.OUTPUT_FILE)
+    assert not os.path.exists(classify_data.LOG_FILE)
+    store = LabelStore(classify_data.LOCAL_LABEL_STORE_FILE).load()
+    version, tags = classify_data.PROMPT_VERSION, classify_data.TAGS
+    assert store.lookup("你好", version, classify_data.LOCAL_MODEL, tags) == ["中性"]
+    assert store.lookup("你好", version, classify_data.MODEL, tags) is None
+    assert [item["tones"] for item in read_json(classify_data.LOCAL_OUTPUT_FILE)] == [["中性"], ["中性"], [], ["中性"]]
+
+    # 正式匯出只看正式模型的標籤
+    run(monkeypatch, "--mode", "export")
+    assert [item["tones"] for item in read_json(classify_data.OUTPUT_FILE)] == [[], [], [], []]
+
+
+def test_local_backend_rejects_online_mode(workdir, monkeypatch):
+    with pytest.raises(SystemExit):
+        run(monkeypatch, "--mode", "online", "--backend", "local")
+
+
+def test_relabel_picks_up_texts_labeled_before_a_tag_was_added(tmp_path, monkeypatch):
+    store = LabelStore(str(tmp_path / "labels.jsonl")).load()
+    logger = classify_data.BufferedLogWriter(str(tmp_path / "log.csv"))
+    for text in ("你好", "為什麼要演奏春日影"):
+        store.put(text, classify_data.PROMPT_VERSION, classify_data.MODEL, classify_data.TAGS, ["中性"])
+    monkeypatch.setattr(classify_data, "TAGS", classify_data.TAGS + ["懷念"])
+
+    assert classify_data.unlabeled_texts(DATA, store, logger) == []
+    assert classify_data.unlabeled_texts(DATA, store, logger, relabel=True) == ["你好", "為什麼要演奏春日影"]
+
+
+def test_blocked_texts_are_logged_once_across_runs(tmp_path):
+    store = LabelStore(str(tmp_path / "labels.jsonl")).load()
+    data = DATA + [{"text": "祥子"}, {"text": "http://example.com"}]
+    for _ in range(2):   # 兩次執行
+        logger = classify_data.BufferedLogWriter(str(tmp_path / "log.csv"))
+        assert classify_data.unlabeled_texts(data, store, logger) == ["你好", "為什麼要演奏春日影"]
+        logger.close()
+
+    with open(tmp_path / "log.csv", encoding="utf8") as f:
+        rows = f.read().splitlines()
+    assert [row.split(",")[1:4] for row in rows[1:]] == [["祥子", "True", "祥子"], ["http://example.com", "True", "網址"]]
+
+
+def test_checkpoints_are_imported_once(workdir):
+    with open(classify_data.LEGACY_CHECKPOINT_FILE, "w", encoding="utf8") as f:
+        json.dump({"index": 2, "cache": {"你好": ["開心"], "為什麼要演奏春日影": []}}, f, ensure_ascii=False)
+    with open(classify_data.CHECKPOINT_FILE, "w", encoding="utf8") as f:
+        f.write(json.dumps({"text": "你好", "tones": ["開心", "輕鬆"]}, ensure_ascii=False) + "\n")
+        f.write(json.dumps({"index": 1}) + "\n")
+        f.write(json.dumps({"text": "壞掉", "tones": ["不存在的標籤"]}, ensure_ascii=False) + "\n")
+        f.write('{"text": "寫到一半')
+
+    store = LabelStore(classify_data.LABEL_STORE_FILE).load()
+    assert classify_data.import_checkpoints(store) == 1
+    store.close()
+    assert not os.path.exists(classify_data.CHECKPOINT_FILE)
+    assert os.path.exists(f"{classify_data.CHECKPOINT_FILE}.imported")
+
+    reloaded = LabelStore(classify_data.LABEL_STORE_FILE).load()
+    version, model, tags = classify_data.PROMPT_VERSION, classify_data.MODEL, classify_data.TAGS
+    assert reloaded.lookup("你好", version, model, tags) == ["開心", "輕鬆"]
+    assert reloaded.lookup("為什麼要演奏春日影", version, model, tags) is None   # 舊版失敗存的空列表要重標
+    assert classify_data.import_checkpoints(reloaded) == 0
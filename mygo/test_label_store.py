@@ -0,0 +1,75 @@
+"""label_store：標籤依 prompt 版本、模型與標籤集合失效"""
+from mygo.label_store import LabelStore, text_hash, version_of
+
+TAGS = ["開心", "傷心", "中性"]
+
+
+def make_store(tmp_path):
+    return LabelStore(str(tmp_path / "labels.jsonl"), flush_every=1).load()
+
+
+def test_lookup_is_keyed_by_prompt_and_model(tmp_path):
+    store = make_store(tmp_path)
+    store.put("你好", "p1", "m1", TAGS, ["開心"])
+    assert store.lookup("你好", "p1", "m1", TAGS) == ["開心"]
+    assert store.lookup("你好", "p2", "m1", TAGS) is None
+    assert store.lookup("你好", "p1", "m2", TAGS) is None
+    assert store.lookup("再見", "p1", "m1", TAGS) is None
+
+
+def test_added_tag_keeps_labels_unless_exact(tmp_path):
+    store = make_store(tmp_path)
+    store.put("你好", "p1", "m1", TAGS, ["開心"])
+    tags = TAGS + ["興奮"]
+    assert store.lookup("你好", "p1", "m1", tags) == ["開心"]
+    assert store.lookup("你好", "p1", "m1", tags, exact_tagset=True) is None
+    store.put("你好", "p1", "m1", tags, ["開心", "興奮"])
+    assert store.lookup("你好", "p1", "m1", tags, exact_tagset=True) == ["開心", "興奮"]
+
+
+def test_removed_tag_invalidates_labels_using_it(tmp_path):
+    store = make_store(tmp_path)
+    store.put("你好", "p1", "m1", TAGS, ["開心"])
+    store.put("嗚嗚", "p1", "m1", TAGS, ["傷心"])
+    tags = ["開心", "中性"]
+    assert store.lookup("你好", "p1", "m1", tags) == ["開心"]
+    assert store.lookup("嗚嗚", "p1", "m1", tags) is None
+
+
+def test_reload_replays_latest_entry_and_ignores_torn_line(tmp_path):
+    store = make_store(tmp_path)
+    store.put("你好", "p1", "m1", TAGS, ["開心"])
+    store.put("你好", "p1", "m1", TAGS, ["中性"])
+    store.close()
+    with open(store.path, "a", encoding="utf8") as f:
+        f.write('{"hash": "' + text_hash("再見"))   # 中斷時寫到一半
+
+    reloaded = LabelStore(store.path, flush_every=1).load()
+    assert reloaded.lookup("你好", "p1", "m1", TAGS) == ["中性"]
+    assert reloaded.lookup("再見", "p1", "m1", TAGS) is None
+    assert reloaded.tagsets == {version_of(TAGS): TAGS}
+
+    # 之後寫入的標籤不會接在壞掉的行後面而跟著遺失
+    reloaded.put("y", "p1", "m1", TAGS, ["開心"])
+    reloaded.put("z", "p1", "m1", TAGS, ["傷心"])
+    reloaded.close()
+    again = LabelStore(store.path).load()
+    assert again.lookup("y", "p1", "m1", TAGS) == ["開心"]
+    assert again.lookup("z", "p1", "m1", TAGS) == ["傷心"]
+    assert again.lookup("你好", "p1", "m1", TAGS) == ["中性"]
+
+
+def test_torn_multibyte_line_in_the_middle_is_skipped(tmp_path):
+    path = tmp_path / "labels.jsonl"
+    good = LabelStore(str(path), flush_every=1).load()
+    good.put("你好", "p1", "m1", TAGS, ["開心"])
+    good.close()
+    with open(path, "ab") as f:
+        f.write('{"hash": "再'.encode("utf8")[:-1] + b"\n")   # 斷在中文字中間
+    later = LabelStore(str(path), flush_every=1).load()
+    later.put("再見", "p1", "m1", TAGS, ["傷心"])
+    later.close()
+
+    reloaded = LabelStore(str(path)).load()
+    assert reloaded.lookup("你好", "p1", "m1", TAGS) == ["開心"]
+    assert reloaded.lookup("再見", "p1", "m1", TAGS) == ["傷心"]
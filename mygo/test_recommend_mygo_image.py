@@ -1,14 +1,9 @@
 import json
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
 import requests
 import re
-load_dotenv()
-# 初始化 Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-model = genai.GenerativeModel("gemini-2.5-flash")
+from AI_response.gemini_client import generate, generate_async
+from common.singleflight import singleflight, async_singleflight, digest
 
 TAGS = [
     "開心","興奮","好奇","困惑","傷心","難過","生氣","不耐煩","緊張","害羞","臉紅",
@@ -41,10 +36,44 @@ def safe_json_loads(text: str) -> dict:
 
     return json.loads(text)
 
+
+EMPTY_TONE = {
+    "emotion": "",
+    "tone": "",
+    "intent": "",
+    "confidence": 0.0
+}
+
+
+@singleflight(lambda text: digest(text))
 def analyze_tone(text: str) -> dict:
+    try:
+        response = generate(tone_prompt(text), call_site="analyze_tone")
+        print("RAW:", repr(response.text))
+        return safe_json_loads(response.text)
+
+    except Exception as e:
+        print(f"⚠️ Gemini 呼叫失敗：{e}")
+        return dict(EMPTY_TONE)
+
+
+@async_singleflight(lambda text: digest(text))
+async def analyze_tone_async(text: str) -> dict:
+    """analyze_tone 的 asyncio 版本"""
+    try:
+        response = await generate_async(tone_prompt(text), call_site="analyze_tone")
+        print("RAW:", repr(response.text))
+        return safe_json_loads(response.text)
+
+    except Exception as e:
+        print(f"⚠️ Gemini 呼叫失敗：{e}")
+        return dict(EMPTY_TONE)
+
+
+def tone_prompt(text: str) -> str:
     tag_list = "、".join(TAGS)
 
-    prompt = f"""
+    return f"""
 你是一個「聊天語氣分類器」，不是自由生成模型。
 
 請從【指定標籤清單】中，選出最符合該句話的：
@@ -72,20 +101,6 @@ JSON 格式：
   "confidence": 0.0
 }}
 """
-
-    try:
-        response = model.generate_content(prompt)
-        print("RAW:", repr(response.text))
-        return safe_json_loads(response.text)
-
-    except Exception as e:
-        print(f"⚠️ Gemini 呼叫失敗：{e}")
-        return {
-            "emotion": "",
-            "tone": "",
-            "intent": "",
-            "confidence": 0.0
-        }
 # === 查詢函式 ===
 def find_image_by_text(text, download=False):
     results = [item for item in data if item.get("text") == text]
@@ -130,7 +145,16 @@ def build_candidates(mygo_data, user_text: str):
     2. 只挑 tone 有對應的 MyGO text
     """
 
-    tone_result = analyze_tone(user_text)
+    return filter_candidates(mygo_data, analyze_tone(user_text))
+
+
+async def build_candidates_async(mygo_data, user_text: str):
+    """build_candidates 的 asyncio 版本"""
+    return filter_candidates(mygo_data, await analyze_tone_async(user_text))
+
+
+def filter_candidates(mygo_data, tone_result: dict):
+    """只挑 tone 與使用者語氣相同的 MyGO text，配對不到時全部回傳"""
     user_tone = tone_result.get("tone", "")
 
     if not user_tone:
@@ -161,13 +185,28 @@ def build_candidates(mygo_data, user_text: str):
 
 
 
+@singleflight(lambda user_text, candidates: digest(user_text, *(c["text"] for c in candidates)))
 def select_mygo_reply(user_text, candidates):
+    response = generate(select_prompt(user_text, candidates), call_site="select_mygo_reply")
+    data = safe_json_loads(response.text)
+    return data.get("selected_text", "")
+
+
+@async_singleflight(lambda user_text, candidates: digest(user_text, *(c["text"] for c in candidates)))
+async def select_mygo_reply_async(user_text, candidates):
+    """select_mygo_reply 的 asyncio 版本"""
+    response = await generate_async(select_prompt(user_text, candidates), call_site="select_mygo_reply")
+    data = safe_json_loads(response.text)
+    return data.get("selected_text", "")
+
+
+def select_prompt(user_text, candidates):
     candidate_block = "\n".join(
         f"{i+1}. {c['text']}{','.join(c['tones'])}"
         for i, c in enumerate(candidates)
     )
 
-    prompt = f"""
+    return f"""
 你是一個聊天回覆選擇器。
 
 使用者訊息：
@@ -191,10 +230,6 @@ def select_mygo_reply(user_text, candidates):
 }}
 """
 
-    response = model.generate_content(prompt)
-    data = safe_json_loads(response.text)
-    return data.get("selected_text", "")
-
 def recommend_mygo_image(user_text,download=False):
     candidates = build_candidates(data, user_text)
 
@@ -210,6 +245,17 @@ def recommend_mygo_image(user_text,download=False):
     return images
 
 
+async def recommend_mygo_image_async(user_text):
+    """recommend_mygo_image 的 asyncio 版本（不下載圖片，只回傳網址）"""
+    candidates = await build_candidates_async(data, user_text)
+
+    selected_text = await select_mygo_reply_async(user_text, candidates)
+
+    if not selected_text:
+        return None
+    return find_image_by_text(selected_text) or None
+
+
 def main():
     text="哈哈笑死可憐"
     recommend_mygo_image(text,download=True)
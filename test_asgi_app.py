@@ -0,0 +1,60 @@
+"""asgi_app.callback：同一使用者的事件依序處理，不同使用者同時處理"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import asgi_app
+
+
+def text_event(event_id, user_id, text):
+    return {
+        "type": "message", "timestamp": 1700000000000, "mode": "active",
+        "source": {"type": "user", "userId": user_id},
+        "replyToken": f"reply-{event_id}", "webhookEventId": event_id,
+        "deliveryContext": {"isRedelivery": False},
+        "message": {"type": "text", "id": f"m-{event_id}", "text": text, "quoteToken": "q"},
+    }
+
+
+def post(*events):
+    body = json.dumps({"destination": "Ubot", "events": list(events)})
+    secret = asgi_app.config.CHANNEL_SECRET.encode()
+    signature = base64.b64encode(hmac.new(secret, body.encode(), hashlib.sha256).digest()).decode()
+    return asyncio.run(asgi_app.callback(body, signature))
+
+
+@pytest.fixture
+def log(monkeypatch):
+    """以記錄開始 / 結束的假 dispatch 取代真正的處理；文字 "slow" 較慢、"boom" 失敗"""
+    log = []
+
+    async def dispatch(event):
+        text = event.message.text
+        log.append(("start", text))
+        await asyncio.sleep(0.05 if text.startswith("slow") else 0)
+        if text == "boom":
+            raise RuntimeError(text)
+        log.append(("end", text))
+
+    monkeypatch.setattr(asgi_app, "dispatch", dispatch)
+    return log
+
+
+def test_events_from_one_user_run_in_order(log):
+    status = post(text_event("e1", "Ua", "slow-mode"), text_event("e2", "Ub", "other"),
+                  text_event("e3", "Ua", "開始分析"))
+    assert status == 200
+    assert log.index(("end", "slow-mode")) < log.index(("start", "開始分析"))
+    assert log.index(("end", "other")) < log.index(("end", "slow-mode"))   # 其他使用者不必等
+
+
+def test_failure_stops_only_that_users_later_events(log):
+    status = post(text_event("e1", "Ua", "boom"), text_event("e2", "Ub", "slow-other"),
+                  text_event("e3", "Ua", "開始分析"))
+    assert status == 500
+    assert ("start", "開始分析") not in log
+    assert ("end", "slow-other") in log